@@ -0,0 +1,343 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+import metrics
+import coordination
+from database import engine, SQLITE_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+# Online snapshots of the SQLite database, taken on their own sqlite3 connection.
+# "vacuum" (the default) runs VACUUM INTO: a single read transaction that writes a compacted
+# copy, and in WAL mode writers never wait for readers. "pages" uses the online backup API,
+# BACKUP_PAGES pages per step with BACKUP_SLEEP between steps. In WAL mode it copies from one
+# read snapshot; in rollback journal mode each step takes the read lock only briefly, but a write
+# from another connection restarts the copy, so it gives up after BACKUP_MAX_RESTARTS.
+# The integrity check, row counts, compression and checksum all run on the copy, never on
+# the live file.
+METHODS = ("vacuum", "pages")
+BACKUP_PAGES = 1024
+BACKUP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 5
+COMPRESS_LEVEL = 1
+# Niceness of the thread doing the CPU-bound work (copy, integrity check, gzip, checksum), so
+# the API keeps the CPU. A separate thread, because lowering priority cannot be undone unprivileged.
+WORKER_NICE = 10
+CHUNK_SIZE = 1 << 20
+
+# Counted into each manifest and compared again by verify()
+COUNTED_TABLES = ("subnets", "devices", "ip_addresses", "ip_ranges", "ip_events", "settings")
+
+LEASE = "backup"
+NAME_PATTERN = re.compile(r"^ipam-\d{8}T\d{9}Z\.db(\.gz)?$")
+
+def database_path():
+    if engine.dialect.name != "sqlite" or not engine.url.database or engine.url.database == ":memory:":
+        raise ValueError("Backups need an SQLite database file")
+    return engine.url.database
+
+def backup_dir():
+    return os.getenv("BACKUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(database_path())), "backups")
+
+def _connect(path: str):
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+def _snapshot(source: str, target: str, method: str):
+    """
+    Copies the live database at source into the new file target. Returns backup API steps (0 for vacuum).
+    """
+    src = _connect(source)
+    try:
+        if method == "vacuum":
+            src.execute("VACUUM INTO ?", (target,))
+            return 0
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # Keep one read transaction open across the steps: each step then copies from the same
+            # snapshot, writers carry on in the WAL and the backup never restarts
+            src.execute("BEGIN")
+            src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        dst = sqlite3.connect(target)
+        steps = [0]
+        state = {"remaining": None, "restarts": 0}
+        def progress(status, remaining, total):
+            steps[0] += 1
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+                if state["restarts"] > BACKUP_MAX_RESTARTS:
+                    raise ValueError(f"The backup restarted {state['restarts']} times under concurrent writes; use the vacuum method")
+            state["remaining"] = remaining
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, progress=progress)
+        finally:
+            dst.close()
+        return steps[0]
+    finally:
+        src.close()
+
+def _inspect(path: str, check: str = "integrity_check"):
+    """
+    Check result, schema revision and row counts of an uncompressed snapshot. check is
+    integrity_check or quick_check (no index to table cross-checks, several times faster).
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        integrity = "; ".join(row[0] for row in conn.execute(f"PRAGMA {check}"))
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        revision = conn.execute("SELECT version_num FROM alembic_version").fetchone()[0] if "alembic_version" in tables else None
+        counts = {table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in COUNTED_TABLES if table in tables}
+    finally:
+        conn.close()
+    return integrity, revision, counts
+
+def _sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _compress(source: str, target: str):
+    with open(source, "rb") as src, gzip.open(target, "wb", compresslevel=COMPRESS_LEVEL) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+def _decompress(source: str, target: str):
+    with gzip.open(source, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+def _in_background(fn, *args):
+    """
+    Runs fn(*args) in a new thread with WORKER_NICE (Linux threads have their own nice value) and returns its result.
+    """
+    outcome = {}
+    def work():
+        try:
+            if hasattr(os, "setpriority"):
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICE)
+            outcome["result"] = fn(*args)
+        except BaseException as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=work, name="backup", daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def _manifest_path(name: str):
+    return os.path.join(backup_dir(), name + ".json")
+
+def _write_manifest(manifest: dict):
+    path = _manifest_path(manifest["name"])
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def list_backups():
+    """
+    Manifests of the stored snapshots, newest first.
+    """
+    directory = backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if filename.endswith(".json") and NAME_PATTERN.match(filename[:-5]) and os.path.exists(os.path.join(directory, filename[:-5])):
+            with open(os.path.join(directory, filename)) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+def get_backup(name: str):
+    if not NAME_PATTERN.match(name) or not os.path.exists(_manifest_path(name)):
+        return None
+    with open(_manifest_path(name)) as f:
+        return json.load(f)
+
+def backup_file(name: str):
+    return os.path.join(backup_dir(), name)
+
+def create(method: str = "vacuum", compress: bool = True, keep: int = None):
+    """
+    Takes a snapshot, checks it, optionally gzips it and writes its manifest next to it,
+    then rotates down to keep snapshots. Raises ValueError when another process is backing up.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown backup method {method}")
+    source = database_path()
+    directory = backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    if not coordination.acquire(LEASE):
+        raise ValueError("A backup is already running in another process")
+
+    now = datetime.now(timezone.utc)
+    name = f"ipam-{now:%Y%m%dT%H%M%S}{now.microsecond // 1000:03d}Z.db" + (".gz" if compress else "")
+    # Work files stay in the backup directory so the final rename is atomic
+    work = tempfile.mkdtemp(prefix=".work-", dir=directory)
+    try:
+        snapshot = os.path.join(work, "snapshot.db")
+        with metrics.Timer() as copy:
+            steps = _in_background(_snapshot, source, snapshot, method)
+        with metrics.Timer() as check:
+            # The full integrity check is left to verify()
+            integrity, revision, counts = _in_background(_inspect, snapshot, "quick_check")
+        if integrity != "ok":
+            raise RuntimeError(f"Snapshot failed its integrity check: {integrity}")
+        with metrics.Timer() as pack:
+            final = snapshot
+            if compress:
+                final = snapshot + ".gz"
+                _in_background(_compress, snapshot, final)
+            sha256 = _in_background(_sha256, final)
+
+        manifest = {
+            "name": name,
+            "created_at": now.isoformat(),
+            "method": method,
+            "compressed": compress,
+            "database_bytes": os.path.getsize(source),
+            "snapshot_bytes": os.path.getsize(snapshot),
+            "size_bytes": os.path.getsize(final),
+            "sha256": sha256,
+            "alembic_revision": revision,
+            "tables": counts,
+            "integrity": integrity,
+            "backup_steps": steps,
+            "snapshot_seconds": round(copy.elapsed, 3),
+            "check_seconds": round(check.elapsed, 3),
+            "compress_seconds": round(pack.elapsed, 3),
+        }
+        os.replace(final, backup_file(name))
+        _write_manifest(manifest)
+    except Exception:
+        metrics.backups.labels("failed").inc()
+        raise
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+        coordination.release(LEASE)
+
+    metrics.backups.labels("created").inc()
+    metrics.backup_last_seconds.set(copy.elapsed + check.elapsed + pack.elapsed)
+    metrics.backup_last_size.set(manifest["size_bytes"])
+    logger.info(f"Backup {name}: {manifest['database_bytes'] / 1048576:.1f} MB database to {manifest['size_bytes'] / 1048576:.1f} MB "
+                f"({method} {copy.elapsed:.1f}s, check {check.elapsed:.1f}s, compress {pack.elapsed:.1f}s)")
+    if keep:
+        rotate(keep)
+    return manifest
+
+def rotate(keep: int):
+    """
+    Deletes all but the newest keep snapshots. Returns the names deleted.
+    """
+    removed = []
+    for manifest in list_backups()[keep:]:
+        for path in (backup_file(manifest["name"]), _manifest_path(manifest["name"])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        removed.append(manifest["name"])
+    if removed:
+        logger.info(f"Rotated out {len(removed)} backups: {', '.join(removed)}")
+    return removed
+
+def _restore_copy(name: str, target: str):
+    if name.endswith(".gz"):
+        _decompress(backup_file(name), target)
+    else:
+        shutil.copyfile(backup_file(name), target)
+
+def verify(name: str):
+    """
+    Restores a snapshot into a scratch file and checks it: checksum, integrity check, schema
+    revision and row counts must match its manifest. Returns {"name", "ok", "errors", "seconds"}.
+    """
+    manifest = get_backup(name)
+    if manifest is None:
+        raise ValueError(f"Unknown backup {name}")
+    errors = []
+    with metrics.Timer() as timer:
+        if _sha256(backup_file(name)) != manifest["sha256"]:
+            errors.append("checksum mismatch")
+        else:
+            with tempfile.TemporaryDirectory(prefix=".verify-", dir=backup_dir()) as work:
+                restored = os.path.join(work, "restored.db")
+                _restore_copy(name, restored)
+                integrity, revision, counts = _inspect(restored)
+                if integrity != "ok":
+                    errors.append(f"integrity check: {integrity}")
+                if revision != manifest["alembic_revision"]:
+                    errors.append(f"schema revision {revision}, expected {manifest['alembic_revision']}")
+                for table, count in manifest["tables"].items():
+                    if counts.get(table) != count:
+                        errors.append(f"{table} has {counts.get(table)} rows, expected {count}")
+    metrics.backups.labels("verified" if not errors else "verify_failed").inc()
+    return {"name": name, "ok": not errors, "errors": errors, "seconds": round(timer.elapsed, 3)}
+
+def restore(name: str, target: str = None):
+    """
+    Replaces the database file with a verified snapshot. The API and the Brain must be
+    stopped: open connections would keep writing to the replaced file.
+    """
+    result = verify(name)
+    if not result["ok"]:
+        raise ValueError(f"Backup {name} failed verification: {'; '.join(result['errors'])}")
+    target = target or database_path()
+    staging = target + ".restore"
+    _restore_copy(name, staging)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    os.replace(staging, target)
+    logger.info(f"Restored {name} to {target}")
+    return result
+
+def run_scheduled(settings: dict, now: datetime = None):
+    """
+    Takes a backup when backup_interval_hours have passed since the newest one. Returns its manifest, or None.
+    """
+    interval = settings.get("backup_interval_hours", 0)
+    if not interval:
+        return None
+    latest = list_backups()[:1]
+    now = now or datetime.now(timezone.utc)
+    if latest and now - datetime.fromisoformat(latest[0]["created_at"]) < timedelta(hours=interval):
+        return None
+    return create(settings.get("backup_method", "vacuum"), settings.get("backup_compress", True), settings.get("backup_keep", 7))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online database backups")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_parser = commands.add_parser("create", help="take a snapshot now")
+    create_parser.add_argument("--method", choices=METHODS, default="vacuum")
+    create_parser.add_argument("--no-compress", action="store_true")
+    create_parser.add_argument("--keep", type=int, help="rotate down to this many snapshots afterwards")
+    commands.add_parser("list", help="list stored snapshots")
+    verify_parser = commands.add_parser("verify", help="restore a snapshot to a scratch file and check it")
+    verify_parser.add_argument("name")
+    restore_parser = commands.add_parser("restore", help="replace the database with a snapshot (stop the API first)")
+    restore_parser.add_argument("name")
+    restore_parser.add_argument("--target", help="database file to write (default: DATABASE_URL's)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "create":
+        result = create(args.method, not args.no_compress, args.keep)
+    elif args.command == "list":
+        result = list_backups()
+    elif args.command == "verify":
+        result = verify(args.name)
+    else:
+        result = restore(args.name, args.target)
+    print(json.dumps(result, indent=2))
+    if args.command == "verify" and not result["ok"]:
+        raise SystemExit(1)
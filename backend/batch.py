@@ -0,0 +1,453 @@
+import hashlib
+import ipaddress
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from pydantic import ValidationError
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models
+import schemas
+import oui
+import tags
+import ingest
+import ranges
+import cache
+
+logger = logging.getLogger(__name__)
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+
+IP = "ip"
+DEVICE = "device"
+RANGE = "range"
+
+# Applied responses are replayed for retries within this window, then purged
+IDEMPOTENCY_TTL = timedelta(hours=24)
+
+_SCHEMAS = {
+    (IP, CREATE): schemas.IPAddressCreate,
+    (IP, UPDATE): schemas.IPAddressUpdate,
+    (DEVICE, CREATE): schemas.DeviceCreate,
+    (DEVICE, UPDATE): schemas.DeviceUpdate,
+    (RANGE, CREATE): schemas.IPRangeCreate,
+    (RANGE, UPDATE): schemas.IPRangeUpdate,
+}
+_MODELS = {IP: models.IPAddress, DEVICE: models.Device, RANGE: models.IPRange}
+_NAMES = {IP: "IP address", DEVICE: "Device", RANGE: "IP Range"}
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), ingest.QUERY_CHUNK_SIZE):
+        yield values[i:i + ingest.QUERY_CHUNK_SIZE]
+
+def _validation_error(e: ValidationError):
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc']) or 'data'}: {error['msg']}" for error in e.errors())
+
+def _valid_address(value: str):
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+class _Batch:
+    """
+    One POST /batch request. Every operation is checked against the current state first,
+    with chunked IN queries per type rather than a query per operation, and nothing is
+    written if any of them fails. The writes are then grouped into executemany statements
+    in a fixed order: deletes, creates, updates, device tags, then device IP assignments.
+    """
+
+    def __init__(self, db: Session, operations):
+        self.db = db
+        self.operations = operations
+        self.results = [
+            {"index": i, "op": o.op, "type": o.type, "id": o.id, "status": None, "error": None}
+            for i, o in enumerate(operations)
+        ]
+        self.data = [None] * len(operations)
+        self.failed = False
+        self.upserts = {}   # IP create index -> id of the existing record it updates
+        self.links = {}     # address -> index of the device operation assigning it
+
+    def fail(self, index: int, message: str):
+        self.results[index]["status"] = "error"
+        self.results[index]["error"] = message
+        self.failed = True
+
+    def ok(self, index: int):
+        return self.results[index]["status"] is None
+
+    def indexes(self, kind: str, op: str):
+        return [
+            i for i, o in enumerate(self.operations)
+            if o.type == kind and o.op == op and self.ok(i)
+        ]
+
+    def validate(self):
+        db = self.db
+        targets = {}
+        for index, operation in enumerate(self.operations):
+            if operation.op == CREATE:
+                if operation.id is not None:
+                    self.fail(index, "id is assigned by the server on create")
+                    continue
+            elif operation.id is None:
+                self.fail(index, f"id is required for {operation.op}")
+                continue
+            else:
+                first = targets.setdefault((operation.type, operation.id), index)
+                if first != index:
+                    self.fail(index, f"{_NAMES[operation.type]} {operation.id} is already changed by operation {first}")
+                    continue
+            if operation.op != DELETE:
+                try:
+                    self.data[index] = _SCHEMAS[(operation.type, operation.op)].model_validate(operation.data)
+                except ValidationError as e:
+                    self.fail(index, _validation_error(e))
+
+        for kind, model in _MODELS.items():
+            ids = [object_id for target_kind, object_id in targets if target_kind == kind]
+            found = set()
+            for chunk in _chunks(ids):
+                found.update(row.id for row in db.query(model.id).filter(model.id.in_(chunk)))
+            for object_id in ids:
+                index = targets[(kind, object_id)]
+                if self.ok(index) and object_id not in found:
+                    self.fail(index, f"{_NAMES[kind]} {object_id} not found")
+        deleted = {kind: {self.operations[i].id for i in self.indexes(kind, DELETE)} for kind in _MODELS}
+
+        subnet_ids = {subnet.id for subnet in cache.subnets(db)}
+        self.validate_ranges(deleted[RANGE])
+
+        # IP records may only point at devices that exist and survive the batch
+        device_ids = {
+            self.data[i].device_id for i in self.indexes(IP, CREATE) + self.indexes(IP, UPDATE)
+            if self.data[i].device_id is not None
+        }
+        known_devices = set()
+        for chunk in _chunks(device_ids):
+            known_devices.update(row.id for row in db.query(models.Device.id).filter(models.Device.id.in_(chunk)))
+        for index in self.indexes(IP, CREATE) + self.indexes(IP, UPDATE):
+            device_id = self.data[index].device_id
+            if device_id is not None and (device_id not in known_devices or device_id in deleted[DEVICE]):
+                self.fail(index, f"Device {device_id} not found")
+
+        # Creating an address that already has a record updates it, like POST /ips/
+        created = {}
+        for index in self.indexes(IP, CREATE):
+            address = self.data[index].address
+            if not _valid_address(address):
+                self.fail(index, f"Invalid IP address: {address}")
+            elif address in created:
+                self.fail(index, f"{address} is already created by operation {created[address]}")
+            elif self.data[index].subnet_id not in subnet_ids:
+                self.fail(index, f"Subnet {self.data[index].subnet_id} not found")
+            else:
+                created[address] = index
+        existing = self.existing_addresses(created)
+        for address, index in created.items():
+            row = existing.get(address)
+            if row is None or row.id in deleted[IP]:
+                continue
+            if (IP, row.id) in targets:
+                self.fail(index, f"{address} is IP address {row.id}, already changed by operation {targets[(IP, row.id)]}")
+            else:
+                self.upserts[index] = row.id
+
+        for index in self.indexes(DEVICE, CREATE) + self.indexes(DEVICE, UPDATE):
+            address = self.data[index].ip_address
+            if not address:
+                continue
+            if not _valid_address(address):
+                self.fail(index, f"Invalid IP address: {address}")
+            elif address in self.links:
+                self.fail(index, f"{address} is already assigned by operation {self.links[address]}")
+            else:
+                self.links[address] = index
+        if self.links:
+            existing = self.existing_addresses(self.links)
+            subnets = cache.subnet_index(db)
+            for address, index in list(self.links.items()):
+                row = existing.get(address)
+                if row is not None and row.id in deleted[IP]:
+                    self.fail(index, f"{address} is deleted by operation {targets[(IP, row.id)]}")
+                elif row is None and address not in created and subnets.match(address) is None:
+                    self.fail(index, f"Could not assign {address}. Ensure it belongs to a known subnet.")
+                else:
+                    continue
+                del self.links[address]
+
+    def validate_ranges(self, deleted: set):
+        """
+        Checks created and moved ranges against their subnet, then sweeps the resulting ranges
+        of every affected subnet (stored ones minus deleted and moved, plus the batch's) for
+        overlaps in one pass, rather than one overlap query per operation.
+        """
+        db = self.db
+        networks = {}
+        for subnet in cache.subnets(db):
+            try:
+                networks[subnet.id] = ipaddress.ip_network(f"{subnet.network_address}/{subnet.prefix_length}", strict=False)
+            except ValueError:
+                continue
+
+        changed = {}
+        for index in self.indexes(RANGE, CREATE):
+            data = self.data[index]
+            changed[index] = (data.subnet_id, data.start_ip, data.end_ip)
+        updates = {
+            self.operations[i].id: i for i in self.indexes(RANGE, UPDATE)
+            if "start_ip" in self.data[i].model_fields_set or "end_ip" in self.data[i].model_fields_set
+        }
+        for chunk in _chunks(updates):
+            for row in db.query(models.IPRange).filter(models.IPRange.id.in_(chunk)):
+                data = self.data[updates[row.id]]
+                # An explicit null is validated (and rejected) like PUT /ranges/{id}, not replaced by the stored bound
+                start_ip = data.start_ip if "start_ip" in data.model_fields_set else row.start_ip
+                end_ip = data.end_ip if "end_ip" in data.model_fields_set else row.end_ip
+                changed[updates[row.id]] = (row.subnet_id, start_ip, end_ip)
+
+        intervals = {}
+        for index, (subnet_id, start_ip, end_ip) in changed.items():
+            if subnet_id not in networks:
+                self.fail(index, f"Subnet {subnet_id} not found")
+                continue
+            try:
+                start, end = ranges.bounds(networks[subnet_id], start_ip, end_ip)
+            except ValueError as e:
+                self.fail(index, str(e))
+                continue
+            intervals.setdefault(subnet_id, []).append((start, end, index))
+        if not intervals:
+            return
+
+        stored = {}
+        defined = cache.ranges(db)
+        for subnet_id in intervals:
+            for row in defined.get(subnet_id, ((), ()))[1]:
+                stored[row.id] = row
+                if row.id not in deleted and row.id not in updates:
+                    intervals[subnet_id].append((row.start_int, row.end_int, -row.id))
+        for subnet_intervals in intervals.values():
+            for earlier, later in ranges.overlaps(subnet_intervals):
+                # Keys are operation indexes, or negated ids of stored ranges
+                index, other = (later, earlier) if later >= 0 else (earlier, later)
+                if index < 0 or not self.ok(index):
+                    continue
+                if other >= 0:
+                    self.fail(index, f"Range overlaps the range of operation {other}")
+                else:
+                    row = stored[-other]
+                    self.fail(index, f"Range overlaps {row.name} ({row.start_ip} - {row.end_ip})")
+
+    def existing_addresses(self, addresses):
+        rows = {}
+        for chunk in _chunks(addresses):
+            for row in self.db.query(
+                models.IPAddress.id, models.IPAddress.address, models.IPAddress.device_id, models.IPAddress.vendor
+            ).filter(models.IPAddress.address.in_(chunk)):
+                rows[row.address] = row
+        return rows
+
+    def done(self, index: int, status: str, object_id: int = None):
+        self.results[index]["status"] = status
+        if object_id is not None:
+            self.results[index]["id"] = object_id
+
+    def execute(self):
+        db = self.db
+
+        # Deletes. Bulk deletes skip ORM cascades, so dependent rows are handled here
+        ip_ids = [self.operations[i].id for i in self.indexes(IP, DELETE)]
+        for chunk in _chunks(ip_ids):
+            db.query(models.IPEvent).filter(models.IPEvent.ip_id.in_(chunk)).delete(synchronize_session=False)
+            db.query(models.IPService).filter(models.IPService.ip_id.in_(chunk)).delete(synchronize_session=False)
+            db.query(models.IPAddress).filter(models.IPAddress.id.in_(chunk)).delete(synchronize_session=False)
+        device_ids = [self.operations[i].id for i in self.indexes(DEVICE, DELETE)]
+        for chunk in _chunks(device_ids):
+            # A deleted device's IPs stay, unassigned
+            db.query(models.IPAddress).filter(models.IPAddress.device_id.in_(chunk)).update(
+                {"device_id": None}, synchronize_session=False
+            )
+            db.execute(models.device_tags.delete().where(models.device_tags.c.device_id.in_(chunk)))
+            db.query(models.Device).filter(models.Device.id.in_(chunk)).delete(synchronize_session=False)
+        range_ids = [self.operations[i].id for i in self.indexes(RANGE, DELETE)]
+        for chunk in _chunks(range_ids):
+            db.query(models.IPRange).filter(models.IPRange.id.in_(chunk)).delete(synchronize_session=False)
+        for kind in _MODELS:
+            for index in self.indexes(kind, DELETE):
+                self.done(index, "deleted")
+
+        # Creates
+        device_tags = {}
+        indexes = self.indexes(DEVICE, CREATE)
+        ids = self.insert(models.Device, [self.data[i].model_dump(exclude={"ip_address"}) for i in indexes])
+        for index, device_id in zip(indexes, ids):
+            self.done(index, "created", device_id)
+            if self.data[index].tags:
+                device_tags[device_id] = self.data[index].tags
+
+        updates = {kind: [] for kind in _MODELS}
+        indexes = [i for i in self.indexes(IP, CREATE) if i not in self.upserts]
+        rows = []
+        for index in indexes:
+            row = self.data[index].model_dump()
+            row["vendor"] = oui.lookup(row["mac_address"])
+            rows.append(row)
+        for index, ip_id in zip(indexes, self.insert(models.IPAddress, rows)):
+            self.done(index, "created", ip_id)
+        for index, ip_id in self.upserts.items():
+            updates[IP].append((index, ip_id, self.data[index].model_dump(exclude_unset=True)))
+
+        indexes = self.indexes(RANGE, CREATE)
+        for index, range_id in zip(indexes, self.insert(models.IPRange, [self.data[i].model_dump() for i in indexes])):
+            self.done(index, "created", range_id)
+
+        # Updates, one executemany per set of changed columns
+        for kind in _MODELS:
+            for index in self.indexes(kind, UPDATE):
+                updates[kind].append((index, self.operations[index].id, self.data[index].model_dump(exclude_unset=True)))
+        for kind, model in _MODELS.items():
+            groups = {}
+            for index, object_id, changes in updates[kind]:
+                self.done(index, "updated", object_id)
+                changes.pop("ip_address", None)
+                if kind == IP and "mac_address" in changes:
+                    changes["vendor"] = oui.lookup(changes["mac_address"])
+                if kind == DEVICE and "tags" in changes:
+                    device_tags[object_id] = changes["tags"]
+                # Range bounds were validated; the stored integer bounds follow them
+                if kind == RANGE and "start_ip" in changes:
+                    changes["start_int"] = models.ipv4_int(changes["start_ip"])
+                if kind == RANGE and "end_ip" in changes:
+                    changes["end_int"] = models.ipv4_int(changes["end_ip"])
+                if changes:
+                    changes["id"] = object_id
+                    groups.setdefault(tuple(sorted(changes)), []).append(changes)
+            for rows in groups.values():
+                db.execute(update(model), rows)
+
+        if any(operation.type == RANGE for operation in self.operations):
+            cache.bump(db, cache.RANGES)
+        if device_tags:
+            tags.sync_device_tags(db, device_tags)
+        if self.links:
+            self.assign({address: self.results[index]["id"] for address, index in self.links.items()})
+
+    def insert(self, model, rows):
+        if not rows:
+            return []
+        return self.db.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows).scalars().all()
+
+    def assign(self, links: dict):
+        """
+        Set-based link_ip_to_device: existing records are allocated to the device and lend it
+        their vendor as manufacturer, unknown addresses are created in their subnet.
+        """
+        db = self.db
+        existing = self.existing_addresses(links)
+        subnets = None
+        allocations = []
+        new_records = []
+        vendors = {}
+        for address, device_id in links.items():
+            row = existing.get(address)
+            if row is None:
+                subnets = subnets or cache.subnet_index(db)
+                new_records.append({
+                    "address": address,
+                    "status": models.IPStatus.ALLOCATED,
+                    "subnet_id": subnets.match(address),
+                    "device_id": device_id,
+                })
+            elif row.device_id != device_id:
+                allocations.append({"id": row.id, "device_id": device_id, "status": models.IPStatus.ALLOCATED})
+                if row.vendor:
+                    vendors.setdefault(device_id, row.vendor)
+        if allocations:
+            db.execute(update(models.IPAddress), allocations)
+        self.insert(models.IPAddress, new_records)
+
+        manufacturers = []
+        for chunk in _chunks(vendors):
+            for row in db.query(models.Device.id, models.Device.manufacturer).filter(models.Device.id.in_(chunk)):
+                if not row.manufacturer:
+                    manufacturers.append({"id": row.id, "manufacturer": vendors[row.id]})
+        if manufacturers:
+            db.execute(update(models.Device), manufacturers)
+
+    def response(self, applied: bool):
+        counts = {"created": 0, "updated": 0, "deleted": 0, "errors": 0}
+        for result in self.results:
+            if result["status"] is None:
+                result["status"] = "skipped"
+            elif result["status"] == "error":
+                counts["errors"] += 1
+            else:
+                counts[result["status"]] += 1
+        return {"applied": applied, "replayed": False, **counts, "results": self.results}
+
+def _digest(operations):
+    payload = json.dumps([o.model_dump() for o in operations], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _replay(db: Session, key: str, digest: str, now: datetime):
+    stored = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key == key, models.IdempotencyKey.created_at >= now - IDEMPOTENCY_TTL
+    ).first()
+    if stored is None:
+        return None
+    if stored.request_hash != digest:
+        raise ValueError(f"Idempotency key {key} was already used for a different batch")
+    response = json.loads(stored.response)
+    response["replayed"] = True
+    return response
+
+def run(db: Session, operations, idempotency_key: str = None):
+    """
+    Applies create/update/delete operations on IPs, devices and ranges in one transaction and
+    returns the response body with one result per operation. If any operation is invalid
+    nothing is written and applied is false.
+
+    With an idempotency key, the response of an applied batch is stored with the key and
+    replayed for retries within IDEMPOTENCY_TTL, so a retry after a lost response does not
+    apply the operations twice. Raises ValueError when the key was used for other operations
+    or the batch lost a race with a concurrent write.
+    """
+    now = datetime.now(timezone.utc)
+    digest = _digest(operations) if idempotency_key else None
+    if idempotency_key:
+        stored = _replay(db, idempotency_key, digest, now)
+        if stored is not None:
+            return stored
+
+    batch = _Batch(db, operations)
+    batch.validate()
+    if batch.failed:
+        db.rollback()
+        return batch.response(applied=False)
+    try:
+        batch.execute()
+        response = batch.response(applied=True)
+        if idempotency_key:
+            db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.created_at < now - IDEMPOTENCY_TTL
+            ).delete(synchronize_session=False)
+            db.add(models.IdempotencyKey(
+                key=idempotency_key, request_hash=digest, response=json.dumps(response), created_at=now
+            ))
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # A concurrent retry with the same key committed first
+        stored = _replay(db, idempotency_key, digest, now) if idempotency_key else None
+        if stored is not None:
+            return stored
+        raise ValueError(f"Batch conflicts with a concurrent change, nothing was applied: {e.orig}")
+    logger.info(f"Batch applied: {response['created']} created, {response['updated']} updated, {response['deleted']} deleted")
+    return response
@@ -0,0 +1,285 @@
+"""
+Benchmarks API latency while an online backup runs.
+
+    python benchmarks/bench_backup.py                                    # 1 GB fixture, vacuum and pages backups
+    python benchmarks/bench_backup.py --size-mb 200 --methods vacuum -o before.json
+    python benchmarks/bench_backup.py --db /tmp/backup.db -o after.json  # reuse (or create) a fixture file
+    python benchmarks/bench_backup.py --compare before.json after.json   # exits 1 on regressions
+
+The fixture is a synthetic inventory whose ip_events table is padded until the file
+reaches --size-mb. A uvicorn process (API_ONLY, so no Brain) serves it while --clients
+threads read subnets and IPs and update device notes in a loop. Latency is recorded for
+a baseline phase and then for the duration of each POST /backups, per method; the JSON
+report has p50/p99/max for reads and writes per phase and the backup's own timings.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+import models
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Padding rows for ip_events, committed per chunk until the file is large enough
+PAD_CHUNK = 100000
+PAD_VALUE_BYTES = 160
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def build_fixture(path: str, size_mb: int, seed: int):
+    fixture = fixtures.build_inventory(path, 500, 50000, 10000, seed)
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    events = models.IPEvent.__table__
+    engine = fixtures.make_engine(path)
+    padded = 0
+    while os.path.getsize(path) < size_mb * 1048576:
+        with engine.begin() as conn:
+            conn.execute(events.insert(), [
+                {
+                    "ip_id": rng.randint(1, fixture["ips"]),
+                    "event_type": models.EventType.STATUS_CHANGED,
+                    "old_value": "Offline",
+                    "new_value": rng.randbytes(PAD_VALUE_BYTES // 2).hex(),
+                    "timestamp": now - timedelta(seconds=padded + i),
+                }
+                for i in range(PAD_CHUNK)
+            ])
+        padded += PAD_CHUNK
+    engine.dispose()
+    fixture["events"] = padded
+    fixture["size_mb"] = round(os.path.getsize(path) / 1048576, 1)
+    return fixture
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_api(path: str, backup_dir: str):
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=BACKEND, API_ONLY="1", DATABASE_URL=f"sqlite:///{path}", BACKUP_DIR=backup_dir)
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("The API did not start")
+
+class Load:
+    """
+    Client threads issuing reads (GET /subnets/{id}, GET /ips/{id}) and writes
+    (PUT /devices/{id}) back to back. Each sample is (start, seconds, kind, ok).
+    """
+    def __init__(self, port: int, fixture: dict, clients: int, write_share: float, seed: int):
+        self.port = port
+        self.fixture = fixture
+        self.write_share = write_share
+        self.samples = []
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(seed + i,), daemon=True) for i in range(clients)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, seed: int):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        samples = []
+        while not self._stop.is_set():
+            if rng.random() < self.write_share:
+                kind = "write"
+                body = json.dumps({"notes": f"bench {rng.random()}"})
+                method, url = "PUT", f"/devices/{rng.randint(1, self.fixture['devices'])}"
+            elif rng.random() < 0.5:
+                kind, method, url, body = "read", "GET", f"/subnets/{rng.randint(1, self.fixture['subnets'])}", None
+            else:
+                kind, method, url, body = "read", "GET", f"/ips/{rng.randint(1, self.fixture['ips'])}", None
+            start = time.monotonic()
+            try:
+                conn.request(method, url, body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except OSError:
+                conn.close()
+                ok = False
+            samples.append((start, time.monotonic() - start, kind, ok))
+        self.samples.extend(samples)
+
+def summarize(samples, start: float, end: float):
+    result = {"seconds": round(end - start, 2)}
+    for kind in ("read", "write"):
+        window = [s for s in samples if start <= s[0] < end and s[2] == kind]
+        times = sorted(s[1] for s in window)
+        result[kind] = {
+            "requests": len(window),
+            "errors": sum(1 for s in window if not s[3]),
+            "p50_ms": round(_percentile(times, 50) * 1000, 2) if times else None,
+            "p99_ms": round(_percentile(times, 99) * 1000, 2) if times else None,
+            "max_ms": round(times[-1] * 1000, 2) if times else None,
+        }
+    return result
+
+def _backup(port: int, method: str, compress: bool):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=3600)
+    conn.request("POST", f"/backups?method={method}&compress={str(compress).lower()}")
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+def run_suite(args):
+    tmpdir = tempfile.mkdtemp(prefix="ipam-bench-")
+    path = args.db or os.path.join(tmpdir, "backup.db")
+    try:
+        fixture_meta = path + ".json"
+        if os.path.exists(path) and os.path.exists(fixture_meta):
+            with open(fixture_meta) as f:
+                fixture = json.load(f)
+            print(f"Reusing fixture {path}: {fixture}", file=sys.stderr)
+        else:
+            print(f"Building a {args.size_mb} MB fixture...", file=sys.stderr)
+            start = time.perf_counter()
+            fixture = build_fixture(path, args.size_mb, args.seed)
+            fixture["build_seconds"] = round(time.perf_counter() - start, 2)
+            if args.db:
+                with open(fixture_meta, "w") as f:
+                    json.dump(fixture, f)
+
+        proc, port = start_api(path, os.path.join(tmpdir, "backups"))
+        try:
+            load = Load(port, fixture, args.clients, args.write_share, args.seed)
+            load.start()
+            # Warm up, then measure the baseline and one backup per method, with a pause between them
+            time.sleep(2)
+            phases = []
+            start = time.monotonic()
+            time.sleep(args.baseline)
+            phases.append(("baseline", start, time.monotonic(), None))
+            for method in args.methods:
+                print(f"Backing up with {method}...", file=sys.stderr)
+                start = time.monotonic()
+                status, body = _backup(port, method, not args.no_compress)
+                phases.append((method, start, time.monotonic(), (status, body)))
+                time.sleep(2)
+            load.stop()
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        results = {}
+        for name, start, end, backup in phases:
+            results[name] = summarize(load.samples, start, end)
+            if backup is not None:
+                status, body = backup
+                results[name]["backup"] = {"status": status, **({
+                    key: body[key] for key in ("size_bytes", "snapshot_bytes", "backup_steps", "snapshot_seconds",
+                                               "check_seconds", "compress_seconds")
+                } if status == 200 else {"detail": body.get("detail")})}
+        return {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "fixture": fixture,
+                "clients": args.clients,
+                "write_share": args.write_share,
+                "compress": not args.no_compress,
+            },
+            "results": results,
+        }
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def compare(base: dict, new: dict, threshold: float):
+    """
+    Compares read and write p99 per phase. A phase regresses when a p99 grows by more than
+    threshold (a fraction) or a backup that succeeded in the base fails in the new report.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        before = base["results"].get(name)
+        after = new["results"].get(name)
+        if before is None or after is None:
+            rows.append({"phase": name, "status": "missing in " + ("base" if before is None else "new")})
+            continue
+        row = {"phase": name}
+        for kind in ("read", "write"):
+            old, cur = before[kind]["p99_ms"], after[kind]["p99_ms"]
+            if old is None or cur is None:
+                continue
+            change = (cur - old) / old if old else 0.0
+            row[f"{kind}_p99_ms"] = {"base": old, "new": cur, "change_pct": round(change * 100, 1)}
+            if change > threshold:
+                regressions.append(f"{name} {kind} p99 +{change * 100:.1f}%")
+        if before.get("backup", {}).get("status") == 200 and after.get("backup", {}).get("status") != 200:
+            regressions.append(f"{name} backup failed with {after['backup']['status']}")
+        rows.append(row)
+    return {"threshold_pct": threshold * 100, "phases": rows, "regressions": regressions}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--db", help="fixture file to reuse, created if missing")
+    parser.add_argument("--methods", nargs="+", choices=("vacuum", "pages"), default=["vacuum", "pages"])
+    parser.add_argument("--no-compress", action="store_true")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--write-share", type=float, default=0.2, help="fraction of requests that write")
+    parser.add_argument("--baseline", type=float, default=10.0, help="seconds of load measured before the first backup")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two reports")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        report = compare(base, new, args.threshold / 100)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["regressions"] else 0)
+
+    report = run_suite(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
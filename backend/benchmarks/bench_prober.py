@@ -0,0 +1,104 @@
+"""
+Compares the per-packet Python cost of the Scapy discovery path with the raw
+socket prober.
+
+    python benchmarks/bench_prober.py                 # packet build/match only, no privileges needed
+    python benchmarks/bench_prober.py --live 192.168.1.0/24   # also time real sweeps (needs CAP_NET_RAW)
+"""
+import argparse
+import ipaddress
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prober
+
+SRC_MAC = bytes.fromhex("02fc00000001")
+SRC_IP = bytes([192, 168, 0, 2])
+
+def _timed(fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return {"seconds": round(elapsed, 4), "per_packet_us": round(elapsed / count * 1e6, 3)}
+
+def bench_offline(count: int):
+    from scapy.all import Ether, ARP, IP, ICMP
+
+    targets = [str(ipaddress.IPv4Address(0x0A000000 + i)) for i in range(count)]
+    raw_targets = [ipaddress.IPv4Address(t).packed for t in targets]
+    mac = SRC_MAC.hex(":")
+    replies = [
+        bytes(Ether(dst=mac, src="02:00:00:00:00:01") / ARP(op=2, psrc=t, hwsrc="02:00:00:00:00:01", pdst="192.168.0.2"))
+        for t in targets
+    ]
+    wanted = dict(zip(raw_targets, targets))
+
+    def scapy_build_arp():
+        for t in targets:
+            bytes(Ether(dst="ff:ff:ff:ff:ff:ff", src=mac) / ARP(pdst=t, psrc="192.168.0.2", hwsrc=mac))
+
+    def template_build_arp():
+        template = prober.build_arp_template(SRC_MAC, SRC_IP)
+        for raw in raw_targets:
+            template[prober.ARP_TARGET_OFFSET:prober.ARP_TARGET_OFFSET + 4] = raw
+            bytes(template)
+
+    def scapy_build_icmp():
+        for t in targets:
+            bytes(IP(dst=t) / ICMP())
+
+    def template_build_icmp():
+        # The echo request is identical for every target; only the sendto address changes
+        packet = prober.build_icmp_echo(1)
+        for t in targets:
+            (packet, (t, 0))
+
+    def scapy_match_arp():
+        found = {}
+        for frame in replies:
+            packet = Ether(frame)
+            if ARP in packet and packet[ARP].op == 2 and packet[ARP].psrc in targets_set:
+                found[packet[ARP].psrc] = packet[ARP].hwsrc
+
+    def template_match_arp():
+        found = {}
+        for frame in replies:
+            parsed = prober.parse_arp_reply(frame)
+            if parsed and parsed[0] in wanted:
+                found[wanted[parsed[0]]] = parsed[1]
+
+    targets_set = set(targets)
+    return {
+        "arp_build": {"scapy": _timed(scapy_build_arp, count), "template": _timed(template_build_arp, count)},
+        "icmp_build": {"scapy": _timed(scapy_build_icmp, count), "template": _timed(template_build_icmp, count)},
+        "arp_match": {"scapy": _timed(scapy_match_arp, count), "template": _timed(template_match_arp, count)},
+    }
+
+def bench_live(prefix: str, timeout: float):
+    import discovery
+
+    results = {}
+    for name, scan in (("scapy", discovery.scan_subnet), ("raw", lambda p, a, i: prober.scan_subnet(p, a, i, timeout))):
+        start = time.perf_counter()
+        found = scan(prefix, True, True)
+        results[name] = {"seconds": round(time.perf_counter() - start, 3), "hosts": len(found)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=4096, help="packets per offline measurement")
+    parser.add_argument("--live", metavar="PREFIX", help="also sweep this prefix with both backends")
+    parser.add_argument("--timeout", type=float, default=2.0, help="reply timeout for the live raw sweep")
+    args = parser.parse_args()
+
+    report = {"count": args.count, "offline": bench_offline(args.count)}
+    if args.live:
+        report["live"] = bench_live(args.live, args.timeout)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmarks API startup: the time to import the app and the resident memory it costs.
+
+    python benchmarks/bench_startup.py                                   # 10 fresh interpreters per scenario
+    python benchmarks/bench_startup.py --repeat 20 -o before.json
+    python benchmarks/bench_startup.py --compare before.json after.json  # exits 1 on regressions
+
+Each run starts a new interpreter that imports main (and, for the brain scenario, the
+scanning stack the Brain loads on its first cycle) and reports the import time, the
+interpreter's max RSS and whether scapy or dnspython were imported. The api scenario must
+not import them: a change that pulls them back onto the startup path fails --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each scenario imports, and the environment it runs with
+SCENARIOS = {
+    "api": ("import main", {"API_ONLY": "1"}),
+    "brain": ("import main, discovery", {"API_ONLY": ""}),
+}
+
+# Modules that belong to the scanning stack
+HEAVY_MODULES = ("scapy", "dns")
+
+_CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_s": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "heavy": sorted(name for name in {heavy!r} if name in sys.modules),
+}}))
+"""
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def run_scenario(name: str, repeat: int, database_url: str):
+    statement, extra_env = SCENARIOS[name]
+    env = dict(os.environ, PYTHONPATH=BACKEND, DATABASE_URL=database_url, **extra_env)
+    code = _CHILD.format(statement=statement, heavy=HEAVY_MODULES)
+    samples = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{name} failed:\n{proc.stderr}")
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    times = sorted(s["import_s"] for s in samples)
+    rss = sorted(s["max_rss_kb"] for s in samples)
+    return {
+        "runs": repeat,
+        "import_p50_ms": round(_percentile(times, 50) * 1000, 1),
+        "import_max_ms": round(times[-1] * 1000, 1),
+        "rss_p50_mb": round(_percentile(rss, 50) / 1024, 1),
+        "modules": samples[-1]["modules"],
+        "heavy_modules": samples[-1]["heavy"],
+    }
+
+def run_suite(args):
+    with tempfile.TemporaryDirectory(prefix="ipam-bench-") as tmpdir:
+        database_url = f"sqlite:///{os.path.join(tmpdir, 'startup.db')}"
+        results = {}
+        for name in args.only or SCENARIOS:
+            print(f"Running {name} x{args.repeat}...", file=sys.stderr)
+            results[name] = run_scenario(name, args.repeat, database_url)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+def compare(base: dict, new: dict, threshold: float):
+    """
+    Compares import time and RSS per scenario. A scenario regresses when a metric grows by
+    more than threshold (a fraction) or it imports scanning modules the base did not.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        before = base["results"].get(name)
+        after = new["results"].get(name)
+        if before is None or after is None:
+            rows.append({"scenario": name, "status": "missing in " + ("base" if before is None else "new")})
+            continue
+        row = {"scenario": name}
+        for metric in ("import_p50_ms", "rss_p50_mb"):
+            old, cur = before.get(metric), after.get(metric)
+            if old is None or cur is None:
+                continue
+            change = (cur - old) / old if old else 0.0
+            row[metric] = {"base": old, "new": cur, "change_pct": round(change * 100, 1)}
+            if change > threshold:
+                regressions.append(f"{name} {metric} +{change * 100:.1f}%")
+        added = sorted(set(after.get("heavy_modules", [])) - set(before.get("heavy_modules", [])))
+        if added:
+            row["heavy_modules_added"] = added
+            regressions.append(f"{name} now imports {', '.join(added)}")
+        rows.append(row)
+    return {"threshold_pct": threshold * 100, "scenarios": rows, "regressions": regressions}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS))
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two reports")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        report = compare(base, new, args.threshold / 100)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["regressions"] else 0)
+
+    report = run_suite(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Benchmarks the main API and Brain code paths against a synthetic inventory.
+
+    python benchmarks/bench_suite.py                                   # 5k subnets / 500k IPs / 100k devices
+    python benchmarks/bench_suite.py --subnets 500 --ips 50000 --devices 10000 -o before.json
+    python benchmarks/bench_suite.py --db /tmp/bench.db -o after.json  # reuse (or create) a fixture file
+    python benchmarks/bench_suite.py --compare before.json after.json  # exits 1 on regressions
+
+Each operation is run once with tracemalloc to record its peak allocation, then
+timed --repeat times (heavy operations --heavy-repeat times). Results are JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy
+import crud
+import ingest
+import models
+import schemas
+import fixtures
+
+# Operations whose single run scales with the whole inventory
+HEAVY = {"validate_db", "export"}
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+class Context:
+    """
+    Shared state for the operations: fixture shape, a seeded RNG and counters
+    so repeated writes touch fresh rows.
+    """
+
+    def __init__(self, fixture: dict, seed: int):
+        self.fixture = fixture
+        self.rng = random.Random(seed)
+        self.assigned = 0
+        self.ingested = 0
+
+    def random_subnet(self):
+        return self.rng.randrange(self.fixture["subnets"])
+
+def op_list_subnets(db, ctx):
+    # What GET /subnets/ does: load a page with stats and serialize it
+    subnets = crud.get_subnets(db, skip=ctx.rng.randrange(max(1, ctx.fixture["subnets"] - 100)), limit=100)
+    return [schemas.Subnet.model_validate(s).model_dump() for s in subnets]
+
+def op_next_available(db, ctx):
+    return crud.find_next_available_ip(db, ctx.random_subnet() + 1)
+
+def op_next_available_pool(db, ctx):
+    index = ctx.random_subnet()
+    pool = db.query(models.IPRange.id).filter(models.IPRange.subnet_id == index + 1).first()
+    return crud.find_next_available_ip(db, index + 1, pool_id=pool[0])
+
+def op_validate_db(db, ctx):
+    return crud.validate_db(db)
+
+def op_assign(db, ctx):
+    # Link a fresh address (above the used hosts, below the pool) to an existing device
+    index = ctx.assigned % ctx.fixture["subnets"]
+    free_hosts = max(1, fixtures.MAX_IPS_PER_SUBNET - ctx.fixture["ips_per_subnet"])
+    host = ctx.fixture["ips_per_subnet"] + 1 + (ctx.assigned // ctx.fixture["subnets"]) % free_hosts
+    ctx.assigned += 1
+    device = crud.get_device(db, ctx.rng.randrange(ctx.fixture["devices"]) + 1)
+    return crud.link_ip_to_device(db, device, fixtures.host_address(index, host), "eth0")
+
+def op_ingest_scan(db, ctx):
+    # A /24 scan result: every known host answers, some with a new MAC, plus a few new hosts
+    index = ctx.ingested % ctx.fixture["subnets"]
+    ctx.ingested += 1
+    hosts = min(254, ctx.fixture["ips_per_subnet"] + 10)
+    observations = []
+    for host in range(1, hosts + 1):
+        mac = "02:bb:%02x:%02x:%02x:%02x" % tuple((index * 256 + host).to_bytes(4, "big")) if ctx.rng.random() < 0.05 else None
+        observations.append({"ip": fixtures.host_address(index, host), "mac": mac, "hostname": None, "online": True})
+    snapshot = ingest.load_snapshot(db, [o["ip"] for o in observations])
+    stats = ingest.apply_observations(db, observations, subnet_id=index + 1, snapshot=snapshot)
+    db.commit()
+    return stats
+
+def op_search_devices(db, ctx):
+    # Hostname, MAC and IP prefixes, the way the device search box is used
+    device = ctx.rng.randrange(ctx.fixture["devices"])
+    index = ctx.random_subnet()
+    query = ctx.rng.choice([f"host-{device}", "02:00:%02x" % (device % 256), fixtures.host_address(index, 0)[:-1]])
+    return crud.search_devices(db, query)
+
+def op_filter_by_tag(db, ctx):
+    return crud.get_devices(db, limit=100, tag=ctx.rng.choice(["prod AND NOT lab", "lab OR prod", "NOT prod"]))
+
+def op_export(db, ctx):
+    # No export feature exists yet; this is the cost of serializing every IP the way GET /ips/ does
+    count = 0
+    for ip in db.query(models.IPAddress).yield_per(5000):
+        json.dumps(schemas.IPAddress.model_validate(ip).model_dump(mode="json"))
+        count += 1
+    return count
+
+OPERATIONS = {
+    "list_subnets": op_list_subnets,
+    "next_available": op_next_available,
+    "next_available_pool": op_next_available_pool,
+    "validate_db": op_validate_db,
+    "assign": op_assign,
+    "ingest_scan": op_ingest_scan,
+    "search_devices": op_search_devices,
+    "filter_by_tag": op_filter_by_tag,
+    "export": op_export,
+}
+
+def _ms(value):
+    return round(value * 1000, 3) if value is not None else None
+
+def run_operation(name, func, Session, ctx, repeat: int, measure_memory: bool = True):
+    result = {}
+    if measure_memory:
+        db = Session()
+        try:
+            tracemalloc.start()
+            func(db, ctx)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            db.close()
+        result["peak_alloc_mb"] = round(peak / 1024 / 1024, 2)
+
+    timings = []
+    for _ in range(repeat):
+        # A fresh session per run, like one per request
+        db = Session()
+        try:
+            start = time.perf_counter()
+            func(db, ctx)
+            timings.append(time.perf_counter() - start)
+        finally:
+            db.close()
+
+    timings.sort()
+    result.update({
+        "runs": len(timings),
+        "mean_ms": _ms(sum(timings) / len(timings)) if timings else None,
+        "p50_ms": _ms(_percentile(timings, 50)),
+        "p90_ms": _ms(_percentile(timings, 90)),
+        "p99_ms": _ms(_percentile(timings, 99)),
+        "max_ms": _ms(timings[-1]) if timings else None,
+    })
+    return result
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_suite(args):
+    tmpdir = None
+    path = args.db
+    if path is None:
+        tmpdir = tempfile.mkdtemp(prefix="ipam-bench-")
+        path = os.path.join(tmpdir, "bench.db")
+
+    try:
+        start = time.perf_counter()
+        fixture_meta = path + ".json"
+        if os.path.exists(path) and os.path.exists(fixture_meta):
+            with open(fixture_meta) as f:
+                fixture = json.load(f)
+            print(f"Reusing fixture {path}: {fixture}", file=sys.stderr)
+        else:
+            print(f"Building fixture ({args.subnets} subnets, {args.ips} IPs, {args.devices} devices)...", file=sys.stderr)
+            fixture = fixtures.build_inventory(path, args.subnets, args.ips, args.devices, args.seed)
+            fixture["build_seconds"] = round(time.perf_counter() - start, 2)
+            if args.db:
+                with open(fixture_meta, "w") as f:
+                    json.dump(fixture, f)
+
+        Session = fixtures.session_factory(path)
+        ctx = Context(fixture, args.seed)
+        selected = args.only or [name for name in OPERATIONS if name not in (args.skip or [])]
+        results = {}
+        for name in selected:
+            repeat = args.heavy_repeat if name in HEAVY else args.repeat
+            print(f"Running {name} x{repeat}...", file=sys.stderr)
+            results[name] = run_operation(name, OPERATIONS[name], Session, ctx, repeat, not args.no_memory)
+
+        return {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "git_revision": _git_revision(),
+                "python": platform.python_version(),
+                "sqlalchemy": sqlalchemy.__version__,
+                "platform": platform.platform(),
+                "fixture": fixture,
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            },
+            "results": results,
+        }
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+def compare(base: dict, new: dict, threshold: float):
+    """
+    Compares p50/p99 latency and peak allocation per operation.
+    An operation regresses when a metric grows by more than threshold (a fraction).
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        before = base["results"].get(name)
+        after = new["results"].get(name)
+        if before is None or after is None:
+            rows.append({"operation": name, "status": "missing in " + ("base" if before is None else "new")})
+            continue
+        row = {"operation": name}
+        for metric in ("p50_ms", "p99_ms", "peak_alloc_mb"):
+            old, cur = before.get(metric), after.get(metric)
+            if old is None or cur is None:
+                continue
+            change = (cur - old) / old if old else 0.0
+            row[metric] = {"base": old, "new": cur, "change_pct": round(change * 100, 1)}
+            if change > threshold:
+                regressions.append(f"{name} {metric} +{change * 100:.1f}%")
+        rows.append(row)
+    return {"threshold_pct": threshold * 100, "operations": rows, "regressions": regressions}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subnets", type=int, default=5000)
+    parser.add_argument("--ips", type=int, default=500000)
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--heavy-repeat", type=int, default=3)
+    parser.add_argument("--db", help="fixture file to reuse or create (default: a temporary file)")
+    parser.add_argument("--only", nargs="+", choices=sorted(OPERATIONS))
+    parser.add_argument("--skip", nargs="+", choices=sorted(OPERATIONS))
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two reports")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        report = compare(base, new, args.threshold / 100)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["regressions"] else 0)
+
+    report = run_suite(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
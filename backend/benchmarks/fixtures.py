@@ -0,0 +1,137 @@
+"""
+Synthetic inventories for the benchmark suite, written straight into a SQLite file.
+
+Subnets are consecutive /24s starting at 10.0.0.0. Each subnet gets the same
+number of IP records from .1 upwards (so .1 .. .N are used and the rest is free)
+and a DHCP pool at .200-.250. Devices are attached to a share of the allocated IPs.
+"""
+import ipaddress
+import random
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+import models
+import search
+import tags
+
+BASE_NETWORK = int(ipaddress.IPv4Address("10.0.0.0"))
+INSERT_BATCH_SIZE = 20000
+# Hosts per subnet are capped so .200-.250 stays free for the pool
+MAX_IPS_PER_SUBNET = 199
+
+def subnet_network(index: int) -> int:
+    return BASE_NETWORK + index * 256
+
+def host_address(index: int, host: int) -> str:
+    return str(ipaddress.IPv4Address(subnet_network(index) + host))
+
+def make_engine(path: str):
+    # Same engine options as database.py
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+def _insert(conn, table, rows):
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        conn.execute(insert(table), rows[i:i + INSERT_BATCH_SIZE])
+
+def _insert_tag_links(conn):
+    # Same normalization crud applies on write
+    tag_ids = {}
+    for table, links, owner_column in (
+        (models.Subnet.__table__, models.subnet_tags, "subnet_id"),
+        (models.Device.__table__, models.device_tags, "device_id"),
+    ):
+        rows = []
+        for owner_id, value in conn.execute(table.select().with_only_columns(table.c.id, table.c.tags)):
+            for name in tags.parse_tags(value):
+                if name not in tag_ids:
+                    tag_ids[name] = conn.execute(insert(models.Tag.__table__).values(name=name)).inserted_primary_key[0]
+                rows.append({owner_column: owner_id, "tag_id": tag_ids[name]})
+        _insert(conn, links, rows)
+
+def build_inventory(path: str, subnets: int = 5000, ips: int = 500000, devices: int = 100000, seed: int = 1):
+    """
+    Creates the schema and fills it. Returns a dict describing the fixture.
+    """
+    rng = random.Random(seed)
+    ips_per_subnet = min(MAX_IPS_PER_SUBNET, max(1, ips // max(subnets, 1)))
+    ips = ips_per_subnet * subnets
+    devices = min(devices, ips)
+    now = datetime.now(timezone.utc)
+
+    engine = make_engine(path)
+    models.Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        _insert(conn, models.Subnet.__table__, [
+            {
+                "id": i + 1,
+                "name": f"bench-{i}",
+                "network_address": str(ipaddress.IPv4Address(subnet_network(i))),
+                "prefix_length": 24,
+                "gateway": host_address(i, 1),
+                "vlan_id": i % 4094 + 1,
+                "tags": rng.choice(["prod", "lab", "office", "dmz"]),
+                "scan_status": "Idle",
+            }
+            for i in range(subnets)
+        ])
+        _insert(conn, models.IPRange.__table__, [
+            {
+                "subnet_id": i + 1,
+                "name": f"pool-{i}",
+                "start_ip": host_address(i, 200),
+                "end_ip": host_address(i, 250),
+                "purpose": "DHCP",
+            }
+            for i in range(subnets)
+        ])
+        _insert(conn, models.Device.__table__, [
+            {
+                "id": d + 1,
+                "hostname": f"host-{d}",
+                "manufacturer": rng.choice(["Dell", "HP", "Cisco", "Ubiquiti", None]),
+                "device_type": rng.choice(["server", "switch", "workstation", "printer"]),
+                "tags": rng.choice(["prod", "lab", None]),
+            }
+            for d in range(devices)
+        ])
+
+        # Allocated IPs are spread evenly over the inventory and each one gets a device
+        allocated_every = max(1, ips // devices) if devices else 0
+        rows = []
+        ip_id = 0
+        for i in range(subnets):
+            for host in range(1, ips_per_subnet + 1):
+                ip_id += 1
+                allocated = allocated_every and ip_id % allocated_every == 0 and ip_id // allocated_every <= devices
+                online = rng.random() < 0.7
+                rows.append({
+                    "id": ip_id,
+                    "address": host_address(i, host),
+                    "status": models.IPStatus.ALLOCATED if allocated else models.IPStatus.DISCOVERED,
+                    "hostname": f"h{ip_id}.bench.local" if rng.random() < 0.5 else None,
+                    "mac_address": "02:%02x:%02x:%02x:%02x:%02x" % tuple(ip_id.to_bytes(5, "big")),
+                    "healthcheck_status": "Online" if online else "Offline",
+                    "last_seen": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                    "subnet_id": i + 1,
+                    "device_id": ip_id // allocated_every if allocated else None,
+                })
+                if len(rows) >= INSERT_BATCH_SIZE:
+                    _insert(conn, models.IPAddress.__table__, rows)
+                    rows = []
+        _insert(conn, models.IPAddress.__table__, rows)
+        _insert_tag_links(conn)
+        search.create_index(conn)
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+    return {"subnets": subnets, "ips": ips, "ips_per_subnet": ips_per_subnet, "devices": devices, "seed": seed}
+
+def session_factory(path: str):
+    return sessionmaker(autocommit=False, autoflush=False, bind=make_engine(path))
@@ -0,0 +1,130 @@
+import ipaddress
+import logging
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+import models
+import metrics
+import ingest
+
+logger = logging.getLogger(__name__)
+
+# Read-through snapshots of rarely written tables, shared by the API and the Brain. Each
+# cache has a generation counter in cache_generations, bumped by bump() in the same transaction
+# as the write. A read costs one query of that tiny table; the snapshot is reloaded only when
+# its generation moved, so writes from any process (API, worker, CLI) are seen on the next read.
+SETTINGS = "settings"
+SUBNETS = "subnets"
+RANGES = "ranges"
+
+# Subnet definitions only: scan state and RTT estimates change every scan and are not cached
+SubnetDef = namedtuple("SubnetDef", "id name network_address prefix_length discovery_backend")
+RangeDef = namedtuple("RangeDef", "id subnet_id name start_ip end_ip start_int end_int purpose")
+
+_PENDING = "cache_bumped"
+
+_entries = {}   # key -> (generation, value)
+_lock = threading.Lock()
+
+def bump(db: Session, *names):
+    """
+    Marks caches as changed. Takes effect when the caller commits; until then this
+    session reads around the caches so it never snapshots its own uncommitted writes.
+    """
+    for name in names:
+        result = db.execute(
+            update(models.CacheGeneration)
+            .where(models.CacheGeneration.name == name)
+            .values(generation=models.CacheGeneration.generation + 1)
+        )
+        if result.rowcount == 0:
+            db.execute(insert(models.CacheGeneration).values(name=name, generation=1))
+    db.info.setdefault(_PENDING, set()).update(names)
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _end_transaction(session):
+    session.info.pop(_PENDING, None)
+
+def _generations(db: Session):
+    return dict(db.query(models.CacheGeneration.name, models.CacheGeneration.generation).all())
+
+def get(db: Session, name: str, loader, key: str = None):
+    """
+    Returns the snapshot loader(db) for cache name, reloading it only when the generation
+    changed. key tells apart several snapshots derived from the same tables.
+    Snapshots are shared between threads: callers must not modify them.
+    """
+    key = key or name
+    if name in db.info.get(_PENDING, ()):
+        return loader(db)
+    # Read before loading, so a write racing the load leaves the snapshot marked stale rather than fresh
+    generation = _generations(db).get(name, 0)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is not None and entry[0] == generation:
+        metrics.cache_lookups.labels(key, "hit").inc()
+        return entry[1]
+    value = loader(db)
+    with _lock:
+        _entries[key] = (generation, value)
+    metrics.cache_lookups.labels(key, "reload").inc()
+    return value
+
+def _load_subnets(db: Session):
+    return tuple(
+        SubnetDef(*row) for row in db.query(
+            models.Subnet.id, models.Subnet.name, models.Subnet.network_address,
+            models.Subnet.prefix_length, models.Subnet.discovery_backend,
+        ).order_by(models.Subnet.id)
+    )
+
+def subnets(db: Session):
+    return get(db, SUBNETS, _load_subnets)
+
+def subnet_index(db: Session):
+    """
+    Cached ingest.SubnetIndex over the subnet definitions.
+    """
+    return get(db, SUBNETS, lambda db: ingest.SubnetIndex(
+        (s.id, s.network_address, s.prefix_length) for s in _load_subnets(db)
+    ), key="subnet_index")
+
+def _load_ranges(db: Session):
+    by_subnet = {}
+    for row in db.query(
+        models.IPRange.id, models.IPRange.subnet_id, models.IPRange.name, models.IPRange.start_ip,
+        models.IPRange.end_ip, models.IPRange.start_int, models.IPRange.end_int, models.IPRange.purpose,
+    ):
+        range_def = RangeDef(*row)
+        if range_def.start_int is None or range_def.end_int is None:
+            # IPv6 bounds do not fit SQLite's INTEGER and are stored as NULL; compute them here
+            try:
+                range_def = range_def._replace(start_int=int(ipaddress.ip_address(row.start_ip)),
+                                               end_int=int(ipaddress.ip_address(row.end_ip)))
+            except ValueError:
+                logger.warning(f"Range {row.id} has malformed bounds {row.start_ip} - {row.end_ip}")
+                continue
+        by_subnet.setdefault(row.subnet_id, []).append(range_def)
+    index = {}
+    for subnet_id, defs in by_subnet.items():
+        defs.sort(key=lambda r: (r.start_int, r.end_int))
+        index[subnet_id] = ([r.start_int for r in defs], tuple(defs))
+    return index
+
+def ranges(db: Session):
+    """
+    Range definitions per subnet, ordered by start: {subnet_id: (starts, ranges)}, ready for bisect.
+    IPv6 ranges carry integer bounds here too, although their stored ones are NULL.
+    """
+    return get(db, RANGES, _load_ranges)
+
+def preceding_ranges(db: Session, subnet_id: int, end: int):
+    """
+    Ranges of subnet_id starting at or before end, nearest first.
+    """
+    starts, defs = ranges(db).get(subnet_id, ((), ()))
+    for i in range(bisect_right(starts, end) - 1, -1, -1):
+        yield defs[i]
@@ -0,0 +1,157 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case, delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+import models
+import metrics
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Coordination between the processes sharing one database (uvicorn --workers, replicas).
+# A lease is a row in coordination_leases that its holder renews every RENEW_INTERVAL;
+# taking one is a single conditional UPDATE (or INSERT), so two processes can never both
+# succeed. When a holder dies its lease simply expires and the next taker wins.
+BRAIN = "brain"
+
+LEASE_TTL = 60
+RENEW_INTERVAL = LEASE_TTL / 3
+
+# Unique per process, readable in GET /coordination
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_lock = threading.Lock()
+_held = {} # name -> ttl
+_renewer = None
+
+def subnet_claim(subnet_id: int):
+    return f"subnet:{subnet_id}"
+
+def acquire(name: str, ttl: float = LEASE_TTL):
+    """
+    Takes or renews the lease name for this process. Returns False while another live
+    process holds it. Held leases are renewed in the background until released, so ttl
+    must stay well above RENEW_INTERVAL.
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=ttl)
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(models.CoordinationLease)
+            .where(
+                models.CoordinationLease.name == name,
+                or_(models.CoordinationLease.holder == INSTANCE_ID, models.CoordinationLease.expires_at < now),
+            )
+            .values(
+                holder=INSTANCE_ID,
+                acquired_at=case((models.CoordinationLease.holder == INSTANCE_ID, models.CoordinationLease.acquired_at), else_=now),
+                expires_at=expires_at,
+            )
+        )
+        if result.rowcount == 0:
+            db.execute(insert(models.CoordinationLease).values(
+                name=name, holder=INSTANCE_ID, acquired_at=now, expires_at=expires_at
+            ))
+        db.commit()
+    except IntegrityError:
+        # Held (and not expired) by someone else
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+    with _lock:
+        _held[name] = ttl
+    _ensure_renewer()
+    return True
+
+def release(name: str):
+    with _lock:
+        _held.pop(name, None)
+    db = SessionLocal()
+    try:
+        db.execute(delete(models.CoordinationLease).where(
+            models.CoordinationLease.name == name, models.CoordinationLease.holder == INSTANCE_ID
+        ))
+        db.commit()
+    except Exception as e:
+        # It expires on its own
+        logger.warning(f"Failed to release lease {name}: {e}")
+    finally:
+        db.close()
+
+def holds(name: str):
+    """
+    Whether this process still holds name. A lease lost to expiry (e.g. the database was
+    unreachable for LEASE_TTL) is noticed by the next renewal.
+    """
+    return name in _held
+
+def list_leases(db):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        {
+            "name": lease.name,
+            "holder": lease.holder,
+            "acquired_at": lease.acquired_at,
+            "expires_at": lease.expires_at,
+            "expired": lease.expires_at.replace(tzinfo=None) < now,
+            "mine": lease.holder == INSTANCE_ID,
+        }
+        for lease in db.query(models.CoordinationLease).order_by(models.CoordinationLease.name)
+    ]
+
+def _ensure_renewer():
+    global _renewer
+    with _lock:
+        if _renewer is None:
+            _renewer = threading.Thread(target=_renew_loop, daemon=True)
+            _renewer.start()
+
+def _renew_loop():
+    """
+    Extends every held lease each RENEW_INTERVAL and drops the ones taken over by another
+    process. Exits once nothing is held.
+    """
+    global _renewer
+    while True:
+        time.sleep(RENEW_INTERVAL)
+        with _lock:
+            held = sorted(_held.items())
+            if not held:
+                _renewer = None
+                return
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            lost = []
+            for name, ttl in held:
+                result = db.execute(
+                    update(models.CoordinationLease)
+                    .where(models.CoordinationLease.name == name, models.CoordinationLease.holder == INSTANCE_ID)
+                    .values(expires_at=now + timedelta(seconds=ttl))
+                )
+                if result.rowcount == 0:
+                    lost.append(name)
+            db.commit()
+        except Exception as e:
+            logger.warning(f"Failed to renew leases: {e}")
+            continue
+        finally:
+            db.close()
+        if lost:
+            with _lock:
+                for name in lost:
+                    _held.pop(name, None)
+            logger.warning(f"Lost leases to another process: {', '.join(lost)}")
+
+@metrics.register_collector
+def _collect_metrics():
+    metrics.brain_leader.set(1 if BRAIN in _held else 0)
+    metrics.scan_claims.set(sum(1 for name in list(_held) if name != BRAIN))
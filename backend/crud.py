@@ -1,26 +1,45 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload, load_only
 import models
 import schemas
 import threading
 import ipaddress
-from discovery import scan_subnet_range
+import socket
+import rtt
+import search
+import tags
+import oui
+import identity
+import batch
+import ranges
+import cache
+import runtime
+import retention
 
-def _get_subnet_stats(db_subnet: models.Subnet):
+# Subnet ids per grouped count query, well below SQLite's bound parameter limit
+_STATS_CHUNK = 500
+
+def _subnet_ip_counts(db: Session, subnet_ids):
+    # {subnet_id: [assigned, discovered]} from grouped counts rather than loading every IP row
+    ids = list(subnet_ids)
+    counts = {subnet_id: [0, 0] for subnet_id in ids}
+    discovered = models.IPAddress.status == models.IPStatus.DISCOVERED
+    for i in range(0, len(ids), _STATS_CHUNK):
+        rows = (
+            db.query(models.IPAddress.subnet_id, discovered, func.count())
+            .filter(models.IPAddress.subnet_id.in_(ids[i:i + _STATS_CHUNK]))
+            .group_by(models.IPAddress.subnet_id, discovered)
+        )
+        for subnet_id, is_discovered, count in rows:
+            counts[subnet_id][1 if is_discovered else 0] += count
+    return counts
+
+def _get_subnet_stats(db_subnet: models.Subnet, assigned_count: int, discovered_count: int):
     # Ensure prefix_length is within reasonable bounds for calculation
     safe_prefix = max(0, min(32, db_subnet.prefix_length or 32))
     total_ips = 2 ** (32 - safe_prefix)
-    
-    # Simple count of records in DB for this subnet
-    assigned_count = 0
-    discovered_count = 0
-    
-    for ip in db_subnet.ip_addresses:
-        if ip.status == models.IPStatus.DISCOVERED:
-            discovered_count += 1
-        else:
-            # ALLOCATED, RESERVED, DHCP_POOL are all "assigned" in this context
-            assigned_count += 1
-            
+
+    # ALLOCATED, RESERVED, DHCP_POOL are all "assigned" in this context
     return {
         "total": total_ips,
         "assigned": assigned_count,
@@ -28,28 +47,39 @@ def _get_subnet_stats(db_subnet: models.Subnet):
         "free": max(0, total_ips - assigned_count - discovered_count)
     }
 
+def _attach_stats(db: Session, subnets):
+    counts = _subnet_ip_counts(db, [s.id for s in subnets])
+    for s in subnets:
+        s.stats = _get_subnet_stats(s, *counts[s.id])
+    return subnets
+
 def get_subnet(db: Session, subnet_id: int):
     db_subnet = db.query(models.Subnet).options(
         joinedload(models.Subnet.ip_ranges)
     ).filter(models.Subnet.id == subnet_id).first()
     if db_subnet:
-        db_subnet.stats = _get_subnet_stats(db_subnet)
+        _attach_stats(db, [db_subnet])
     return db_subnet
 
-def get_subnets(db: Session, skip: int = 0, limit: int = 100):
-    subnets = db.query(models.Subnet).options(joinedload(models.Subnet.ip_ranges)).offset(skip).limit(limit).all()
-    for s in subnets:
-        s.stats = _get_subnet_stats(s)
-    return subnets
+def get_subnets(db: Session, skip: int = 0, limit: int = 100, tag: str = None):
+    query = db.query(models.Subnet).options(joinedload(models.Subnet.ip_ranges))
+    if tag:
+        query = query.filter(tags.subnet_filter(tag))
+    # One grouped count for the page instead of lazy loading each subnet's IPs
+    return _attach_stats(db, query.offset(skip).limit(limit).all())
 
 def create_subnet(db: Session, subnet: schemas.SubnetCreate):
     db_subnet = models.Subnet(**subnet.model_dump())
+    tags.sync_tags(db, db_subnet)
     db.add(db_subnet)
+    cache.bump(db, cache.SUBNETS)
     db.commit()
     db.refresh(db_subnet)
     
-    # Trigger an immediate scan in the background
-    threading.Thread(target=scan_subnet_range, args=(db_subnet.id,), daemon=True).start()
+    # Trigger an immediate scan in the background; API-only instances leave it to the Brain's next cycle
+    if not runtime.API_ONLY:
+        from discovery import scan_subnet_range
+        threading.Thread(target=scan_subnet_range, args=(db_subnet.id,), daemon=True).start()
     
     return db_subnet
 
@@ -62,6 +92,9 @@ def update_subnet(db: Session, subnet_id: int, subnet: schemas.SubnetUpdate):
         
         for key, value in update_data.items():
             setattr(db_subnet, key, value)
+        if "tags" in update_data:
+            tags.sync_tags(db, db_subnet)
+        cache.bump(db, cache.SUBNETS)
         db.commit()
         db.refresh(db_subnet)
         
@@ -74,6 +107,8 @@ def delete_subnet(db: Session, subnet_id: int):
     db_subnet = get_subnet(db, subnet_id)
     if db_subnet:
         db.delete(db_subnet)
+        # Its ranges go with it
+        cache.bump(db, cache.SUBNETS, cache.RANGES)
         db.commit()
     return db_subnet
 
@@ -171,16 +206,200 @@ def find_next_available_ip(db: Session, subnet_id: int, pool_id: int = None):
         
     return None
 
+# CIDR Planning
+def _ip_to_int(address: str):
+    """
+    Fast string to integer conversion, falling back to ipaddress for IPv6.
+    Returns (version, value) or None for malformed addresses.
+    """
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        addr = ipaddress.ip_address(address)
+        return addr.version, int(addr)
+    except ValueError:
+        return None
+
+def _parse_container(container: str):
+    try:
+        return ipaddress.ip_network(container, strict=False)
+    except ValueError:
+        raise ValueError(f"Invalid container prefix: {container}")
+
+def _get_used_intervals(db: Session, container):
+    """
+    Returns the sorted, merged (start, end) integer bounds of all subnets
+    overlapping the container.
+    """
+    lo = int(container.network_address)
+    hi = int(container.broadcast_address)
+    max_prefix = container.max_prefixlen
+
+    intervals = []
+    for subnet in cache.subnets(db):
+        address, prefix_length = subnet.network_address, subnet.prefix_length
+        parsed = _ip_to_int(address)
+        if not parsed or parsed[0] != container.version:
+            continue
+        prefix = max(0, min(max_prefix, prefix_length if prefix_length is not None else max_prefix))
+        size = 1 << (max_prefix - prefix)
+        start = parsed[1] & ~(size - 1)
+        end = start + size - 1
+        if end < lo or start > hi:
+            continue
+        intervals.append((max(start, lo), min(end, hi)))
+
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _get_free_intervals(container, used):
+    free = []
+    cursor = int(container.network_address)
+    for start, end in used:
+        if start > cursor:
+            free.append((cursor, start - 1))
+        cursor = end + 1
+    if cursor <= int(container.broadcast_address):
+        free.append((cursor, int(container.broadcast_address)))
+    return free
+
+def _interval_to_blocks(start: int, end: int, max_prefix: int):
+    """
+    Splits an integer interval into the minimal list of aligned CIDR blocks,
+    yielded as (start, prefix_length).
+    """
+    while start <= end:
+        size = (start & -start) if start else 1 << max_prefix
+        while size > end - start + 1:
+            size >>= 1
+        yield start, max_prefix - (size.bit_length() - 1)
+        start += size
+
+def _format_block(container, start: int, prefix_length: int):
+    return str(type(container)((start, prefix_length)))
+
+def find_first_free_subnet(db: Session, container: str, prefix_length: int):
+    network = _parse_container(container)
+    if prefix_length < network.prefixlen or prefix_length > network.max_prefixlen:
+        raise ValueError(f"Prefix length must be between /{network.prefixlen} and /{network.max_prefixlen}")
+
+    size = 1 << (network.max_prefixlen - prefix_length)
+    for start, end in _get_free_intervals(network, _get_used_intervals(db, network)):
+        aligned = (start + size - 1) & ~(size - 1)
+        if aligned + size - 1 <= end:
+            return _format_block(network, aligned, prefix_length)
+    return None
+
+def find_free_blocks(db: Session, container: str, min_prefix_length: int = None, limit: int = 100):
+    """
+    Lists the free CIDR blocks of the container that are at least as large
+    as min_prefix_length, largest first.
+    """
+    network = _parse_container(container)
+    if min_prefix_length is None:
+        min_prefix_length = network.max_prefixlen
+
+    blocks = []
+    for start, end in _get_free_intervals(network, _get_used_intervals(db, network)):
+        for block_start, block_prefix in _interval_to_blocks(start, end, network.max_prefixlen):
+            if block_prefix <= min_prefix_length:
+                blocks.append((block_prefix, block_start))
+
+    blocks.sort()
+    return [
+        {"network": _format_block(network, start, prefix), "size": 1 << (network.max_prefixlen - prefix)}
+        for prefix, start in blocks[:limit]
+    ]
+
+def get_fragmentation_report(db: Session, container: str):
+    network = _parse_container(container)
+    used = _get_used_intervals(db, network)
+    free = _get_free_intervals(network, used)
+
+    total = network.num_addresses
+    used_count = sum(end - start + 1 for start, end in used)
+    free_count = total - used_count
+
+    histogram = {}
+    largest = None
+    block_count = 0
+    for start, end in free:
+        for block_start, block_prefix in _interval_to_blocks(start, end, network.max_prefixlen):
+            block_count += 1
+            histogram[block_prefix] = histogram.get(block_prefix, 0) + 1
+            if largest is None or block_prefix < largest[1]:
+                largest = (block_start, block_prefix)
+
+    largest_size = 1 << (network.max_prefixlen - largest[1]) if largest else 0
+    return {
+        "container": str(network),
+        "total": total,
+        "used": used_count,
+        "free": free_count,
+        "utilization": round(used_count / total * 100, 2),
+        "free_intervals": len(free),
+        "free_blocks": block_count,
+        "largest_free_block": _format_block(network, *largest) if largest else None,
+        "fragmentation": round(1 - largest_size / free_count, 4) if free_count else 0.0,
+        "free_blocks_by_prefix": {f"/{p}": histogram[p] for p in sorted(histogram)},
+    }
+
 # Device CRUD
+def _schema_columns(model, schema):
+    # Only the columns the response schema serializes
+    return [getattr(model, c.key) for c in model.__table__.columns if c.key in schema.model_fields]
+
+def _device_load_options():
+    # One query for the devices, one for their IPs and one for those IPs' subnets (with
+    # ip_ranges joined), however many interfaces a device has. selectinload batches its
+    # IN lists by 500 keys, so large pages stay within SQLite's parameter limit.
+    return selectinload(models.Device.ip_addresses).options(
+        load_only(*_schema_columns(models.IPAddress, schemas.IPAddress)),
+        selectinload(models.IPAddress.subnet).options(
+            load_only(*_schema_columns(models.Subnet, schemas.Subnet)),
+            joinedload(models.Subnet.ip_ranges),
+        ),
+    )
+
 def get_device(db: Session, device_id: int):
     return db.query(models.Device).options(
-        joinedload(models.Device.ip_addresses).joinedload(models.IPAddress.subnet)
+        _device_load_options()
     ).filter(models.Device.id == device_id).first()
 
-def get_devices(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Device).options(
-        joinedload(models.Device.ip_addresses).joinedload(models.IPAddress.subnet)
-    ).offset(skip).limit(limit).all()
+def get_devices(db: Session, skip: int = 0, limit: int = 100, tag: str = None):
+    query = db.query(models.Device).options(_device_load_options())
+    if tag:
+        query = query.filter(tags.device_filter(tag))
+    # No collection JOIN, so offset/limit count devices rather than device x IP rows
+    return query.order_by(models.Device.id).offset(skip).limit(limit).all()
+
+def lookup_vendors(macs):
+    return oui.lookup_many(macs)
+
+def apply_batch(db: Session, operations, idempotency_key: str = None):
+    return batch.run(db, operations, idempotency_key)
+
+def get_tag_counts(db: Session, tag: str = None):
+    return tags.tag_counts(db, tag)
+
+def search_devices(db: Session, query: str, limit: int = 20):
+    ids = search.search_device_ids(db, query, limit)
+    if not ids:
+        return []
+    devices = {
+        d.id: d for d in db.query(models.Device).options(_device_load_options()).filter(models.Device.id.in_(ids))
+    }
+    # Keep the FTS ranking
+    return [devices[i] for i in ids if i in devices]
 
 def link_ip_to_device(db: Session, db_device: models.Device, ip_addr: str, interface_name: str = None):
     if not ip_addr:
@@ -190,20 +409,14 @@ def link_ip_to_device(db: Session, db_device: models.Device, ip_addr: str, inter
     db_ip = db.query(models.IPAddress).filter(models.IPAddress.address == ip_addr).first()
     
     if not db_ip:
-        # Try to find the correct subnet for this new IP
-        subnets = db.query(models.Subnet).all()
-        target_subnet = None
-        for s in subnets:
-            network = ipaddress.ip_network(f"{s.network_address}/{s.prefix_length}")
-            if ipaddress.ip_address(ip_addr) in network:
-                target_subnet = s
-                break
+        # Find the most specific subnet for this new IP
+        subnet_id = cache.subnet_index(db).match(ip_addr)
         
-        if target_subnet:
+        if subnet_id:
             db_ip = models.IPAddress(
                 address=ip_addr,
                 status=models.IPStatus.ALLOCATED,
-                subnet_id=target_subnet.id,
+                subnet_id=subnet_id,
                 device_id=db_device.id,
                 interface_name=interface_name
             )
@@ -213,6 +426,9 @@ def link_ip_to_device(db: Session, db_device: models.Device, ip_addr: str, inter
         db_ip.status = models.IPStatus.ALLOCATED
         if interface_name is not None:
             db_ip.interface_name = interface_name
+        # Fill in the manufacturer from the interface's OUI unless it was entered by hand
+        if not db_device.manufacturer and db_ip.vendor:
+            db_device.manufacturer = db_ip.vendor
     
     db.commit()
     if db_ip:
@@ -224,6 +440,7 @@ def create_device(db: Session, device: schemas.DeviceCreate):
     ip_addr = device_data.pop("ip_address", None)
     
     db_device = models.Device(**device_data)
+    tags.sync_tags(db, db_device)
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
@@ -241,6 +458,8 @@ def update_device(db: Session, device_id: int, device: schemas.DeviceUpdate):
         
         for key, value in update_data.items():
             setattr(db_device, key, value)
+        if "tags" in update_data:
+            tags.sync_tags(db, db_device)
         db.commit()
         
         if ip_addr:
@@ -268,10 +487,18 @@ def delete_device(db: Session, device_id: int):
 def get_ip_address(db: Session, ip_id: int):
     return db.query(models.IPAddress).filter(models.IPAddress.id == ip_id).first()
 
-def get_ip_addresses(db: Session, subnet_id: int = None, skip: int = 0, limit: int = 100):
-    query = db.query(models.IPAddress)
+def get_ip_addresses(db: Session, subnet_id: int = None, skip: int = 0, limit: int = 100, tag: str = None):
+    # The page's subnets (with ip_ranges joined) in one more query, not one per subnet
+    query = db.query(models.IPAddress).options(
+        selectinload(models.IPAddress.subnet).options(
+            load_only(*_schema_columns(models.Subnet, schemas.Subnet)),
+            joinedload(models.Subnet.ip_ranges),
+        )
+    )
     if subnet_id:
         query = query.filter(models.IPAddress.subnet_id == subnet_id)
+    if tag:
+        query = query.filter(tags.ip_filter(tag))
     return query.offset(skip).limit(limit).all()
 
 def create_ip_address(db: Session, ip: schemas.IPAddressCreate):
@@ -283,12 +510,15 @@ def create_ip_address(db: Session, ip: schemas.IPAddressCreate):
         update_data = ip.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_ip, key, value)
+        if "mac_address" in update_data:
+            db_ip.vendor = oui.lookup(db_ip.mac_address)
         db.commit()
         db.refresh(db_ip)
         return db_ip
     
     # Create new record
     db_ip = models.IPAddress(**ip.model_dump())
+    db_ip.vendor = oui.lookup(db_ip.mac_address)
     db.add(db_ip)
     db.commit()
     db.refresh(db_ip)
@@ -300,6 +530,8 @@ def update_ip_address(db: Session, ip_id: int, ip: schemas.IPAddressUpdate):
         update_data = ip.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_ip, key, value)
+        if "mac_address" in update_data:
+            db_ip.vendor = oui.lookup(db_ip.mac_address)
         db.commit()
         db.refresh(db_ip)
     return db_ip
@@ -311,6 +543,32 @@ def delete_ip_address(db: Session, ip_id: int):
         db.commit()
     return db_ip
 
+def get_ip_events(db: Session, ip_id: int, skip: int = 0, limit: int = 100):
+    return db.query(models.IPEvent).filter(
+        models.IPEvent.ip_id == ip_id
+    ).order_by(models.IPEvent.timestamp.desc(), models.IPEvent.id.desc()).offset(skip).limit(limit).all()
+
+def get_ip_services(db: Session, ip_id: int):
+    return db.query(models.IPService).filter(
+        models.IPService.ip_id == ip_id
+    ).order_by(models.IPService.protocol, models.IPService.port).all()
+
+def get_subnet_rtt(db: Session, subnet: models.Subnet):
+    """
+    Learned probe round trip statistics of a subnet and the sweep timeout they produce.
+    """
+    settings = get_settings(db)
+    estimator = rtt.RTTEstimator.from_subnet(subnet)
+    timeout = estimator.timeout(rtt.SWEEP_TIMEOUT) if settings["adaptive_timeouts"] else rtt.SWEEP_TIMEOUT
+    return {
+        "subnet_id": subnet.id,
+        "srtt_ms": estimator.srtt * 1000 if estimator.srtt is not None else None,
+        "rttvar_ms": estimator.rttvar * 1000 if estimator.rttvar is not None else None,
+        "timeout_ms": timeout * 1000,
+        "samples": estimator.samples,
+        "last_scan_duration": subnet.last_scan_duration,
+    }
+
 # IPRange CRUD
 def get_ip_range(db: Session, ip_range_id: int):
     return db.query(models.IPRange).filter(models.IPRange.id == ip_range_id).first()
@@ -322,8 +580,14 @@ def get_ip_ranges(db: Session, subnet_id: int = None, skip: int = 0, limit: int
     return query.offset(skip).limit(limit).all()
 
 def create_ip_range(db: Session, ip_range: schemas.IPRangeCreate):
+    subnet = db.query(models.Subnet).filter(models.Subnet.id == ip_range.subnet_id).first()
+    if not subnet:
+        raise ValueError(f"Subnet {ip_range.subnet_id} not found")
+    ranges.check(db, subnet, ip_range.start_ip, ip_range.end_ip)
+    # start_int/end_int are filled in by the column defaults
     db_ip_range = models.IPRange(**ip_range.model_dump())
     db.add(db_ip_range)
+    cache.bump(db, cache.RANGES)
     db.commit()
     db.refresh(db_ip_range)
     return db_ip_range
@@ -332,21 +596,59 @@ def update_ip_range(db: Session, ip_range_id: int, ip_range: schemas.IPRangeUpda
     db_ip_range = get_ip_range(db, ip_range_id)
     if db_ip_range:
         update_data = ip_range.model_dump(exclude_unset=True)
+        if "start_ip" in update_data or "end_ip" in update_data:
+            start_ip = update_data.get("start_ip", db_ip_range.start_ip)
+            end_ip = update_data.get("end_ip", db_ip_range.end_ip)
+            ranges.check(db, db_ip_range.subnet, start_ip, end_ip, exclude_id=db_ip_range.id)
+            # As the column defaults on insert: NULL for IPv6, which does not fit SQLite's INTEGER
+            db_ip_range.start_int = models.ipv4_int(start_ip)
+            db_ip_range.end_int = models.ipv4_int(end_ip)
         for key, value in update_data.items():
             setattr(db_ip_range, key, value)
+        cache.bump(db, cache.RANGES)
         db.commit()
         db.refresh(db_ip_range)
     return db_ip_range
 
+def get_ip_range_stats(db: Session, ip_range_id: int):
+    return ranges.range_stats(db, range_ids=[ip_range_id]).get(ip_range_id)
+
+def get_ip_ranges_stats(db: Session, subnet_id: int = None):
+    return list(ranges.range_stats(db, subnet_id=subnet_id).values())
+
 def delete_ip_range(db: Session, ip_range_id: int):
     db_ip_range = get_ip_range(db, ip_range_id)
     if db_ip_range:
         db.delete(db_ip_range)
+        cache.bump(db, cache.RANGES)
         db.commit()
     return db_ip_range
 
+# Conflicts CRUD
+def get_conflicts(db: Session, kind: str = None, skip: int = 0, limit: int = 100):
+    query = db.query(models.IPConflict)
+    if kind:
+        query = query.filter(models.IPConflict.kind == kind)
+    return query.order_by(models.IPConflict.last_seen.desc(), models.IPConflict.id.desc()).offset(skip).limit(limit).all()
+
+def delete_conflict(db: Session, conflict_id: int):
+    db_conflict = db.query(models.IPConflict).filter(models.IPConflict.id == conflict_id).first()
+    if db_conflict:
+        db.delete(db_conflict)
+        db.commit()
+    return db_conflict
+
+def get_mac_sightings(db: Session, mac: str):
+    if identity.canonical_mac(mac) is None:
+        raise ValueError(f"Invalid MAC address: {mac}")
+    return identity.get_sightings(db, mac)
+
 # Settings CRUD
 def get_settings(db: Session):
+    # Parsed once per settings generation; a copy, so callers may adjust it
+    return dict(cache.get(db, cache.SETTINGS, _load_settings))
+
+def _load_settings(db: Session):
     settings = db.query(models.Setting).all()
     # Map to useful dict
     result = {
@@ -355,7 +657,28 @@ def get_settings(db: Session):
         "icmp_enabled": True,
         "dns_enabled": False,
         "dns_server": "",
-        "dns_search_domains": ""
+        "dns_search_domains": "",
+        "last_seen_granularity": 300,
+        "history_retention_days": 30,
+        "history_daily_retention_days": 365,
+        "discovery_backend": "scapy",
+        "service_detection": False,
+        "nmap_top_ports": 100,
+        "adaptive_timeouts": True,
+        "probe_retries": 1,
+        "scan_time_budget": 1800,
+        "passive_discovery": False,
+        "passive_interface": "",
+        "dhcp_lease_files": "",
+        "dns_mode": "ptr",
+        "dns_zones": "",
+        "retention_discovered_days": 0,
+        "retention_offline_days": 0,
+        "retention_maintenance_hours": 24,
+        "backup_interval_hours": 0,
+        "backup_keep": 7,
+        "backup_method": "vacuum",
+        "backup_compress": True
     }
     for s in settings:
         if s.key == "discovery_interval":
@@ -370,6 +693,48 @@ def get_settings(db: Session):
             result["dns_server"] = s.value
         elif s.key == "dns_search_domains":
             result["dns_search_domains"] = s.value
+        elif s.key == "last_seen_granularity":
+            result["last_seen_granularity"] = int(s.value)
+        elif s.key == "history_retention_days":
+            result["history_retention_days"] = int(s.value)
+        elif s.key == "history_daily_retention_days":
+            result["history_daily_retention_days"] = int(s.value)
+        elif s.key == "discovery_backend":
+            result["discovery_backend"] = s.value
+        elif s.key == "service_detection":
+            result["service_detection"] = s.value.lower() == "true"
+        elif s.key == "nmap_top_ports":
+            result["nmap_top_ports"] = int(s.value)
+        elif s.key == "adaptive_timeouts":
+            result["adaptive_timeouts"] = s.value.lower() == "true"
+        elif s.key == "probe_retries":
+            result["probe_retries"] = int(s.value)
+        elif s.key == "scan_time_budget":
+            result["scan_time_budget"] = int(s.value)
+        elif s.key == "passive_discovery":
+            result["passive_discovery"] = s.value.lower() == "true"
+        elif s.key == "passive_interface":
+            result["passive_interface"] = s.value
+        elif s.key == "dhcp_lease_files":
+            result["dhcp_lease_files"] = s.value
+        elif s.key == "dns_mode":
+            result["dns_mode"] = s.value
+        elif s.key == "dns_zones":
+            result["dns_zones"] = s.value
+        elif s.key == "retention_discovered_days":
+            result["retention_discovered_days"] = int(s.value)
+        elif s.key == "retention_offline_days":
+            result["retention_offline_days"] = int(s.value)
+        elif s.key == "retention_maintenance_hours":
+            result["retention_maintenance_hours"] = int(s.value)
+        elif s.key == "backup_interval_hours":
+            result["backup_interval_hours"] = int(s.value)
+        elif s.key == "backup_keep":
+            result["backup_keep"] = int(s.value)
+        elif s.key == "backup_method":
+            result["backup_method"] = s.value
+        elif s.key == "backup_compress":
+            result["backup_compress"] = s.value.lower() == "true"
     return result
 
 def update_settings(db: Session, settings: schemas.SettingsUpdate):
@@ -381,18 +746,11 @@ def update_settings(db: Session, settings: schemas.SettingsUpdate):
         else:
             db_setting = models.Setting(key=key, value=str(value))
             db.add(db_setting)
+    cache.bump(db, cache.SETTINGS)
     db.commit()
     return get_settings(db)
 
 def purge_discovered_ips(db: Session, days: int = 30):
-    from datetime import datetime, timedelta, timezone
-    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-    
-    # Only delete DISCOVERED ones that haven't been seen recently
-    deleted_count = db.query(models.IPAddress).filter(
-        models.IPAddress.status == models.IPStatus.DISCOVERED,
-        models.IPAddress.last_seen < cutoff
-    ).delete()
-    
-    db.commit()
-    return deleted_count
+    # Only delete DISCOVERED ones that haven't been seen recently, in batches that let writers in
+    deleted, _ = retention.purge_discovered(db, days)
+    return deleted["discovered_ips"]
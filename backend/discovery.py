@@ -1,26 +1,71 @@
 import time
 import logging
 import socket
-from datetime import datetime, timezone
+import ipaddress
+import threading
+from itertools import groupby
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from scapy.all import srp, Ether, ARP, conf, IP, ICMP, sr1, sr
 import dns.resolver
 import dns.reversename
 import models
 import schemas
+import cache
+import coordination
+import ingest
+import history
+import retention
+import backup
+import nmap_scanner
+import prober
+import rtt
+import jobs
+import metrics
+import passive
+import leases
+import zones
 from database import SessionLocal
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def ping_ip(ip_address: str, timeout: int = 1):
+# Number of health check results written per commit
+HEALTH_CHECK_BATCH_SIZE = 200
+
+PING_TIMEOUT = rtt.PING_TIMEOUT
+SWEEP_TIMEOUT = rtt.SWEEP_TIMEOUT
+
+# A subnet is due for the Brain once its last scan (by any process) is this fraction of the interval old
+DUE_FRACTION = 0.9
+
+# Scapy sweeps larger networks in blocks of this many addresses so jobs can report progress and stop in between
+SWEEP_CHUNK_SIZE = 4096
+
+# Subnet scan_status for each finished job state
+SCAN_STATUS = {
+    jobs.COMPLETED: "Idle",
+    jobs.CANCELLED: "Cancelled",
+    jobs.TIMED_OUT: "Timed out",
+}
+
+def ping_ip(ip_address: str, timeout: int = 1, retries: int = 0, rtts: list = None):
     """
     Standard ICMP Ping using Scapy.
+    Unanswered pings are retried with a doubled timeout.
     """
     try:
-        packet = IP(dst=ip_address)/ICMP()
-        reply = sr1(packet, timeout=timeout, verbose=0)
-        return reply is not None
+        for attempt in range(retries + 1):
+            packet = IP(dst=ip_address)/ICMP()
+            reply = sr1(packet, timeout=timeout, verbose=0)
+            if reply is not None:
+                # Only first attempts give an unambiguous round trip time
+                if rtts is not None and attempt == 0:
+                    rtts.append(reply.time - packet.sent_time)
+                return True
+            timeout *= 2
+        return False
     except Exception as e:
         logger.error(f"Error pinging {ip_address}: {e}")
         return False
@@ -72,149 +117,446 @@ def resolve_hostname(ip_address: str, dns_server: str = None):
         except:
             return None
 
-def scan_subnet(network_prefix: str, arp_enabled: bool = True, icmp_enabled: bool = True):
+def _timed_resolve(ip_address: str, dns_server: str = None):
     """
-    Scan a subnet using both ARP (local) and ICMP (routed).
-    network_prefix: e.g. "192.168.1.0/24"
+    resolve_hostname that feeds the DNS lookup metrics.
     """
-    discovered_hosts = {} # ip -> mac
+    with metrics.Timer() as timer:
+        hostname = resolve_hostname(ip_address, dns_server)
+    metrics.dns_lookups.inc()
+    metrics.dns_lookup_seconds.inc(timer.elapsed)
+    return hostname
+
+def _sweep(targets, arp_enabled: bool, icmp_enabled: bool, timeout: float, discovered_hosts: dict, rtts: list = None, job=None):
+    """
+    One ARP and/or ICMP pass over targets (a prefix or a list of addresses).
+    """
+    if isinstance(targets, list):
+        count = len(targets)
+    else:
+        count = ipaddress.ip_network(targets, strict=False).num_addresses
 
     # 1. ARP Scan (very fast and reliable for local segment)
     if arp_enabled:
         try:
-            logger.info(f"Starting ARP scan for {network_prefix}")
-            ans, _ = srp(Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=network_prefix), timeout=2, verbose=0)
-            for _, received in ans:
+            logger.info(f"Starting ARP scan for {targets}")
+            ans, _ = srp(Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=targets), timeout=timeout, verbose=0)
+            if job is not None:
+                job.probes_sent += count
+                job.replies += len(ans)
+            for sent, received in ans:
                 discovered_hosts[received.psrc] = received.hwsrc
+                if rtts is not None:
+                    rtts.append(received.time - sent.sent_time)
         except Exception as e:
-            logger.error(f"Error during ARP scan for {network_prefix}: {e}")
+            logger.error(f"Error during ARP scan for {targets}: {e}")
 
     # 2. ICMP Scan (works across routers/gateways)
-    if icmp_enabled:
+    if icmp_enabled and not (job is not None and job.should_stop()):
         try:
-            logger.info(f"Starting ICMP scan for {network_prefix}")
-            ans_icmp, _ = sr(IP(dst=network_prefix)/ICMP(), timeout=2, verbose=0)
-            for _, received in ans_icmp:
+            logger.info(f"Starting ICMP scan for {targets}")
+            ans_icmp, _ = sr(IP(dst=targets)/ICMP(), timeout=timeout, verbose=0)
+            if job is not None:
+                job.probes_sent += count
+                job.replies += len(ans_icmp)
+            for sent, received in ans_icmp:
                 ip_addr = received.src
                 if ip_addr not in discovered_hosts:
                     discovered_hosts[ip_addr] = None # MAC not visible via Layer 3
+                    if rtts is not None:
+                        rtts.append(received.time - sent.sent_time)
         except Exception as e:
-            logger.error(f"Error during ICMP scan for {network_prefix}: {e}")
+            logger.error(f"Error during ICMP scan for {targets}: {e}")
+
+def _sweep_blocks(network_prefix: str):
+    network = ipaddress.ip_network(network_prefix, strict=False)
+    if network.num_addresses <= SWEEP_CHUNK_SIZE:
+        return [network_prefix]
+    block_prefix = network.max_prefixlen - SWEEP_CHUNK_SIZE.bit_length() + 1
+    return [str(block) for block in network.subnets(new_prefix=block_prefix)]
+
+def _host_count(network_prefix: str):
+    network = ipaddress.ip_network(network_prefix, strict=False)
+    if network.prefixlen >= network.max_prefixlen - 1:
+        return network.num_addresses
+    return network.num_addresses - 2
+
+def scan_subnet(network_prefix: str, arp_enabled: bool = True, icmp_enabled: bool = True, timeout: float = 2,
+                retries: int = 0, expected=None, rtts: list = None, job=None):
+    """
+    Scan a subnet using both ARP (local) and ICMP (routed).
+    network_prefix: e.g. "192.168.1.0/24"
+    Expected hosts (known to be online) that stay silent are re-probed
+    individually up to retries times with a doubled timeout.
+    A job gets progress counters and is checked for cancellation between sweeps.
+    """
+    discovered_hosts = {} # ip -> mac
+    for block in _sweep_blocks(network_prefix):
+        if job is not None and job.should_stop():
+            break
+        _sweep(block, arp_enabled, icmp_enabled, timeout, discovered_hosts, rtts, job)
+
+    for _ in range(retries):
+        if job is not None and job.should_stop():
+            break
+        missing = [address for address in expected or [] if address not in discovered_hosts]
+        if not missing:
+            break
+        timeout *= 2
+        logger.info(f"Retrying {len(missing)} silent hosts in {network_prefix} (timeout {timeout:.2f}s)")
+        _sweep(missing, arp_enabled, icmp_enabled, timeout, discovered_hosts, job=job)
 
     return [{"ip": ip, "mac": mac} for ip, mac in discovered_hosts.items()]
 
-def run_health_checks(dns_enabled: bool = False, dns_server: str = None):
+def run_health_checks(dns_enabled: bool = False, dns_server: str = None, last_seen_granularity: int = 300, discovery_backend: str = "scapy",
+                      adaptive_timeouts: bool = True, probe_retries: int = 1):
     """
     Iterates through all registered IP addresses and pings them.
     Updates the healthcheck_status and last_seen in the database.
     Also updates hostname if DNS is enabled.
+    Only fields whose observed value changed are written.
+    Addresses are pinged subnet by subnet so each batch uses its subnet's learned timeout.
     """
     db = SessionLocal()
     try:
-        ips = db.query(models.IPAddress).all()
-        logger.info(f"Running health checks on {len(ips)} IPs")
-        for ip_record in ips:
-            is_alive = ping_ip(ip_record.address)
-            ip_record.healthcheck_status = "Online" if is_alive else "Offline"
-            
-            if is_alive:
-                ip_record.last_seen = datetime.now(timezone.utc)
-            
-            # Attempt to refresh hostname if DNS is enabled, even if host is offline
-            if dns_enabled:
-                new_hostname = resolve_hostname(ip_record.address, dns_server)
-                if new_hostname:
-                    ip_record.hostname = new_hostname
-            
+        snapshot = ingest.load_snapshot(db)
+        logger.info(f"Running health checks on {len(snapshot)} IPs")
+        estimators = {
+            subnet.id: rtt.RTTEstimator.from_subnet(subnet)
+            for subnet in db.query(models.Subnet).all()
+        }
+        addresses = sorted(snapshot, key=lambda address: snapshot[address]["subnet_id"] or 0)
+        totals = {"updated": 0, "unchanged": 0, "events": 0}
+        sampled = set()
+        for subnet_id, group in groupby(addresses, key=lambda address: snapshot[address]["subnet_id"]):
+            group = list(group)
+            estimator = estimators.get(subnet_id) or rtt.RTTEstimator()
+            timeout = estimator.timeout(PING_TIMEOUT) if adaptive_timeouts else PING_TIMEOUT
+            for i in range(0, len(group), HEALTH_CHECK_BATCH_SIZE):
+                batch = group[i:i + HEALTH_CHECK_BATCH_SIZE]
+                # Only hosts that were online get retried; known-offline ones get a single probe
+                expected = [address for address in batch if snapshot[address]["healthcheck_status"] == ingest.ONLINE]
+                rtts = []
+                alive = _ping_batch(batch, discovery_backend, timeout, probe_retries, expected, estimator.settle_time(), rtts)
+                metrics.probes_sent.labels(discovery_backend).inc(len(batch))
+                if rtts and subnet_id in estimators:
+                    estimator.update_many(rtts)
+                    sampled.add(subnet_id)
+                observations = []
+                for address in batch:
+                    obs = {"ip": address, "online": address in alive}
+                    
+                    # Attempt to refresh hostname if DNS is enabled, even if host is offline
+                    if dns_enabled:
+                        obs["hostname"] = _timed_resolve(address, dns_server)
+                    observations.append(obs)
+                
+                _flush_health_observations(db, observations, snapshot, last_seen_granularity, totals)
+        if sampled:
+            db.execute(update(models.Subnet), [dict(id=sid, **estimators[sid].as_columns()) for sid in sampled])
             db.commit()
+        logger.info(f"Health checks wrote {totals['updated']} changed IPs ({totals['unchanged']} unchanged, {totals['events']} events)")
     except Exception as e:
         logger.error(f"Health check task failed: {e}")
     finally:
         db.close()
 
-def scan_subnet_range(subnet_id: int, arp_enabled: bool = True, icmp_enabled: bool = True, dns_enabled: bool = False, dns_server: str = None):
+def _ping_batch(addresses, discovery_backend: str = "scapy", timeout: float = PING_TIMEOUT, retries: int = 0,
+                expected=None, settle: float = None, rtts: list = None):
+    """
+    Returns the subset of addresses that answered a ping.
+    The raw prober pings the whole batch concurrently; Scapy pings one at a time.
+    Only expected addresses are retried.
+    """
+    if discovery_backend == "raw":
+        try:
+            return prober.ping_many(addresses, timeout, retries, expected, settle, rtts)
+        except OSError as e:
+            logger.warning(f"Raw prober unavailable, falling back to Scapy: {e}")
+    expected = set(expected) if expected is not None else set(addresses)
+    return {
+        address for address in addresses
+        if ping_ip(address, timeout, retries if address in expected else 0, rtts)
+    }
+
+def _flush_health_observations(db: Session, observations, snapshot, last_seen_granularity, totals):
+    stats = ingest.apply_observations(db, observations, snapshot=snapshot, last_seen_granularity=last_seen_granularity)
+    db.commit()
+    for key in totals:
+        totals[key] += stats[key]
+
+def _claim_subnet(subnet_id: int, due_after: float = None):
+    """
+    Claims subnet_id for a scan by this process, so other workers and replicas skip it.
+    With due_after, only when nobody scanned it in the last due_after seconds.
+    """
+    claim = coordination.subnet_claim(subnet_id)
+    if not coordination.acquire(claim):
+        return False
+    if due_after:
+        db = SessionLocal()
+        try:
+            last_scan = db.query(models.Subnet.last_scan).filter(models.Subnet.id == subnet_id).scalar()
+        finally:
+            db.close()
+        if last_scan is not None:
+            if last_scan.tzinfo is None:
+                last_scan = last_scan.replace(tzinfo=timezone.utc)
+            if (datetime.now(timezone.utc) - last_scan).total_seconds() < due_after:
+                coordination.release(claim)
+                return False
+    return True
+
+def scan_subnet_range(subnet_id: int, arp_enabled: bool = True, icmp_enabled: bool = True, dns_enabled: bool = False, dns_server: str = None, last_seen_granularity: int = 300,
+                      discovery_backend: str = "scapy", service_detection: bool = False, nmap_top_ports: int = 100,
+                      adaptive_timeouts: bool = True, probe_retries: int = 1, scan_time_budget: int = 0, job: jobs.ScanJob = None,
+                      due_after: float = None):
     """
     Scans a single subnet and updates its metadata.
+    The subnet's own discovery_backend, when set, overrides the global one.
+    Probe timeouts come from the subnet's learned round trip times, and hosts
+    known to be online are retried when they stay silent.
+    Runs as a scan job (see jobs.py); a cancelled or timed out job still
+    ingests the hosts it found. Returns the job.
+    Without a job, claims the subnet first (see _claim_subnet) and returns None when it
+    is claimed elsewhere or not due; a given job comes with its claim already taken.
     """
+    if job is None:
+        try:
+            job = jobs.create_job(subnet_id, scan_time_budget)
+        except ValueError as e:
+            logger.info(f"Skipping scan: {e}")
+            return None
+        if not _claim_subnet(subnet_id, due_after):
+            jobs.discard_job(job)
+            return None
+
     db = SessionLocal()
+    subnet = None
     try:
         subnet = db.query(models.Subnet).filter(models.Subnet.id == subnet_id).first()
         if not subnet:
-            return
+            job.finish("Subnet not found")
+            return job
 
         subnet.scan_status = "Scanning"
+        subnet.scan_progress = 0
         db.commit()
 
         network = f"{subnet.network_address}/{subnet.prefix_length}"
-        results = scan_subnet(network, arp_enabled, icmp_enabled)
+        backend = subnet.discovery_backend or discovery_backend
+        # nmap reports its own percentage instead of probe counts
+        total_probes = 0 if backend == "nmap" else _host_count(network) * (int(arp_enabled) + int(icmp_enabled))
+        job.start(network, backend, total_probes)
+
+        estimator = rtt.RTTEstimator.from_subnet(subnet)
+        timeout = estimator.timeout(SWEEP_TIMEOUT) if adaptive_timeouts else SWEEP_TIMEOUT
+        expected = [
+            address for (address,) in db.query(models.IPAddress.address).filter(
+                models.IPAddress.subnet_id == subnet.id,
+                models.IPAddress.healthcheck_status == ingest.ONLINE
+            )
+        ]
+        rtts = []
+        results = None
+        if backend == "nmap":
+            # nmap runs its own adaptive timing
+            results = nmap_scanner.scan_subnet(network, service_detection, nmap_top_ports, job)
+        elif backend == "raw":
+            try:
+                results = prober.scan_subnet(network, arp_enabled, icmp_enabled, timeout, probe_retries,
+                                             expected, estimator.settle_time(), rtts, job)
+            except OSError as e:
+                logger.warning(f"Raw prober unavailable for {network}, falling back to Scapy: {e}")
+        if results is None:
+            results = scan_subnet(network, arp_enabled, icmp_enabled, timeout, probe_retries, expected, rtts, job)
         
-        logger.info(f"Scan found {len(results)} active hosts in {network}")
+        estimator.update_many(rtts)
+        logger.info(f"Scan found {len(results)} active hosts in {network} in {job.elapsed:.2f}s "
+                    f"(timeout {timeout:.2f}s, srtt {(estimator.srtt or 0) * 1000:.1f}ms, {job.probes_sent} probes)")
         
+        observations = []
         for res in results:
             ip_addr = res["ip"]
-            mac_addr = res["mac"]
             
-            # Resolve hostname if enabled
-            hostname = None
-            if dns_enabled:
-                hostname = resolve_hostname(ip_addr, dns_server)
-
-            ip_record = db.query(models.IPAddress).filter(models.IPAddress.address == ip_addr).first()
+            # Resolve hostname if enabled; a stopped job skips the remaining lookups
+            hostname = res.get("hostname")
+            if dns_enabled and not job.should_stop():
+                hostname = _timed_resolve(ip_addr, dns_server) or hostname
             
-            if ip_record:
-                ip_record.last_seen = datetime.now(timezone.utc)
-                if mac_addr:
-                    ip_record.mac_address = mac_addr
-                if hostname:
-                    ip_record.hostname = hostname
-                ip_record.healthcheck_status = "Online"
-            else:
-                new_ip = models.IPAddress(
-                    address=ip_addr,
-                    hostname=hostname,
-                    mac_address=mac_addr,
-                    status=models.IPStatus.DISCOVERED,
-                    healthcheck_status="Online",
-                    last_seen=datetime.now(timezone.utc),
-                    subnet_id=subnet.id
-                )
-                db.add(new_ip)
+            observations.append({"ip": ip_addr, "mac": res["mac"], "hostname": hostname, "online": True})
+        
+        snapshot = ingest.load_snapshot(db, [o["ip"] for o in observations])
+        stats = ingest.apply_observations(db, observations, subnet_id=subnet.id, snapshot=snapshot, last_seen_granularity=last_seen_granularity)
+        job.hosts_ingested = stats["observed"]
+        logger.info(f"Ingested {network}: {stats['created']} new, {stats['updated']} changed, {stats['unchanged']} unchanged, {stats['events']} events, "
+                    f"{stats['moved']} moved, {stats['retired']} retired, {stats['conflicts']} conflicts")
+        
+        if backend == "nmap" and service_detection and not job.should_stop():
+            service_stats = ingest.apply_services(db, {res["ip"]: res["ports"] for res in results}, snapshot, last_seen_granularity)
+            logger.info(f"Services in {network}: {service_stats['created']} new, {service_stats['updated']} changed, {service_stats['removed']} closed")
         
+        job.finish()
+        for column, value in estimator.as_columns().items():
+            setattr(subnet, column, value)
+        subnet.last_scan_duration = job.elapsed
         subnet.last_scan = datetime.now(timezone.utc)
-        subnet.scan_status = "Idle"
+        subnet.scan_status = SCAN_STATUS[job.state]
+        subnet.scan_progress = None
         db.commit()
+        if job.state != jobs.COMPLETED:
+            logger.info(f"Scan job {job.id} for {network} ended early ({job.state}) after {job.elapsed:.2f}s")
     except Exception as e:
         logger.error(f"Scan failed for subnet {subnet_id}: {e}")
+        job.finish(str(e))
         if subnet:
+            db.rollback()
             subnet.scan_status = f"Error: {str(e)[:50]}"
+            subnet.scan_progress = None
             db.commit()
     finally:
         db.close()
+        coordination.release(coordination.subnet_claim(subnet_id))
+    return job
 
-def run_discovery(arp_enabled: bool = True, icmp_enabled: bool = True, dns_enabled: bool = False, dns_server: str = None):
+def start_subnet_scan(subnet_id: int, settings: dict):
     """
-    Iterates through all subnets and performs discovery.
+    Starts a scan job for one subnet in a background thread using the current settings.
+    Raises ValueError if the subnet is already being scanned, here or by another process.
+    """
+    job = jobs.create_job(subnet_id, settings.get("scan_time_budget"))
+    if not _claim_subnet(subnet_id):
+        jobs.discard_job(job)
+        raise ValueError(f"Subnet {subnet_id} is already being scanned by another instance")
+    threading.Thread(
+        target=scan_subnet_range,
+        args=(
+            subnet_id,
+            settings.get("arp_enabled", True),
+            settings.get("icmp_enabled", True),
+            settings.get("dns_enabled", False) and settings.get("dns_mode", "ptr") == "ptr",
+            settings.get("dns_server"),
+            settings.get("last_seen_granularity", 300),
+            settings.get("discovery_backend", "scapy"),
+            settings.get("service_detection", False),
+            settings.get("nmap_top_ports", 100),
+            settings.get("adaptive_timeouts", True),
+            settings.get("probe_retries", 1),
+        ),
+        kwargs={"job": job},
+        daemon=True
+    ).start()
+    return job
+
+def run_discovery(arp_enabled: bool = True, icmp_enabled: bool = True, dns_enabled: bool = False, dns_server: str = None, last_seen_granularity: int = 300,
+                  discovery_backend: str = "scapy", service_detection: bool = False, nmap_top_ports: int = 100,
+                  adaptive_timeouts: bool = True, probe_retries: int = 1, scan_time_budget: int = 0, due_after: float = None):
+    """
+    Iterates through all subnets and performs discovery. Subnets claimed by another process,
+    or scanned less than due_after seconds ago, are skipped.
     """
     db = SessionLocal()
     subnet_ids = []
     try:
-        subnets = db.query(models.Subnet).all()
-        subnet_ids = [s.id for s in subnets]
+        subnet_ids = [s.id for s in cache.subnets(db)]
+        if due_after:
+            # Cheap pre-filter; each due subnet is checked again once claimed
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=due_after)
+            recent = {sid for (sid,) in db.query(models.Subnet.id).filter(models.Subnet.last_scan >= cutoff)}
+            subnet_ids = [sid for sid in subnet_ids if sid not in recent]
     except Exception as e:
         logger.error(f"Failed to fetch subnets for discovery: {e}")
     finally:
         db.close()
     
-    for sid in subnet_ids:
-        scan_subnet_range(sid, arp_enabled, icmp_enabled, dns_enabled, dns_server)
+    for i, sid in enumerate(subnet_ids):
+        metrics.discovery_queue_depth.set(len(subnet_ids) - i)
+        scan_subnet_range(sid, arp_enabled, icmp_enabled, dns_enabled, dns_server, last_seen_granularity,
+                          discovery_backend, service_detection, nmap_top_ports, adaptive_timeouts, probe_retries, scan_time_budget,
+                          due_after=due_after)
+    metrics.discovery_queue_depth.set(0)
+
+def run_zone_reconciliation(dns_zones: str, dns_server: str = None, last_seen_granularity: int = 300):
+    """
+    Refreshes hostnames from whole reverse zones instead of one PTR query per address.
+    """
+    db = SessionLocal()
+    try:
+        sources = zones.parse_sources(dns_zones)
+        if not sources:
+            logger.warning("DNS zone mode is enabled but no dns_zones are configured")
+            return
+        zones.reconcile(db, sources, dns_server, last_seen_granularity)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"DNS zone reconciliation failed: {e}")
+    finally:
+        db.close()
+
+def _lead():
+    """
+    Takes or keeps the Brain lease. A database error counts as not leading.
+    """
+    try:
+        return coordination.acquire(coordination.BRAIN)
+    except Exception as e:
+        logger.error(f"Failed to check the Brain lease: {e}")
+        return False
+
+def run_follower_cycle():
+    """
+    What a process that does not hold the Brain lease does: scans the subnets that are due
+    and not claimed, so discovery is spread over every worker and replica. Health checks,
+    zone reconciliation, passive discovery, lease files and history stay with the leader.
+    """
+    db = SessionLocal()
+    try:
+        from crud import get_settings
+        settings = get_settings(db)
+        db.close()
+        passive.configure(False)
+        leases.configure("")
+        run_discovery(
+            settings.get("arp_enabled", True),
+            settings.get("icmp_enabled", True),
+            settings.get("dns_enabled", False) and settings.get("dns_mode", "ptr") == "ptr",
+            settings.get("dns_server"),
+            settings.get("last_seen_granularity", 300),
+            settings.get("discovery_backend", "scapy"),
+            settings.get("service_detection", False),
+            settings.get("nmap_top_ports", 100),
+            settings.get("adaptive_timeouts", True),
+            settings.get("probe_retries", 1),
+            settings.get("scan_time_budget", 1800),
+            due_after=settings.get("discovery_interval", 15) * 60 * DUE_FRACTION,
+        )
+    except Exception as e:
+        logger.error(f"Error in follower cycle: {e}")
+    finally:
+        db.close()
 
 def start_brain_loop():
     """
     Main loop for background tasks. 
     Runs discovery based on interval setting.
+    Every process runs this loop, but only the holder of the Brain lease runs full cycles;
+    the others help with due subnet scans and retry the lease every LEASE_TTL seconds.
     """
-    logger.info("The Brain is starting...")
+    logger.info(f"The Brain is starting as {coordination.INSTANCE_ID}...")
+    leading = None
     while True:
+        if not _lead():
+            if leading is not False:
+                logger.info("Another process holds the Brain lease; following")
+            leading = False
+            run_follower_cycle()
+            time.sleep(coordination.LEASE_TTL)
+            continue
+        if not leading:
+            logger.info("This process now holds the Brain lease")
+        leading = True
+
         db = SessionLocal()
         interval = 5 # default 5 minutes
         try:
@@ -225,10 +567,61 @@ def start_brain_loop():
             icmp_enabled = settings.get("icmp_enabled", True)
             dns_enabled = settings.get("dns_enabled", False)
             dns_server = settings.get("dns_server")
+            # Zone mode replaces the per-IP PTR lookups with one reconciliation per cycle
+            zone_dns = dns_enabled and settings.get("dns_mode", "ptr") == "zone"
+            ptr_dns = dns_enabled and not zone_dns
+            last_seen_granularity = settings.get("last_seen_granularity", 300)
+            discovery_backend = settings.get("discovery_backend", "scapy")
+            service_detection = settings.get("service_detection", False)
+            nmap_top_ports = settings.get("nmap_top_ports", 100)
+            adaptive_timeouts = settings.get("adaptive_timeouts", True)
+            probe_retries = settings.get("probe_retries", 1)
+            scan_time_budget = settings.get("scan_time_budget", 1800)
+            passive.configure(settings.get("passive_discovery", False), settings.get("passive_interface"), last_seen_granularity)
+            leases.configure(settings.get("dhcp_lease_files", ""))
             
             logger.info(f"The Brain is starting a new cycle (ARP: {arp_enabled}, ICMP: {icmp_enabled}, DNS: {dns_enabled})")
-            run_health_checks(dns_enabled, dns_server)
-            run_discovery(arp_enabled, icmp_enabled, dns_enabled, dns_server)
+            dns_seconds = metrics.dns_lookup_seconds.labels()
+            with metrics.Timer() as cycle:
+                dns_start = dns_seconds.value
+                with metrics.Timer() as health:
+                    run_health_checks(ptr_dns, dns_server, last_seen_granularity, discovery_backend, adaptive_timeouts, probe_retries)
+                health_dns = dns_seconds.value - dns_start
+                with metrics.Timer() as discovery:
+                    run_discovery(arp_enabled, icmp_enabled, ptr_dns, dns_server, last_seen_granularity,
+                                  discovery_backend, service_detection, nmap_top_ports, adaptive_timeouts, probe_retries, scan_time_budget,
+                                  due_after=interval * 60 * DUE_FRACTION)
+                discovery_dns = dns_seconds.value - dns_start - health_dns
+                with metrics.Timer() as zone:
+                    if zone_dns:
+                        run_zone_reconciliation(settings.get("dns_zones", ""), dns_server, last_seen_granularity)
+                
+                with metrics.Timer() as maintenance:
+                    history.rollup_availability(db)
+                with metrics.Timer() as cleanup:
+                    try:
+                        retention.run(db, settings)
+                    except ValueError as e:
+                        logger.info(f"Skipping retention: {e}")
+                with metrics.Timer() as snapshot:
+                    try:
+                        backup.run_scheduled(settings)
+                    except ValueError as e:
+                        logger.info(f"Skipping backup: {e}")
+                    except Exception as e:
+                        logger.error(f"Scheduled backup failed: {e}")
+            
+            # DNS lookups happen inside health checks and discovery; report them as their own phase
+            metrics.brain_phase_duration.labels("health").observe(max(health.elapsed - health_dns, 0.0))
+            metrics.brain_phase_duration.labels("discovery").observe(max(discovery.elapsed - discovery_dns, 0.0))
+            metrics.brain_phase_duration.labels("dns").observe(health_dns + discovery_dns + zone.elapsed)
+            metrics.brain_phase_duration.labels("history").observe(maintenance.elapsed)
+            metrics.brain_phase_duration.labels("retention").observe(cleanup.elapsed)
+            metrics.brain_phase_duration.labels("backup").observe(snapshot.elapsed)
+            metrics.brain_cycle_duration.observe(cycle.elapsed)
+            metrics.brain_cycles.inc()
+            logger.info(f"Brain cycle took {cycle.elapsed:.1f}s (health {health.elapsed:.1f}s, discovery {discovery.elapsed:.1f}s, "
+                        f"DNS {health_dns + discovery_dns + zone.elapsed:.1f}s, history {maintenance.elapsed:.1f}s, retention {cleanup.elapsed:.1f}s, backup {snapshot.elapsed:.1f}s)")
         except Exception as e:
             logger.error(f"Error in brain loop: {e}")
         finally:
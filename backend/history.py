@@ -0,0 +1,250 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+import models
+from ingest import as_utc, ONLINE, OFFLINE, QUERY_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+STATUS_EVENTS = (models.EventType.DISCOVERED, models.EventType.STATUS_CHANGED)
+WATERMARK_KEY = "history_rollup_watermark"
+
+def _floor(value: datetime, period: str):
+    if period == "day":
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _scope_filter(query, ip_id: int = None, subnet_id: int = None):
+    if ip_id is not None:
+        query = query.filter(models.IPEvent.ip_id == ip_id)
+    if subnet_id is not None:
+        query = query.join(models.IPAddress, models.IPAddress.id == models.IPEvent.ip_id).filter(
+            models.IPAddress.subnet_id == subnet_id
+        )
+    return query
+
+def _load_timeline(db: Session, start: datetime, end: datetime, ip_id: int = None, subnet_id: int = None):
+    """
+    Returns {ip_id: (status at start, [(timestamp, status), ...])} for the window.
+    Uses the (ip_id, timestamp) index for both the seed lookup and the range scan.
+    """
+    latest = _scope_filter(
+        db.query(models.IPEvent.ip_id, func.max(models.IPEvent.timestamp).label("timestamp")).filter(
+            models.IPEvent.event_type.in_(STATUS_EVENTS),
+            models.IPEvent.timestamp < start
+        ),
+        ip_id, subnet_id
+    ).group_by(models.IPEvent.ip_id).subquery()
+
+    seeds = db.query(models.IPEvent.ip_id, models.IPEvent.new_value).join(
+        latest, and_(models.IPEvent.ip_id == latest.c.ip_id, models.IPEvent.timestamp == latest.c.timestamp)
+    ).filter(models.IPEvent.event_type.in_(STATUS_EVENTS)).order_by(models.IPEvent.id)
+
+    timeline = {row_ip_id: (status, []) for row_ip_id, status in seeds}
+
+    transitions = _scope_filter(
+        db.query(models.IPEvent.ip_id, models.IPEvent.timestamp, models.IPEvent.new_value).filter(
+            models.IPEvent.event_type.in_(STATUS_EVENTS),
+            models.IPEvent.timestamp >= start,
+            models.IPEvent.timestamp < end
+        ),
+        ip_id, subnet_id
+    ).order_by(models.IPEvent.ip_id, models.IPEvent.timestamp, models.IPEvent.id)
+
+    for row_ip_id, timestamp, status in transitions:
+        timeline.setdefault(row_ip_id, (None, []))[1].append((as_utc(timestamp), status))
+    return timeline
+
+def _add_span(totals: dict, start: datetime, end: datetime, online: bool, period: str = None):
+    # Splits [start, end) across bucket boundaries; period=None accumulates into a single total
+    while start < end:
+        if period is None:
+            bucket, bucket_end = None, end
+        else:
+            bucket = _floor(start, period)
+            bucket_end = min(end, bucket + PERIODS[period])
+        seconds = (bucket_end - start).total_seconds()
+        entry = totals.setdefault(bucket, [0.0, 0.0])
+        if online:
+            entry[0] += seconds
+        entry[1] += seconds
+        start = bucket_end
+
+def _integrate(seed, transitions, start: datetime, end: datetime, totals: dict, period: str = None):
+    """
+    Walks the status timeline of one IP and accumulates online/observed seconds.
+    Time before the first known status is not counted as observed.
+    """
+    state = seed
+    cursor = start
+    for timestamp, status in transitions:
+        if state is not None and timestamp > cursor:
+            _add_span(totals, cursor, timestamp, state == ONLINE, period)
+        cursor = max(cursor, timestamp)
+        state = status
+    if state is not None and end > cursor:
+        _add_span(totals, cursor, end, state == ONLINE, period)
+
+def _get_watermark(db: Session):
+    setting = db.query(models.Setting).filter(models.Setting.key == WATERMARK_KEY).first()
+    return as_utc(datetime.fromisoformat(setting.value)) if setting and setting.value else None
+
+def _set_watermark(db: Session, value: datetime):
+    setting = db.query(models.Setting).filter(models.Setting.key == WATERMARK_KEY).first()
+    if not setting:
+        setting = models.Setting(key=WATERMARK_KEY, description="Availability rollups are complete up to this time")
+        db.add(setting)
+    setting.value = value.isoformat()
+
+def _upsert_rollups(db: Session, totals: dict, scope: str, period: str):
+    rows = [
+        {
+            "scope": scope,
+            "scope_id": scope_id,
+            "period": period,
+            "bucket_start": bucket,
+            "online_seconds": round(online),
+            "observed_seconds": round(observed),
+        }
+        for (scope_id, bucket), (online, observed) in totals.items()
+    ]
+    for i in range(0, len(rows), QUERY_CHUNK_SIZE):
+        stmt = sqlite_insert(models.AvailabilityRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["scope", "scope_id", "period", "bucket_start"],
+            set_={
+                "online_seconds": models.AvailabilityRollup.online_seconds + stmt.excluded.online_seconds,
+                "observed_seconds": models.AvailabilityRollup.observed_seconds + stmt.excluded.observed_seconds,
+            }
+        )
+        db.execute(stmt, rows[i:i + QUERY_CHUNK_SIZE])
+    return len(rows)
+
+def rollup_availability(db: Session, now: datetime = None):
+    """
+    Folds status transitions since the last run into per-subnet hourly and daily
+    buckets and per-IP daily buckets. Only completed hours are rolled up.
+    """
+    now = now or datetime.now(timezone.utc)
+    end = _floor(now, "hour")
+    watermark = _get_watermark(db)
+    start = watermark
+    if start is None:
+        first = db.query(func.min(models.IPEvent.timestamp)).scalar()
+        start = _floor(as_utc(first), "hour") if first else end
+    if start >= end:
+        if watermark is None:
+            _set_watermark(db, end)
+            db.commit()
+        return 0
+
+    timeline = _load_timeline(db, start, end)
+    ip_ids = list(timeline)
+    subnet_of = {}
+    for i in range(0, len(ip_ids), QUERY_CHUNK_SIZE):
+        subnet_of.update(db.query(models.IPAddress.id, models.IPAddress.subnet_id).filter(
+            models.IPAddress.id.in_(ip_ids[i:i + QUERY_CHUNK_SIZE])
+        ).all())
+
+    ip_days, subnet_hours, subnet_days = {}, {}, {}
+    for ip_id, (seed, transitions) in timeline.items():
+        hours = {}
+        _integrate(seed, transitions, start, end, hours, "hour")
+        subnet_id = subnet_of.get(ip_id)
+        for bucket, (online, observed) in hours.items():
+            day = _floor(bucket, "day")
+            targets = [(ip_days, (ip_id, day))]
+            if subnet_id is not None:
+                targets += [(subnet_hours, (subnet_id, bucket)), (subnet_days, (subnet_id, day))]
+            for totals, key in targets:
+                entry = totals.setdefault(key, [0.0, 0.0])
+                entry[0] += online
+                entry[1] += observed
+
+    written = _upsert_rollups(db, ip_days, "ip", "day")
+    written += _upsert_rollups(db, subnet_hours, "subnet", "hour")
+    written += _upsert_rollups(db, subnet_days, "subnet", "day")
+    _set_watermark(db, end)
+    db.commit()
+    logger.info(f"Rolled up availability from {start} to {end} ({len(timeline)} IPs, {written} buckets)")
+    return written
+
+def _sum_rollups(db: Session, scope: str, scope_id: int, period: str, start: datetime, end: datetime, totals: dict):
+    if start >= end:
+        return
+    length = PERIODS[period]
+    rows = db.query(models.AvailabilityRollup).filter(
+        models.AvailabilityRollup.scope == scope,
+        models.AvailabilityRollup.scope_id == scope_id,
+        models.AvailabilityRollup.period == period,
+        models.AvailabilityRollup.bucket_start >= start - length,
+        models.AvailabilityRollup.bucket_start < end
+    ).all()
+    for row in rows:
+        bucket = as_utc(row.bucket_start)
+        overlap = (min(end, bucket + length) - max(start, bucket)).total_seconds()
+        if overlap <= 0:
+            continue
+        # Buckets cut by the window edges are prorated
+        fraction = overlap / length.total_seconds()
+        entry = totals.setdefault(None, [0.0, 0.0])
+        entry[0] += row.online_seconds * fraction
+        entry[1] += row.observed_seconds * fraction
+
+def _summarize(totals: dict, start: datetime, end: datetime):
+    online, observed = totals.get(None, [0.0, 0.0])
+    return {
+        "start": start,
+        "end": end,
+        "online_seconds": round(online),
+        "observed_seconds": round(observed),
+        "availability": round(online / observed * 100, 2) if observed else None,
+    }
+
+def get_ip_availability(db: Session, ip_id: int, start: datetime, end: datetime, retention_days: int = 30, now: datetime = None):
+    """
+    Availability of one IP: daily rollups before the raw retention boundary,
+    exact transitions after it.
+    """
+    now = now or datetime.now(timezone.utc)
+    start, end = as_utc(start), min(as_utc(end), now)
+    raw_cutoff = now - timedelta(days=retention_days)
+    live_start = max(start, raw_cutoff)
+
+    totals = {}
+    _sum_rollups(db, "ip", ip_id, "day", start, min(end, live_start), totals)
+    if end > live_start:
+        for seed, transitions in _load_timeline(db, live_start, end, ip_id=ip_id).values():
+            _integrate(seed, transitions, live_start, end, totals)
+
+    result = _summarize(totals, start, end)
+    last_offline = db.query(func.max(models.IPEvent.timestamp)).filter(
+        models.IPEvent.ip_id == ip_id,
+        models.IPEvent.event_type == models.EventType.STATUS_CHANGED,
+        models.IPEvent.new_value == OFFLINE,
+        models.IPEvent.timestamp < end
+    ).scalar()
+    result["last_offline"] = as_utc(last_offline)
+    return result
+
+def get_subnet_availability(db: Session, subnet_id: int, start: datetime, end: datetime, retention_days: int = 30, now: datetime = None):
+    """
+    Availability of a subnet in IP-seconds: daily rollups before the retention
+    boundary, hourly rollups up to the last rollup run, exact transitions after it.
+    """
+    now = now or datetime.now(timezone.utc)
+    start, end = as_utc(start), min(as_utc(end), now)
+    raw_cutoff = now - timedelta(days=retention_days)
+    watermark = _get_watermark(db) or raw_cutoff
+    live_start = max(start, raw_cutoff, watermark)
+
+    totals = {}
+    _sum_rollups(db, "subnet", subnet_id, "day", start, min(end, raw_cutoff), totals)
+    _sum_rollups(db, "subnet", subnet_id, "hour", max(start, raw_cutoff), min(end, live_start), totals)
+    if end > live_start:
+        for seed, transitions in _load_timeline(db, live_start, end, subnet_id=subnet_id).values():
+            _integrate(seed, transitions, live_start, end, totals)
+    return _summarize(totals, start, end)
@@ -0,0 +1,209 @@
+import logging
+from datetime import timedelta
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+import models
+import oui
+import ingest
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_IP = "duplicate_ip"
+MAC_FLAP = "mac_flap"
+
+# Alternations closer together than this are conflicts; slower changes are DHCP churn
+CONFLICT_WINDOW = timedelta(hours=1)
+# Delete the DISCOVERED record a MAC left behind when it shows up at a new address
+RETIRE_MOVED = True
+
+def canonical_mac(value):
+    digits = oui.normalize_mac(value)
+    if digits is None:
+        return None
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2)).lower()
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), ingest.QUERY_CHUNK_SIZE):
+        yield values[i:i + ingest.QUERY_CHUNK_SIZE]
+
+def _load_sightings(db: Session, macs, addresses):
+    """
+    Every stored sighting of the batch's MACs or at the batch's addresses, in two chunked IN queries.
+    """
+    rows = {}
+    for column, values in ((models.MACSighting.mac_address, macs), (models.MACSighting.address, addresses)):
+        for chunk in _chunks(values):
+            for row in db.query(models.MACSighting).filter(column.in_(chunk)):
+                rows[row.id] = row
+    return rows.values()
+
+def track(db: Session, observations, snapshot: dict, now, last_seen_granularity: int = 300):
+    """
+    Records which MAC answered at which address and compares the batch against the
+    sighting history with in-memory hash joins (no per-row queries):
+
+    - duplicate_ip: one address answered by several MACs in the batch, or flipping
+      back to a MAC it had before another MAC within CONFLICT_WINDOW
+    - mac_flap: one MAC returning to an address it left for another within CONFLICT_WINDOW
+    - move: a MAC at a new address; the stale DISCOVERED record it left is retired
+
+    Returns counters. The caller commits.
+    """
+    stats = {"sightings": 0, "moved": 0, "retired": 0, "conflicts": 0}
+
+    # (mac, address) pairs seen in this batch
+    batch = {}
+    for obs in observations:
+        mac = canonical_mac(obs.get("mac"))
+        current = snapshot.get(obs["ip"])
+        if mac and current is not None:
+            batch[(mac, obs["ip"])] = current
+    if not batch:
+        return stats
+
+    batch_by_mac = {}
+    batch_by_address = {}
+    for mac, address in batch:
+        batch_by_mac.setdefault(mac, set()).add(address)
+        batch_by_address.setdefault(address, set()).add(mac)
+
+    by_pair = {}
+    by_mac = {}
+    by_address = {}
+    for row in _load_sightings(db, batch_by_mac, batch_by_address):
+        row_last_seen = ingest.as_utc(row.last_seen)
+        entry = (row.mac_address, row.address, row_last_seen)
+        by_pair[(row.mac_address, row.address)] = (row.id, row_last_seen)
+        by_mac.setdefault(row.mac_address, []).append(entry)
+        by_address.setdefault(row.address, []).append(entry)
+
+    window_start = now - CONFLICT_WINDOW
+    touched = []
+    created = []
+    conflicts = {}
+    moves = []
+
+    for (mac, address), current in batch.items():
+        previous = by_pair.get((mac, address))
+        if previous is None:
+            created.append({
+                "mac_address": mac, "address": address, "subnet_id": current.get("subnet_id"),
+                "first_seen": now, "last_seen": now,
+            })
+        elif (now - previous[1]).total_seconds() >= last_seen_granularity:
+            touched.append({"id": previous[0], "last_seen": now})
+
+        # Other MACs at this address: in the same batch, or seen here since this MAC was last here
+        rivals = batch_by_address[address] - {mac}
+        if previous is not None:
+            rivals |= {
+                other for other, _, seen in by_address.get(address, ())
+                if other != mac and seen > previous[1] and seen >= window_start
+            }
+        if rivals:
+            conflict = conflicts.setdefault((DUPLICATE_IP, address), {"subnet_id": current.get("subnet_id"), "members": set()})
+            conflict["members"] |= rivals | {mac}
+
+        # Other addresses of this MAC outside the batch (multi-homed hosts answer on several at once)
+        elsewhere = [
+            (other, seen) for _, other, seen in by_mac.get(mac, ())
+            if other != address and other not in batch_by_mac[mac]
+        ]
+        if not elsewhere:
+            continue
+        if previous is not None:
+            bounced = {other for other, seen in elsewhere if seen > previous[1] and seen >= window_start}
+            if bounced:
+                conflict = conflicts.setdefault((MAC_FLAP, mac), {"subnet_id": current.get("subnet_id"), "members": set()})
+                conflict["members"] |= bounced | {address}
+        else:
+            old_address = max(elsewhere, key=lambda item: item[1])[0]
+            moves.append((mac, old_address, address, current["id"]))
+
+    if created:
+        db.bulk_insert_mappings(models.MACSighting, created)
+        stats["sightings"] = len(created)
+    if touched:
+        db.execute(update(models.MACSighting), touched)
+
+    if moves:
+        stats["moved"] = len(moves)
+        db.add_all([
+            models.IPEvent(ip_id=ip_id, event_type=models.EventType.MAC_MOVED, old_value=old, new_value=new, timestamp=now)
+            for _, old, new, ip_id in moves
+        ])
+        if RETIRE_MOVED:
+            stats["retired"] = _retire(db, {old: mac for mac, old, _, _ in moves}, snapshot)
+
+    if conflicts:
+        stats["conflicts"] = _record_conflicts(db, conflicts, now)
+    return stats
+
+def _retire(db: Session, left_behind: dict, snapshot: dict):
+    """
+    Deletes DISCOVERED, unassigned records still carrying the MAC that moved away.
+    Allocated and reserved records are never touched.
+    """
+    stale = []
+    for chunk in _chunks(left_behind):
+        rows = db.query(models.IPAddress.id, models.IPAddress.address, models.IPAddress.mac_address).filter(
+            models.IPAddress.address.in_(chunk),
+            models.IPAddress.status == models.IPStatus.DISCOVERED,
+            models.IPAddress.device_id.is_(None),
+        )
+        stale.extend(row for row in rows if canonical_mac(row.mac_address) == left_behind[row.address])
+    if not stale:
+        return 0
+
+    ids = [row.id for row in stale]
+    for chunk in _chunks(ids):
+        # Bulk deletes skip ORM cascades
+        db.query(models.IPEvent).filter(models.IPEvent.ip_id.in_(chunk)).delete(synchronize_session=False)
+        db.query(models.IPService).filter(models.IPService.ip_id.in_(chunk)).delete(synchronize_session=False)
+        db.query(models.IPAddress).filter(models.IPAddress.id.in_(chunk)).delete(synchronize_session=False)
+    for row in stale:
+        snapshot.pop(row.address, None)
+    logger.info(f"Retired {len(stale)} stale discovered records after MAC moves")
+    return len(stale)
+
+def _record_conflicts(db: Session, conflicts: dict, now):
+    """
+    Upserts conflicts: an open conflict (seen within CONFLICT_WINDOW) for the same address
+    or MAC is extended, otherwise a new one is opened.
+    """
+    window_start = now - CONFLICT_WINDOW
+    existing = {}
+    for kind, column in ((DUPLICATE_IP, models.IPConflict.address), (MAC_FLAP, models.IPConflict.mac_address)):
+        keys = [key for k, key in conflicts if k == kind]
+        for chunk in _chunks(keys):
+            for row in db.query(models.IPConflict).filter(
+                models.IPConflict.kind == kind, column.in_(chunk), models.IPConflict.last_seen >= window_start
+            ):
+                existing[(kind, row.address if kind == DUPLICATE_IP else row.mac_address)] = row
+
+    for (kind, key), conflict in conflicts.items():
+        row = existing.get((kind, key))
+        if row is None:
+            db.add(models.IPConflict(
+                kind=kind,
+                address=key if kind == DUPLICATE_IP else None,
+                mac_address=key if kind == MAC_FLAP else None,
+                members=",".join(sorted(conflict["members"])),
+                subnet_id=conflict["subnet_id"],
+                first_seen=now,
+                last_seen=now,
+                occurrences=1,
+            ))
+            logger.warning(f"New {kind} conflict on {key}: {', '.join(sorted(conflict['members']))}")
+        else:
+            members = set((row.members or "").split(",")) - {""}
+            row.members = ",".join(sorted(members | conflict["members"]))
+            row.last_seen = now
+            row.occurrences = (row.occurrences or 0) + 1
+    return len(conflicts)
+
+def get_sightings(db: Session, mac: str):
+    return db.query(models.MACSighting).filter(
+        models.MACSighting.mac_address == canonical_mac(mac)
+    ).order_by(models.MACSighting.last_seen.desc()).all()
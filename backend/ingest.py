@@ -0,0 +1,262 @@
+import ipaddress
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+import models
+import oui
+import identity
+
+logger = logging.getLogger(__name__)
+
+ONLINE = "Online"
+OFFLINE = "Offline"
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+QUERY_CHUNK_SIZE = 500
+
+def as_utc(value: datetime):
+    # SQLite hands back naive datetimes even for timezone-aware columns
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def load_snapshot(db: Session, addresses=None, subnet_id: int = None):
+    """
+    Loads the current observed state of IP records into memory, keyed by address.
+    Only the columns needed for change detection are selected.
+    """
+    columns = (
+        models.IPAddress.id,
+        models.IPAddress.address,
+        models.IPAddress.mac_address,
+        models.IPAddress.vendor,
+        models.IPAddress.hostname,
+        models.IPAddress.healthcheck_status,
+        models.IPAddress.last_seen,
+        models.IPAddress.device_id,
+        models.IPAddress.subnet_id,
+    )
+
+    rows = []
+    if addresses is not None:
+        addresses = list(addresses)
+        for i in range(0, len(addresses), QUERY_CHUNK_SIZE):
+            chunk = addresses[i:i + QUERY_CHUNK_SIZE]
+            rows.extend(db.query(*columns).filter(models.IPAddress.address.in_(chunk)).all())
+    else:
+        query = db.query(*columns)
+        if subnet_id is not None:
+            query = query.filter(models.IPAddress.subnet_id == subnet_id)
+        rows = query.all()
+
+    return {
+        row.address: {
+            "id": row.id,
+            "mac_address": row.mac_address,
+            "vendor": row.vendor,
+            "hostname": row.hostname,
+            "healthcheck_status": row.healthcheck_status,
+            "last_seen": as_utc(row.last_seen),
+            "device_id": row.device_id,
+            "subnet_id": row.subnet_id,
+        }
+        for row in rows
+    }
+
+class SubnetIndex:
+    """
+    Longest prefix match of addresses to subnet ids: one dict lookup per prefix length.
+    """
+
+    def __init__(self, subnets):
+        # (id, network_address, prefix_length) rows; cache.subnet_index() keeps one built
+        self._by_length = {}
+        for subnet_id, network, prefix_length in subnets:
+            try:
+                net = ipaddress.ip_network(f"{network}/{prefix_length}", strict=False)
+            except ValueError:
+                continue
+            self._by_length.setdefault((net.version, net.prefixlen), {})[int(net.network_address)] = subnet_id
+        self._lengths = sorted(self._by_length, key=lambda key: -key[1])
+
+    def match(self, address: str):
+        ip = ipaddress.ip_address(address)
+        value = int(ip)
+        for version, length in self._lengths:
+            if version != ip.version:
+                continue
+            host_bits = ip.max_prefixlen - length
+            subnet_id = self._by_length[(version, length)].get(value >> host_bits << host_bits)
+            if subnet_id is not None:
+                return subnet_id
+        return None
+
+def apply_observations(db: Session, observations, subnet_id: int = None, snapshot: dict = None,
+                       last_seen_granularity: int = 300, now: datetime = None):
+    """
+    Compares observations against the stored state and writes only the fields that changed.
+
+    Each observation is a dict with an "ip" key and optional "mac", "hostname" and "online"
+    keys (online=None means the source says nothing about liveness).
+    last_seen is only rewritten once the stored value is older than last_seen_granularity seconds.
+    Unknown addresses are created as DISCOVERED when a subnet_id is given.
+    MAC sightings are tracked by identity.track.
+    Returns counters describing what was written.
+    """
+    now = now or datetime.now(timezone.utc)
+    observations = list(observations)
+    if snapshot is None:
+        snapshot = load_snapshot(db, [o["ip"] for o in observations])
+
+    stats = {"observed": len(observations), "created": 0, "updated": 0, "unchanged": 0, "events": 0}
+    updates = []
+    events = []
+    new_records = []
+    new_addresses = set()
+
+    for obs in observations:
+        address = obs["ip"]
+        mac = obs.get("mac")
+        hostname = obs.get("hostname")
+        online = obs.get("online")
+        current = snapshot.get(address)
+
+        if current is None:
+            # Several replies for one new address (duplicate IPs) create a single record
+            if subnet_id is None or address in new_addresses:
+                continue
+            new_addresses.add(address)
+            new_records.append({
+                "address": address,
+                "hostname": hostname,
+                "mac_address": mac,
+                "vendor": oui.lookup(mac),
+                "status": models.IPStatus.DISCOVERED,
+                "healthcheck_status": ONLINE if online else None,
+                "last_seen": now if online else None,
+                "subnet_id": subnet_id,
+            })
+            continue
+
+        changes = {}
+        if mac and mac != current["mac_address"]:
+            changes["mac_address"] = mac
+            if current["mac_address"]:
+                events.append((current["id"], models.EventType.MAC_CHANGED, current["mac_address"], mac))
+        # Resolved on MAC changes and for records that predate vendor lookup
+        if mac and ("mac_address" in changes or current["vendor"] is None):
+            vendor = oui.lookup(mac)
+            if vendor != current["vendor"]:
+                changes["vendor"] = vendor
+        if hostname and hostname != current["hostname"]:
+            changes["hostname"] = hostname
+            if current["hostname"]:
+                events.append((current["id"], models.EventType.HOSTNAME_CHANGED, current["hostname"], hostname))
+        if online is not None:
+            status = ONLINE if online else OFFLINE
+            if status != current["healthcheck_status"]:
+                changes["healthcheck_status"] = status
+                events.append((current["id"], models.EventType.STATUS_CHANGED, current["healthcheck_status"], status))
+            last_seen = current["last_seen"]
+            if online and (
+                "healthcheck_status" in changes
+                or last_seen is None
+                or (now - last_seen).total_seconds() >= last_seen_granularity
+            ):
+                changes["last_seen"] = now
+
+        if changes:
+            current.update(changes)
+            changes["id"] = current["id"]
+            updates.append(changes)
+        else:
+            stats["unchanged"] += 1
+
+    # Bulk UPDATE by primary key, grouped so each executemany shares one statement shape
+    groups = {}
+    for row in updates:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for rows in groups.values():
+        db.execute(update(models.IPAddress), rows)
+    stats["updated"] = len(updates)
+
+    # Core executemany inserts: no ORM objects for what can be thousands of new hosts
+    if new_records:
+        ids = db.execute(
+            insert(models.IPAddress).returning(models.IPAddress.id, sort_by_parameter_order=True), new_records
+        ).scalars().all()
+        for record, ip_id in zip(new_records, ids):
+            snapshot[record["address"]] = {
+                "id": ip_id,
+                "mac_address": record["mac_address"],
+                "vendor": record["vendor"],
+                "hostname": record["hostname"],
+                "healthcheck_status": record["healthcheck_status"],
+                "last_seen": record["last_seen"],
+                "device_id": None,
+                "subnet_id": record["subnet_id"],
+            }
+            events.append((ip_id, models.EventType.DISCOVERED, None, record["healthcheck_status"]))
+        stats["created"] = len(new_records)
+
+    if events:
+        db.execute(insert(models.IPEvent), [
+            {"ip_id": ip_id, "event_type": event_type, "old_value": old, "new_value": new, "timestamp": now}
+            for ip_id, event_type, old, new in events
+        ])
+        stats["events"] = len(events)
+
+    # MAC to address history: moves, duplicate IPs and MAC flaps
+    stats.update(identity.track(db, observations, snapshot, now, last_seen_granularity))
+    return stats
+
+def apply_services(db: Session, services: dict, snapshot: dict, last_seen_granularity: int = 300, now: datetime = None):
+    """
+    Reconciles the open ports reported by a service scan, keyed by address.
+    New or changed services are written, ports that are no longer open are removed.
+    """
+    now = now or datetime.now(timezone.utc)
+    ports_by_ip = {snapshot[address]["id"]: ports for address, ports in services.items() if address in snapshot}
+    ip_ids = list(ports_by_ip)
+
+    existing = {}
+    for i in range(0, len(ip_ids), QUERY_CHUNK_SIZE):
+        rows = db.query(models.IPService).filter(models.IPService.ip_id.in_(ip_ids[i:i + QUERY_CHUNK_SIZE])).all()
+        for row in rows:
+            existing[(row.ip_id, row.port, row.protocol)] = row
+
+    stats = {"created": 0, "updated": 0, "removed": 0}
+    seen = set()
+    for ip_id, ports in ports_by_ip.items():
+        for port in ports:
+            key = (ip_id, port["port"], port["protocol"])
+            seen.add(key)
+            row = existing.get(key)
+            if row is None:
+                db.add(models.IPService(
+                    ip_id=ip_id,
+                    port=port["port"],
+                    protocol=port["protocol"],
+                    service=port.get("service"),
+                    product=port.get("product"),
+                    version=port.get("version"),
+                    last_seen=now
+                ))
+                stats["created"] += 1
+                continue
+            fingerprint = (port.get("service"), port.get("product"), port.get("version"))
+            last_seen = as_utc(row.last_seen)
+            if fingerprint != (row.service, row.product, row.version):
+                row.service, row.product, row.version = fingerprint
+                row.last_seen = now
+                stats["updated"] += 1
+            elif last_seen is None or (now - last_seen).total_seconds() >= last_seen_granularity:
+                row.last_seen = now
+                stats["updated"] += 1
+
+    for key, row in existing.items():
+        if key not in seen:
+            db.delete(row)
+            stats["removed"] += 1
+    return stats
@@ -0,0 +1,373 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select, update
+import models
+import metrics
+import coordination
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Progress lives in memory; the subnet and scan_jobs rows are only refreshed this often,
+# which is also how often a cancel requested through another worker is noticed
+FLUSH_INTERVAL = 2.0
+# Finished jobs kept around for inspection
+HISTORY_SIZE = 100
+# An active job whose holder stopped refreshing its row for this long is reported as failed
+ORPHAN_AFTER = coordination.LEASE_TTL
+
+_SQLITE_MAX_INTEGER = 2 ** 63 - 1
+
+_lock = threading.Lock()
+_jobs = OrderedDict()
+_flusher = None
+
+class ScanJob:
+    """
+    Progress and control handle for one subnet scan.
+    Counters are plain attributes bumped by the scanning thread; readers only
+    ever see slightly stale values. Scanners poll should_stop() to cancel cooperatively.
+    Its id is that of its scan_jobs row, where every other worker reads it.
+    """
+
+    def __init__(self, job_id: int, subnet_id: int, time_budget: float = None):
+        self.id = job_id
+        self.subnet_id = subnet_id
+        self.network = None
+        self.backend = None
+        self.state = QUEUED
+        self.error = None
+        self.time_budget = time_budget or None
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+
+        self.total_probes = 0
+        self.probes_sent = 0
+        self.replies = 0
+        self.hosts_ingested = 0
+        # Set directly by scanners that report their own completion (nmap)
+        self.percent = None
+
+        self._cancel = threading.Event()
+        self._started = None
+        self._finished = None
+        self._flushed_progress = None
+
+    def start(self, network: str, backend: str, total_probes: int = 0):
+        self.network = network
+        self.backend = backend
+        self.total_probes = total_probes
+        self.state = RUNNING
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.monotonic()
+        _store(self)
+        _ensure_flusher()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def elapsed(self):
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.monotonic()) - self._started
+
+    def over_budget(self):
+        return self.time_budget is not None and self.elapsed > self.time_budget
+
+    def should_stop(self):
+        return self._cancel.is_set() or self.over_budget()
+
+    def progress(self):
+        if self.state == COMPLETED:
+            return 100.0
+        if self.percent is not None:
+            return min(self.percent, 99.0)
+        if not self.total_probes:
+            return 0.0
+        # Retries can push probes_sent past the planned total
+        return min(100.0 * self.probes_sent / self.total_probes, 99.0)
+
+    def eta(self):
+        if self.state not in ACTIVE_STATES:
+            return None
+        progress = self.progress()
+        if progress <= 0:
+            return None
+        return self.elapsed * (100.0 - progress) / progress
+
+    def finish(self, error: str = None):
+        if error:
+            self.state = FAILED
+            self.error = error
+        elif self._cancel.is_set():
+            self.state = CANCELLED
+        elif self.over_budget():
+            self.state = TIMED_OUT
+        else:
+            self.state = COMPLETED
+        self.finished_at = datetime.now(timezone.utc)
+        self._finished = time.monotonic()
+        if self.probes_sent:
+            metrics.probes_sent.labels(self.backend).inc(self.probes_sent)
+        _store(self)
+        _prune()
+
+    def as_dict(self):
+        elapsed = self.elapsed
+        return {
+            "id": self.id,
+            "subnet_id": self.subnet_id,
+            "network": self.network,
+            "backend": self.backend,
+            "state": self.state,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 3),
+            "time_budget": self.time_budget,
+            "progress": round(self.progress(), 1),
+            "eta_seconds": round(self.eta(), 1) if self.eta() is not None else None,
+            "total_probes": self.total_probes,
+            "probes_sent": self.probes_sent,
+            "replies": self.replies,
+            "hosts_ingested": self.hosts_ingested,
+            "probes_per_second": round(self.probes_sent / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+def _columns(job: ScanJob):
+    return {
+        "state": job.state,
+        "network": job.network,
+        "backend": job.backend,
+        "error": job.error,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "updated_at": datetime.now(timezone.utc),
+        "progress": round(job.progress(), 1),
+        # A sweep of a large IPv6 subnet plans more probes than SQLite's INTEGER holds
+        "total_probes": min(job.total_probes, _SQLITE_MAX_INTEGER),
+        "probes_sent": job.probes_sent,
+        "replies": job.replies,
+        "hosts_ingested": job.hosts_ingested,
+    }
+
+def _store(job: ScanJob):
+    db = SessionLocal()
+    try:
+        db.execute(update(models.ScanJob).where(models.ScanJob.id == job.id).values(**_columns(job)))
+        db.commit()
+    except Exception as e:
+        logger.warning(f"Failed to store scan job {job.id}: {e}")
+    finally:
+        db.close()
+
+def _naive(value: datetime):
+    # SQLite hands back naive datetimes
+    return value.replace(tzinfo=None) if value is not None else None
+
+def _row_dict(row: models.ScanJob, now: datetime):
+    """
+    The as_dict() of a job run by another process, from its scan_jobs row.
+    """
+    now = _naive(now)
+    state, error = row.state, row.error
+    if state in ACTIVE_STATES and _naive(row.updated_at) < now - timedelta(seconds=ORPHAN_AFTER):
+        state, error = FAILED, "The process running this scan stopped"
+    started = _naive(row.started_at)
+    elapsed = ((_naive(row.finished_at) or now) - started).total_seconds() if started else 0.0
+    progress = row.progress if state != COMPLETED else 100.0
+    eta = elapsed * (100.0 - progress) / progress if state in ACTIVE_STATES and progress > 0 else None
+    return {
+        "id": row.id,
+        "subnet_id": row.subnet_id,
+        "network": row.network,
+        "backend": row.backend,
+        "state": state,
+        "error": error,
+        "created_at": row.created_at,
+        "started_at": row.started_at,
+        "finished_at": row.finished_at,
+        "elapsed_seconds": round(elapsed, 3),
+        "time_budget": row.time_budget,
+        "progress": round(progress, 1),
+        "eta_seconds": round(eta, 1) if eta is not None else None,
+        "total_probes": row.total_probes,
+        "probes_sent": row.probes_sent,
+        "replies": row.replies,
+        "hosts_ingested": row.hosts_ingested,
+        "probes_per_second": round(row.probes_sent / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+def _job_dict(row: models.ScanJob, now: datetime):
+    # Jobs of this process report their live counters
+    job = _jobs.get(row.id)
+    return job.as_dict() if job is not None else _row_dict(row, now)
+
+def create_job(subnet_id: int, time_budget: float = None):
+    """
+    Registers a new job. Only one active job per subnet is allowed in this process;
+    the subnet claim (see coordination.py) rules out the others.
+    """
+    with _lock:
+        for job in _jobs.values():
+            if job.subnet_id == subnet_id and job.state in ACTIVE_STATES:
+                raise ValueError(f"Subnet {subnet_id} is already being scanned (job {job.id})")
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            row = models.ScanJob(subnet_id=subnet_id, holder=coordination.INSTANCE_ID, state=QUEUED,
+                                 time_budget=time_budget or None, created_at=now, updated_at=now)
+            db.add(row)
+            db.commit()
+            job_id = row.id
+        finally:
+            db.close()
+        job = ScanJob(job_id, subnet_id, time_budget)
+        job.created_at = now
+        _jobs[job.id] = job
+    return job
+
+def discard_job(job: ScanJob):
+    """
+    Forgets a job that never started, e.g. because another process claimed the subnet.
+    """
+    with _lock:
+        _jobs.pop(job.id, None)
+    db = SessionLocal()
+    try:
+        db.execute(delete(models.ScanJob).where(models.ScanJob.id == job.id))
+        db.commit()
+    finally:
+        db.close()
+
+def get_job(db, job_id: int):
+    """
+    The job as a dict, whichever process runs it, or None.
+    """
+    row = db.query(models.ScanJob).filter(models.ScanJob.id == job_id).first()
+    return _job_dict(row, datetime.now(timezone.utc)) if row is not None else None
+
+def list_jobs(db, active_only: bool = False):
+    query = db.query(models.ScanJob)
+    if active_only:
+        query = query.filter(models.ScanJob.state.in_(ACTIVE_STATES))
+    now = datetime.now(timezone.utc)
+    jobs = [_job_dict(row, now) for row in query.order_by(models.ScanJob.id.desc())]
+    if active_only:
+        # Orphaned jobs still have an active state in their rows
+        jobs = [job for job in jobs if job["state"] in ACTIVE_STATES]
+    return jobs
+
+def cancel_job(db, job_id: int):
+    """
+    Asks a job to stop, whichever process runs it: that process sees cancel_requested
+    on its next flush. Returns the job as a dict, or None.
+    """
+    db.execute(
+        update(models.ScanJob)
+        .where(models.ScanJob.id == job_id, models.ScanJob.state.in_(ACTIVE_STATES))
+        .values(cancel_requested=True)
+    )
+    db.commit()
+    job = _jobs.get(job_id)
+    if job is not None and job.state in ACTIVE_STATES:
+        logger.info(f"Cancelling scan job {job_id} for subnet {job.subnet_id}")
+        job.cancel()
+    return get_job(db, job_id)
+
+@metrics.register_collector
+def _collect_metrics():
+    counts = dict.fromkeys((QUEUED, RUNNING, COMPLETED, CANCELLED, TIMED_OUT, FAILED), 0)
+    rate = 0.0
+    for job in list(_jobs.values()):
+        counts[job.state] += 1
+        if job.state == RUNNING and job.elapsed > 0:
+            rate += job.probes_sent / job.elapsed
+    for state, count in counts.items():
+        metrics.scan_jobs.labels(state).set(count)
+    metrics.scan_probe_rate.set(rate)
+
+def _ensure_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, daemon=True)
+            _flusher.start()
+
+def _flush_loop():
+    """
+    Every FLUSH_INTERVAL, copies the progress of running jobs to their subnet rows (only
+    values that changed) and to their scan_jobs rows, and cancels the jobs another worker
+    asked to stop. Exits once no job is active.
+    """
+    global _flusher
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with _lock:
+            active = [job for job in _jobs.values() if job.state in ACTIVE_STATES]
+            if not active:
+                _flusher = None
+                return
+        changed = []
+        for job in active:
+            progress = int(job.progress())
+            if job.state == RUNNING and progress != job._flushed_progress:
+                job._flushed_progress = progress
+                changed.append((job.subnet_id, progress))
+        db = SessionLocal()
+        try:
+            # Written every time: it is also the heartbeat that tells other workers the job is alive
+            for job in active:
+                db.execute(update(models.ScanJob).where(models.ScanJob.id == job.id).values(**_columns(job)))
+            cancelled = set(db.execute(select(models.ScanJob.id).where(
+                models.ScanJob.id.in_([job.id for job in active]), models.ScanJob.cancel_requested.is_(True)
+            )).scalars())
+            for job in active:
+                if job.id in cancelled and not job.cancelled:
+                    logger.info(f"Cancelling scan job {job.id} for subnet {job.subnet_id}, requested through another worker")
+                    job.cancel()
+            for subnet_id, progress in changed:
+                # A scan that just finished has already written its final state
+                db.execute(
+                    update(models.Subnet)
+                    .where(models.Subnet.id == subnet_id, models.Subnet.scan_status == "Scanning")
+                    .values(scan_progress=progress)
+                )
+            db.commit()
+        except Exception as e:
+            logger.warning(f"Failed to flush scan jobs: {e}")
+        finally:
+            db.close()
+
+def _prune():
+    with _lock:
+        finished = [job_id for job_id, job in _jobs.items() if job.state not in ACTIVE_STATES]
+        for job_id in finished[:max(0, len(finished) - HISTORY_SIZE)]:
+            del _jobs[job_id]
+    db = SessionLocal()
+    try:
+        kept = select(models.ScanJob.id).order_by(models.ScanJob.id.desc()).limit(HISTORY_SIZE)
+        db.execute(delete(models.ScanJob).where(models.ScanJob.state.not_in(ACTIVE_STATES), models.ScanJob.id.not_in(kept)))
+        db.commit()
+    except Exception as e:
+        logger.warning(f"Failed to prune scan jobs: {e}")
+    finally:
+        db.close()
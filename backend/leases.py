@@ -0,0 +1,414 @@
+import argparse
+import codecs
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import update
+import cache
+import ingest
+import metrics
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Lease files are polled this often; each poll only reads what was appended since the last one
+POLL_INTERVAL = 2
+# A backlog (first read, or a burst) is read and written in chunks of this many bytes
+READ_CHUNK_SIZE = 1024 * 1024
+
+FORMATS = ("dhcpd", "kea", "dnsmasq")
+
+_DHCPD_LEASE = re.compile(r"^lease\s+(\S+)\s*\{")
+_DHCPD_DATE = re.compile(r"^\d\s+(\d{4})/(\d{2})/(\d{2})\s+(\d{2}):(\d{2}):(\d{2})$")
+
+def _from_timestamp(value):
+    value = int(value)
+    return datetime.fromtimestamp(value, timezone.utc) if value > 0 else None
+
+class _Parser:
+    """
+    Incremental line parser: feed() accepts arbitrary chunks of the file and returns the
+    lease records completed by it. Partial lines (and UTF-8 sequences) wait for the next chunk.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+
+    def feed(self, data: bytes):
+        lines = (self._partial + self._decoder.decode(data)).split("\n")
+        self._partial = lines.pop()
+        leases = []
+        for line in lines:
+            lease = self.parse_line(line.strip())
+            if lease is not None:
+                leases.append(lease)
+        return leases
+
+class DhcpdParser(_Parser):
+    """
+    ISC dhcpd.leases: "lease <ip> { ... }" blocks, appended on every change. The last
+    block for an address wins.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lease = None
+
+    def parse_line(self, line: str):
+        match = _DHCPD_LEASE.match(line)
+        if match:
+            self._lease = {"ip": match.group(1), "mac": None, "hostname": None, "expires": None, "active": False}
+            return None
+        lease = self._lease
+        if lease is None:
+            return None
+        if line == "}":
+            self._lease = None
+            now = datetime.now(timezone.utc)
+            lease["active"] = lease["active"] and (lease["expires"] is None or lease["expires"] > now)
+            return lease
+        statement = line.rstrip(";").strip()
+        if statement.startswith("binding state "):
+            lease["active"] = statement.split()[-1] == "active"
+        elif statement.startswith("hardware ethernet "):
+            lease["mac"] = statement.split()[-1].lower()
+        elif statement.startswith("client-hostname "):
+            lease["hostname"] = statement[len("client-hostname "):].strip('"') or None
+        elif statement.startswith("ends "):
+            value = statement[len("ends "):]
+            if value.startswith("epoch "):
+                lease["expires"] = _from_timestamp(value.split()[1])
+            else:
+                date = _DHCPD_DATE.match(value)
+                if date:
+                    lease["expires"] = datetime(*map(int, date.groups()), tzinfo=timezone.utc)
+        return None
+
+class KeaParser(_Parser):
+    """
+    Kea memfile CSV (kea-leases4.csv / kea-leases6.csv): a header line, then one row per
+    lease change. state 0 is a valid lease; released leases are written with valid_lifetime 0.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._columns = None
+
+    def parse_line(self, line: str):
+        if not line:
+            return None
+        fields = line.split(",")
+        if fields[0] == "address":
+            self._columns = {name: i for i, name in enumerate(fields)}
+            return None
+        columns = self._columns
+        if columns is None or len(fields) < len(columns):
+            return None
+        # Kea escapes commas inside values
+        value = lambda name: fields[columns[name]].replace("&#x2c", ",") if name in columns else ""
+        expires = _from_timestamp(value("expire") or 0)
+        active = (
+            value("state") in ("", "0")
+            and int(value("valid_lifetime") or 0) > 0
+            and expires is not None and expires > datetime.now(timezone.utc)
+        )
+        return {
+            "ip": value("address"),
+            "mac": value("hwaddr").lower() or None,
+            "hostname": value("hostname").rstrip(".") or None,
+            "expires": expires,
+            "active": active,
+        }
+
+class DnsmasqParser(_Parser):
+    """
+    dnsmasq.leases: "<expiry> <mac> <ip> <hostname|*> <client id>" per line. dnsmasq rewrites
+    the whole file on every change, so it is a snapshot rather than a log.
+    """
+
+    def parse_line(self, line: str):
+        fields = line.split()
+        if len(fields) < 4 or fields[0] == "duid":
+            return None
+        expires = _from_timestamp(fields[0])
+        return {
+            "ip": fields[2],
+            "mac": fields[1].lower(),
+            "hostname": None if fields[3] == "*" else fields[3],
+            "expires": expires,
+            "active": expires is None or expires > datetime.now(timezone.utc),
+        }
+
+PARSERS = {"dhcpd": DhcpdParser, "kea": KeaParser, "dnsmasq": DnsmasqParser}
+# Formats whose file is rewritten whole: re-read on every modification, and leases missing
+# from the new copy are released
+SNAPSHOT_FORMATS = ("dnsmasq",)
+
+def parse_sources(value: str):
+    """
+    Parses the dhcp_lease_files setting: comma-separated paths, each optionally prefixed
+    with its format ("kea:/var/lib/kea/kea-leases4.csv"). Without a prefix the format is
+    guessed from the file name.
+    """
+    sources = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        fmt, _, path = item.partition(":")
+        if fmt not in FORMATS:
+            path = item
+            name = os.path.basename(path).lower()
+            fmt = "kea" if name.endswith(".csv") else "dnsmasq" if "dnsmasq" in name else "dhcpd"
+        sources.append((fmt, path))
+    return sources
+
+class LeaseFile:
+    """
+    Follows one lease file from the last byte offset read. The file is read again from the
+    start only when it was replaced or truncated (dhcpd and Kea periodically rewrite it to
+    drop superseded records) or, for snapshot formats, modified.
+    """
+
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.format = fmt
+        self.offset = 0
+        self.size = 0
+        self.records = 0
+        self.last_read = None
+        self.error = None
+        self._stat_key = None
+        self._parser = None
+        self._known = set()
+
+    @property
+    def behind(self):
+        return self.offset < self.size
+
+    def as_dict(self):
+        return {
+            "path": self.path,
+            "format": self.format,
+            "offset": self.offset,
+            "size": self.size,
+            "records": self.records,
+            "last_read": self.last_read,
+            "error": self.error,
+        }
+
+    def read(self):
+        """
+        Returns the lease records written since the last call (at most READ_CHUNK_SIZE bytes).
+        """
+        st = os.stat(self.path)
+        self.size = st.st_size
+        snapshot = self.format in SNAPSHOT_FORMATS
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns if snapshot else None)
+        if self._parser is None or key != self._stat_key or st.st_size < self.offset:
+            if self._parser is not None:
+                logger.info(f"Lease file {self.path} was rewritten, reading it from the start")
+            self._stat_key = key
+            self._parser = PARSERS[self.format]()
+            self.offset = 0
+        elif st.st_size == self.offset:
+            return []
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read() if snapshot else f.read(READ_CHUNK_SIZE)
+        self.offset += len(data)
+        leases = self._parser.feed(data)
+
+        if snapshot:
+            current = {lease["ip"] for lease in leases}
+            leases.extend(
+                {"ip": ip, "mac": None, "hostname": None, "expires": None, "active": False}
+                for ip in self._known - current
+            )
+            self._known = current
+        self.records += len(leases)
+        self.last_read = datetime.now(timezone.utc)
+        self.error = None
+        metrics.dhcp_lease_records.labels(self.format).inc(len(leases))
+        return leases
+
+def apply_leases(db, leases, now: datetime = None):
+    """
+    Maps lease records onto IPAddress rows. Active leases go through the usual change
+    detection (MAC, vendor, new DISCOVERED records inside known subnets); lease hostnames
+    only fill empty hostnames. lease_expires is then written for every leased address in
+    one bulk update, and cleared for released or expired ones. The caller commits.
+    """
+    latest = {}
+    for lease in leases:
+        if lease["ip"]:
+            latest[lease["ip"]] = lease
+    if not latest:
+        return {"leases": 0, "created": 0, "updated": 0}
+
+    snapshot = ingest.load_snapshot(db, list(latest))
+    subnets = cache.subnet_index(db)
+    groups = {}
+    for address, lease in latest.items():
+        if not lease["active"] or not lease["mac"]:
+            continue
+        current = snapshot.get(address)
+        subnet_id = current["subnet_id"] if current is not None else subnets.match(address)
+        if subnet_id is None:
+            continue
+        hostname = lease["hostname"] if current is None or not current["hostname"] else None
+        # A lease says nothing about whether the host is up right now
+        groups.setdefault(subnet_id, []).append({"ip": address, "mac": lease["mac"], "hostname": hostname, "online": None})
+
+    stats = {"leases": len(latest), "created": 0, "updated": 0}
+    for subnet_id, group in groups.items():
+        result = ingest.apply_observations(db, group, subnet_id=subnet_id, snapshot=snapshot, now=now)
+        stats["created"] += result["created"]
+        stats["updated"] += result["updated"]
+
+    rows = [
+        {"id": snapshot[address]["id"], "lease_expires": lease["expires"] if lease["active"] else None}
+        for address, lease in latest.items()
+        if address in snapshot
+    ]
+    for i in range(0, len(rows), ingest.QUERY_CHUNK_SIZE):
+        db.execute(update(models.IPAddress), rows[i:i + ingest.QUERY_CHUNK_SIZE])
+    return stats
+
+# Settings row with the status of every followed file, served by GET /leases/sources on every worker
+STATUS_KEY = "dhcp_lease_files_status"
+
+def _store_status(db, files):
+    # A bookkeeping row, like the history watermark: the settings cache is not bumped
+    setting = db.query(models.Setting).filter(models.Setting.key == STATUS_KEY).first()
+    if not setting:
+        setting = models.Setting(key=STATUS_KEY, description="Status of the followed DHCP lease files")
+        db.add(setting)
+    setting.value = json.dumps([lease_file.as_dict() for lease_file in files], default=str)
+    db.commit()
+
+class LeaseFollower:
+    """
+    Polls the configured lease files in a daemon thread and writes what changed.
+    """
+
+    def __init__(self, sources):
+        self.sources = list(sources)
+        self.files = [LeaseFile(path, fmt) for fmt, path in self.sources]
+        self._stop = threading.Event()
+        self._thread = None
+        self._stored = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="lease-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        logger.info(f"Following {len(self.files)} DHCP lease files")
+        while not self._stop.is_set():
+            for lease_file in self.files:
+                self.poll(lease_file)
+            self.store_status()
+            self._stop.wait(POLL_INTERVAL)
+
+    def store_status(self):
+        """
+        Writes the status of the files for the other workers, when it changed.
+        """
+        current = [lease_file.as_dict() for lease_file in self.files]
+        if current == self._stored:
+            return
+        db = SessionLocal()
+        try:
+            _store_status(db, self.files)
+            self._stored = current
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to store the lease file status: {e}")
+        finally:
+            db.close()
+
+    def poll(self, lease_file: LeaseFile):
+        db = SessionLocal()
+        try:
+            while not self._stop.is_set():
+                leases = lease_file.read()
+                if leases:
+                    stats = apply_leases(db, leases)
+                    db.commit()
+                    logger.debug(f"{lease_file.path}: {stats['leases']} leases, {stats['created']} new, {stats['updated']} changed IPs")
+                if not lease_file.behind:
+                    break
+        except OSError as e:
+            if lease_file.error != str(e):
+                logger.warning(f"Cannot read lease file {lease_file.path}: {e}")
+            lease_file.error = str(e)
+        except Exception as e:
+            db.rollback()
+            lease_file.error = str(e)
+            logger.error(f"Lease ingestion from {lease_file.path} failed: {e}")
+        finally:
+            db.close()
+
+_follower = None
+_follower_lock = threading.Lock()
+
+def configure(value: str):
+    """
+    Starts, restarts or stops the follower to match the dhcp_lease_files setting.
+    Called every Brain cycle.
+    """
+    global _follower
+    sources = parse_sources(value)
+    with _follower_lock:
+        if _follower is not None and (_follower.sources != sources or not _follower.is_alive()):
+            _follower.stop()
+            _follower = None
+        if sources and _follower is None:
+            _follower = LeaseFollower(sources)
+            _follower.start()
+
+def status(db):
+    """
+    The followed files, live on the Brain leader and as last stored (every POLL_INTERVAL) elsewhere.
+    """
+    follower = _follower
+    if follower:
+        return [lease_file.as_dict() for lease_file in follower.files]
+    setting = db.query(models.Setting).filter(models.Setting.key == STATUS_KEY).first()
+    if not setting or not setting.value:
+        return []
+    # Files dropped from the setting since the leader last stored the status are left out
+    configured = db.query(models.Setting).filter(models.Setting.key == "dhcp_lease_files").first()
+    sources = parse_sources(configured.value if configured else "")
+    return [entry for entry in json.loads(setting.value) if (entry["format"], entry["path"]) in sources]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DHCP lease file tools")
+    parser.add_argument("sources", nargs="+", help="lease files, optionally prefixed with dhcpd:, kea: or dnsmasq:")
+    parser.add_argument("--dry-run", action="store_true", help="print the parsed leases instead of importing them")
+    args = parser.parse_args()
+
+    for fmt, path in parse_sources(",".join(args.sources)):
+        lease_file = LeaseFile(path, fmt)
+        if args.dry_run:
+            while True:
+                for lease in lease_file.read():
+                    print(f"{lease['ip']}\t{lease['mac'] or '-'}\t{lease['hostname'] or '-'}\t{lease['expires'] or '-'}\t{'active' if lease['active'] else 'inactive'}")
+                if not lease_file.behind:
+                    break
+        else:
+            LeaseFollower([(fmt, path)]).poll(lease_file)
+            print(lease_file.as_dict())
@@ -1,26 +1,54 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Response, Header
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List
+from datetime import datetime, timedelta, timezone
 
+import logging
 import threading
 import models
 import schemas
 import crud
+import history
+import jobs
+import metrics
+import profiling
+import leases
+import runtime
+import coordination
+import retention
+import backup
 from database import SessionLocal, engine, get_db
-from discovery import start_brain_loop
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Create tables (Alembic should handle this in production, but good for quick dev)
 # models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="IPAM API", version="0.3.0")
 
+def _run_brain():
+    # The scanning stack (scapy, dnspython) is imported here, off the startup path
+    from discovery import start_brain_loop
+    start_brain_loop()
+
 # Start discovery background thread
 @app.on_event("startup")
 def startup_event():
-    thread = threading.Thread(target=start_brain_loop, daemon=True)
+    if runtime.API_ONLY:
+        logger.info("API_ONLY is set: not starting the discovery Brain")
+        return
+    thread = threading.Thread(target=_run_brain, daemon=True)
     thread.start()
 
+@app.on_event("shutdown")
+def shutdown_event():
+    # Hand the Brain over now instead of when the lease expires
+    if coordination.holds(coordination.BRAIN):
+        coordination.release(coordination.BRAIN)
+
 # Configure CORS for local development
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +58,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency and per-request DB time for /metrics
+app.add_middleware(metrics.PrometheusMiddleware)
+metrics.instrument_engine(engine)
+
+# Opt-in per-request SQL profiling (QUERY_PROFILING=1 or strict)
+if profiling.ENABLED:
+    app.add_middleware(profiling.QueryProfilingMiddleware)
+    profiling.instrument_engine(engine)
+
 @app.get("/")
 async def root():
     return {"message": "IPAM API is running"}
@@ -38,6 +75,19 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/coordination", response_model=schemas.CoordinationStatus)
+def get_coordination(db: Session = Depends(get_db)):
+    return {
+        "instance_id": coordination.INSTANCE_ID,
+        "api_only": runtime.API_ONLY,
+        "brain_leader": coordination.holds(coordination.BRAIN),
+        "leases": coordination.list_leases(db),
+    }
+
 @app.get("/stats")
 async def get_stats(db: Session = Depends(get_db)):
     subnet_count = db.query(models.Subnet).count()
@@ -62,9 +112,11 @@ def create_subnet(subnet: schemas.SubnetCreate, db: Session = Depends(get_db)):
     return crud.create_subnet(db=db, subnet=subnet)
 
 @app.get("/subnets/", response_model=List[schemas.Subnet])
-def read_subnets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    subnets = crud.get_subnets(db, skip=skip, limit=limit)
-    return subnets
+def read_subnets(skip: int = 0, limit: int = 100, tag: str = None, db: Session = Depends(get_db)):
+    try:
+        return crud.get_subnets(db, skip=skip, limit=limit, tag=tag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/subnets/{subnet_id}", response_model=schemas.Subnet)
 def read_subnet(subnet_id: int, db: Session = Depends(get_db)):
@@ -80,6 +132,59 @@ def get_next_available_ip(subnet_id: int, pool_id: int = None, db: Session = Dep
         raise HTTPException(status_code=404, detail="No available IP addresses found in the specified range")
     return {"address": ip}
 
+@app.get("/planning/next-free")
+def get_next_free_subnet(container: str, prefix_length: int, db: Session = Depends(get_db)):
+    try:
+        network = crud.find_first_free_subnet(db, container, prefix_length)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not network:
+        raise HTTPException(status_code=404, detail=f"No free /{prefix_length} found in {container}")
+    return {"network": network}
+
+@app.get("/planning/free-blocks")
+def get_free_blocks(container: str, min_prefix_length: int = None, limit: int = 100, db: Session = Depends(get_db)):
+    try:
+        return crud.find_free_blocks(db, container, min_prefix_length, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/planning/fragmentation")
+def get_fragmentation(container: str, db: Session = Depends(get_db)):
+    try:
+        return crud.get_fragmentation_report(db, container)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/subnets/{subnet_id}/availability", response_model=schemas.Availability)
+def read_subnet_availability(subnet_id: int, start: datetime = None, end: datetime = None, db: Session = Depends(get_db)):
+    if crud.get_subnet(db, subnet_id=subnet_id) is None:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    settings = crud.get_settings(db)
+    return history.get_subnet_availability(db, subnet_id, start, end, settings["history_retention_days"])
+
+@app.get("/subnets/{subnet_id}/rtt", response_model=schemas.RTTStats)
+def read_subnet_rtt(subnet_id: int, db: Session = Depends(get_db)):
+    db_subnet = crud.get_subnet(db, subnet_id=subnet_id)
+    if db_subnet is None:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    return crud.get_subnet_rtt(db, db_subnet)
+
+@app.post("/subnets/{subnet_id}/scan", response_model=schemas.ScanJob)
+def scan_subnet(subnet_id: int, db: Session = Depends(get_db)):
+    if crud.get_subnet(db, subnet_id=subnet_id) is None:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    if runtime.API_ONLY:
+        raise HTTPException(status_code=503, detail="Scanning is disabled on this instance (API_ONLY)")
+    from discovery import start_subnet_scan
+    try:
+        job = start_subnet_scan(subnet_id, crud.get_settings(db))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.as_dict()
+
 @app.put("/subnets/{subnet_id}", response_model=schemas.Subnet)
 def update_subnet(subnet_id: int, subnet: schemas.SubnetUpdate, db: Session = Depends(get_db)):
     db_subnet = crud.update_subnet(db, subnet_id=subnet_id, subnet=subnet)
@@ -100,9 +205,15 @@ def create_device(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
     return crud.create_device(db=db, device=device)
 
 @app.get("/devices/", response_model=List[schemas.DeviceWithIPs])
-def read_devices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    devices = crud.get_devices(db, skip=skip, limit=limit)
-    return devices
+def read_devices(skip: int = 0, limit: int = 100, tag: str = None, db: Session = Depends(get_db)):
+    try:
+        return crud.get_devices(db, skip=skip, limit=limit, tag=tag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/devices/search", response_model=List[schemas.DeviceWithIPs])
+def search_devices(q: str, limit: int = 20, db: Session = Depends(get_db)):
+    return crud.search_devices(db, q, limit=limit)
 
 @app.get("/devices/{device_id}", response_model=schemas.DeviceWithIPs)
 def read_device(device_id: int, db: Session = Depends(get_db)):
@@ -141,9 +252,11 @@ def create_ip_address(ip: schemas.IPAddressCreate, db: Session = Depends(get_db)
     return crud.create_ip_address(db=db, ip=ip)
 
 @app.get("/ips/", response_model=List[schemas.IPAddress])
-def read_ips(subnet_id: int = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    ips = crud.get_ip_addresses(db, subnet_id=subnet_id, skip=skip, limit=limit)
-    return ips
+def read_ips(subnet_id: int = None, skip: int = 0, limit: int = 100, tag: str = None, db: Session = Depends(get_db)):
+    try:
+        return crud.get_ip_addresses(db, subnet_id=subnet_id, skip=skip, limit=limit, tag=tag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/ips/{ip_id}", response_model=schemas.IPAddress)
 def read_ip(ip_id: int, db: Session = Depends(get_db)):
@@ -152,6 +265,27 @@ def read_ip(ip_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="IP address not found")
     return db_ip
 
+@app.get("/ips/{ip_id}/events", response_model=List[schemas.IPEvent])
+def read_ip_events(ip_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    if crud.get_ip_address(db, ip_id=ip_id) is None:
+        raise HTTPException(status_code=404, detail="IP address not found")
+    return crud.get_ip_events(db, ip_id=ip_id, skip=skip, limit=limit)
+
+@app.get("/ips/{ip_id}/services", response_model=List[schemas.IPService])
+def read_ip_services(ip_id: int, db: Session = Depends(get_db)):
+    if crud.get_ip_address(db, ip_id=ip_id) is None:
+        raise HTTPException(status_code=404, detail="IP address not found")
+    return crud.get_ip_services(db, ip_id=ip_id)
+
+@app.get("/ips/{ip_id}/availability", response_model=schemas.Availability)
+def read_ip_availability(ip_id: int, start: datetime = None, end: datetime = None, db: Session = Depends(get_db)):
+    if crud.get_ip_address(db, ip_id=ip_id) is None:
+        raise HTTPException(status_code=404, detail="IP address not found")
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    settings = crud.get_settings(db)
+    return history.get_ip_availability(db, ip_id, start, end, settings["history_retention_days"])
+
 @app.put("/ips/{ip_id}", response_model=schemas.IPAddress)
 def update_ip(ip_id: int, ip: schemas.IPAddressUpdate, db: Session = Depends(get_db)):
     db_ip = crud.update_ip_address(db, ip_id=ip_id, ip=ip)
@@ -169,12 +303,19 @@ def delete_ip(ip_id: int, db: Session = Depends(get_db)):
 # IP Range Endpoints
 @app.post("/ranges/", response_model=schemas.IPRange)
 def create_ip_range(ip_range: schemas.IPRangeCreate, db: Session = Depends(get_db)):
-    return crud.create_ip_range(db=db, ip_range=ip_range)
+    try:
+        return crud.create_ip_range(db=db, ip_range=ip_range)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/ranges/", response_model=List[schemas.IPRange])
 def read_ip_ranges(subnet_id: int = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return crud.get_ip_ranges(db, subnet_id=subnet_id, skip=skip, limit=limit)
 
+@app.get("/ranges/stats", response_model=List[schemas.IPRangeStats])
+def read_ip_ranges_stats(subnet_id: int = None, db: Session = Depends(get_db)):
+    return crud.get_ip_ranges_stats(db, subnet_id=subnet_id)
+
 @app.get("/ranges/{range_id}", response_model=schemas.IPRange)
 def read_ip_range(range_id: int, db: Session = Depends(get_db)):
     db_range = crud.get_ip_range(db, ip_range_id=range_id)
@@ -182,9 +323,19 @@ def read_ip_range(range_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="IP Range not found")
     return db_range
 
+@app.get("/ranges/{range_id}/stats", response_model=schemas.IPRangeStats)
+def read_ip_range_stats(range_id: int, db: Session = Depends(get_db)):
+    stats = crud.get_ip_range_stats(db, ip_range_id=range_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="IP Range not found")
+    return stats
+
 @app.put("/ranges/{range_id}", response_model=schemas.IPRange)
 def update_ip_range(range_id: int, ip_range: schemas.IPRangeUpdate, db: Session = Depends(get_db)):
-    db_range = crud.update_ip_range(db, ip_range_id=range_id, ip_range=ip_range)
+    try:
+        db_range = crud.update_ip_range(db, ip_range_id=range_id, ip_range=ip_range)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if db_range is None:
         raise HTTPException(status_code=404, detail="IP Range not found")
     return db_range
@@ -196,6 +347,110 @@ def delete_ip_range(range_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="IP Range not found")
     return {"message": "IP Range deleted"}
 
+# Batch Endpoint
+@app.post("/batch", response_model=schemas.BatchResponse)
+def apply_batch(request: schemas.BatchRequest, response: Response, idempotency_key: str = Header(None),
+                db: Session = Depends(get_db)):
+    try:
+        result = crud.apply_batch(db, request.operations, idempotency_key)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result["applied"]:
+        response.status_code = 400
+    return result
+
+# Scan Job Endpoints
+@app.get("/scans", response_model=List[schemas.ScanJob])
+def read_scan_jobs(active: bool = False, db: Session = Depends(get_db)):
+    return jobs.list_jobs(db, active_only=active)
+
+@app.get("/scans/{job_id}", response_model=schemas.ScanJob)
+def read_scan_job(job_id: int, db: Session = Depends(get_db)):
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job
+
+@app.post("/scans/{job_id}/cancel", response_model=schemas.ScanJob)
+def cancel_scan_job(job_id: int, db: Session = Depends(get_db)):
+    job = jobs.cancel_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job
+
+# MAC Vendor Endpoints
+@app.post("/oui/lookup")
+def lookup_mac_vendors(request: schemas.MACLookup):
+    return crud.lookup_vendors(request.macs)
+
+# Conflict Endpoints
+@app.get("/conflicts", response_model=List[schemas.IPConflict])
+def read_conflicts(kind: str = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return crud.get_conflicts(db, kind=kind, skip=skip, limit=limit)
+
+@app.delete("/conflicts/{conflict_id}")
+def delete_conflict(conflict_id: int, db: Session = Depends(get_db)):
+    db_conflict = crud.delete_conflict(db, conflict_id=conflict_id)
+    if db_conflict is None:
+        raise HTTPException(status_code=404, detail="Conflict not found")
+    return {"message": "Conflict dismissed"}
+
+@app.get("/macs/{mac}/sightings", response_model=List[schemas.MACSighting])
+def read_mac_sightings(mac: str, db: Session = Depends(get_db)):
+    try:
+        return crud.get_mac_sightings(db, mac)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# DHCP Lease Endpoints
+@app.get("/leases/sources", response_model=List[schemas.LeaseSource])
+def read_lease_sources(db: Session = Depends(get_db)):
+    return leases.status(db)
+
+# DNS Zone Endpoints
+@app.post("/dns/reconcile", response_model=schemas.DNSReconcileReport)
+def reconcile_dns_zones(db: Session = Depends(get_db)):
+    import zones
+    settings = crud.get_settings(db)
+    sources = zones.parse_sources(settings.get("dns_zones"))
+    if not sources:
+        raise HTTPException(status_code=400, detail="No DNS zones configured (dns_zones setting)")
+    report = zones.reconcile(db, sources, settings.get("dns_server"), settings.get("last_seen_granularity", 300))
+    db.commit()
+    return report
+
+@app.get("/dns/mismatches", response_model=List[schemas.DNSMismatch])
+def read_dns_mismatches(kind: str = None, db: Session = Depends(get_db)):
+    import zones
+    report = zones.last_report(db)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No DNS zone reconciliation has run yet")
+    return [m for m in report["mismatches"] if kind is None or m["kind"] == kind]
+
+# Tag Endpoints
+@app.get("/tags", response_model=List[schemas.TagCount])
+def read_tags(tag: str = None, db: Session = Depends(get_db)):
+    try:
+        return crud.get_tag_counts(db, tag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Query Profiling Endpoints
+@app.get("/debug/queries")
+def read_query_profiles(suspects: bool = False):
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Query profiling is disabled")
+    return profiling.list_profiles(suspects_only=suspects)
+
+@app.get("/debug/queries/{profile_id}")
+def read_query_profile(profile_id: int):
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Query profiling is disabled")
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Query profile not found")
+    return profile.as_dict()
+
 # Settings Endpoints
 @app.get("/settings")
 def get_settings(db: Session = Depends(get_db)):
@@ -205,6 +460,49 @@ def get_settings(db: Session = Depends(get_db)):
 def update_settings(settings: schemas.SettingsUpdate, db: Session = Depends(get_db)):
     return crud.update_settings(db, settings)
 
+@app.get("/retention", response_model=schemas.RetentionReport)
+def read_retention_report(db: Session = Depends(get_db)):
+    report = retention.last_report(db)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Retention has not run yet")
+    return report
+
+@app.post("/retention/run", response_model=schemas.RetentionReport)
+def run_retention(maintenance: bool = None, db: Session = Depends(get_db)):
+    try:
+        return retention.run(db, crud.get_settings(db), maintenance)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+# Backup Endpoints
+@app.get("/backups", response_model=List[schemas.Backup])
+def read_backups():
+    return backup.list_backups()
+
+@app.post("/backups", response_model=schemas.Backup)
+def create_backup(method: str = None, compress: bool = None, db: Session = Depends(get_db)):
+    settings = crud.get_settings(db)
+    method = method or settings["backup_method"]
+    if method not in backup.METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(backup.METHODS)}")
+    try:
+        return backup.create(method, settings["backup_compress"] if compress is None else compress, settings["backup_keep"])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/backups/{name}/verify", response_model=schemas.BackupVerification)
+def verify_backup(name: str):
+    if backup.get_backup(name) is None:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return backup.verify(name)
+
+@app.get("/backups/{name}/download")
+def download_backup(name: str):
+    # get_backup only knows names matching backup.NAME_PATTERN, so no path can escape the backup directory
+    if backup.get_backup(name) is None:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return FileResponse(backup.backup_file(name), filename=name, media_type="application/octet-stream")
+
 @app.post("/settings/purge")
 def purge_ips(days: int = 30, db: Session = Depends(get_db)):
     count = crud.purge_discovered_ips(db, days)
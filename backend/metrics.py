@@ -0,0 +1,291 @@
+import bisect
+import logging
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+PHASE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# SQLite hands out its write lock when a transaction first writes. Write transactions are
+# opened with a separately timed BEGIN IMMEDIATE, so the wait for the lock is measured apart
+# from the statement's own work; waits longer than this count as contended.
+LOCK_WAIT_THRESHOLD = 0.001
+# Statements before which pysqlite opens a transaction
+_WRITE_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# [query count, query seconds] of the request being served, if any
+_request_db = ContextVar("request_db", default=None)
+
+class _Family:
+    """
+    A named metric with optional labels. Children are created once per label
+    combination and then updated without locks: increments rely on the GIL and a
+    concurrent scrape may see a value that is one update behind.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _label_text(self, values, extra=None):
+        pairs = list(zip(self.labelnames, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Family):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._label_text(values)} {_number(child.value)}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._label_text(values, ('le', _number(bound)))} {cumulative}")
+        cumulative += counts[-1]
+        lines.append(f"{self.name}_bucket{self._label_text(values, ('le', '+Inf'))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+REGISTRY = []
+# Called before rendering to refresh gauges that are cheaper to compute on scrape
+_collectors = []
+
+def register_collector(func):
+    _collectors.append(func)
+    return func
+
+# API
+http_request_duration = Histogram(
+    "ipam_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+http_requests = Counter(
+    "ipam_http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+http_request_db_queries = Histogram(
+    "ipam_http_request_db_queries", "Database queries issued per HTTP request.", ("route",), QUERY_COUNT_BUCKETS)
+http_request_db_duration = Histogram(
+    "ipam_http_request_db_seconds", "Database time spent per HTTP request.", ("route",))
+
+# Database
+db_queries = Counter("ipam_db_queries_total", "SQL statements executed.")
+db_query_duration = Histogram("ipam_db_query_duration_seconds", "SQL statement execution time.")
+db_lock_wait = Histogram("ipam_db_lock_wait_seconds", "Time write transactions waited for the SQLite write lock.")
+db_lock_waits = Counter(
+    "ipam_db_lock_waits_total",
+    f"Write transactions that waited for the SQLite write lock (longer than {LOCK_WAIT_THRESHOLD}s) or gave up (locked).",
+    ("outcome",))
+
+# Brain
+brain_cycle_duration = Histogram(
+    "ipam_brain_cycle_duration_seconds", "Duration of a full Brain cycle.", buckets=PHASE_BUCKETS)
+brain_phase_duration = Histogram(
+    "ipam_brain_phase_duration_seconds", "Brain cycle time by phase; DNS lookups are split out of health and discovery.",
+    ("phase",), PHASE_BUCKETS)
+brain_cycles = Counter("ipam_brain_cycles_total", "Completed Brain cycles.")
+brain_leader = Gauge("ipam_brain_leader", "1 when this process holds the Brain lease and runs the full cycle.")
+scan_claims = Gauge("ipam_scan_claims", "Subnet scan claims held by this process.")
+dns_lookups = Counter("ipam_dns_lookups_total", "Reverse DNS lookups performed.")
+dns_lookup_seconds = Counter("ipam_dns_lookup_seconds_total", "Time spent in reverse DNS lookups.")
+probes_sent = Counter("ipam_probes_sent_total", "Discovery and health check probes sent, by backend.", ("backend",))
+discovery_queue_depth = Gauge("ipam_discovery_queue_depth", "Subnets still waiting in the current discovery cycle.")
+scan_jobs = Gauge("ipam_scan_jobs", "Scan jobs currently known, by state.", ("state",))
+scan_probe_rate = Gauge("ipam_scan_probes_per_second", "Probe throughput of running scan jobs.")
+passive_packets = Counter("ipam_passive_packets_total", "ARP, DHCP and ND frames captured by passive discovery.")
+passive_sightings = Counter("ipam_passive_sightings_total", "Coalesced sightings flushed by passive discovery.")
+dhcp_lease_records = Counter("ipam_dhcp_lease_records_total", "Lease records read from DHCP lease files, by format.", ("format",))
+retention_rows_deleted = Counter("ipam_retention_rows_deleted_total", "Rows deleted by retention, by kind.", ("kind",))
+retention_reclaimed_bytes = Counter("ipam_retention_reclaimed_bytes_total", "Database file space returned by retention vacuums.")
+backups = Counter("ipam_backups_total", "Backups by outcome (created, failed, verified, verify_failed).", ("outcome",))
+backup_last_seconds = Gauge("ipam_backup_last_duration_seconds", "Snapshot, check and compression time of the last backup.")
+backup_last_size = Gauge("ipam_backup_last_size_bytes", "Size of the last backup file.")
+cache_lookups = Counter("ipam_cache_lookups_total", "Cached snapshot reads, by cache and result (hit or reload).", ("cache", "result"))
+
+def render():
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            logger.warning(f"Metrics collector {collector.__name__} failed: {e}")
+    lines = []
+    for family in REGISTRY:
+        lines.extend(family.render())
+    return "\n".join(lines) + "\n"
+
+class PrometheusMiddleware:
+    """
+    Plain ASGI middleware timing each HTTP request. Routes are labelled by
+    their path template so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        db_stats = [0, 0.0]
+        token = _request_db.set(db_stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.labels(method, path).observe(elapsed)
+            http_requests.labels(method, path, status[0]).inc()
+            http_request_db_queries.labels(path).observe(db_stats[0])
+            http_request_db_duration.labels(path).observe(db_stats[1])
+
+def _take_write_lock(conn, statement: str):
+    driver = conn.connection.driver_connection
+    # Only where pysqlite would open the transaction itself: not on AUTOCOMMIT connections or inside a transaction
+    if driver.isolation_level is None or driver.in_transaction or not statement.lstrip()[:7].upper().startswith(_WRITE_KEYWORDS):
+        return
+    start = time.perf_counter()
+    # Waits up to busy_timeout, then raises "database is locked" through the statement
+    driver.execute("BEGIN IMMEDIATE")
+    waited = time.perf_counter() - start
+    db_lock_wait.observe(waited)
+    if waited > LOCK_WAIT_THRESHOLD:
+        db_lock_waits.labels("waited").inc()
+
+def instrument_engine(engine):
+    """
+    Times every statement on the engine and attributes it to the current HTTP request.
+    On SQLite, also times how long write transactions wait for the write lock.
+    """
+    sqlite = engine.dialect.name == "sqlite"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+        if sqlite:
+            _take_write_lock(conn, statement)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries.inc()
+        db_query_duration.observe(elapsed)
+        stats = _request_db.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        if "database is locked" in str(context.original_exception):
+            db_lock_waits.labels("locked").inc()
+
+class Timer:
+    """
+    Context manager measuring wall time; elapsed is available afterwards.
+    """
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
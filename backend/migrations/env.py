@@ -25,6 +25,12 @@ if config.config_file_name is not None:
 from models import Base
 target_metadata = Base.metadata
 
+# The FTS5 device search index (search.py) and its shadow tables are created by hand
+def include_name(name, type_, parent_names):
+    if type_ == "table":
+        return not name.startswith("device_search")
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -50,6 +56,7 @@ def run_migrations_offline() -> None:
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
         render_as_batch=True,
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -73,7 +80,8 @@ def run_migrations_online() -> None:
         context.configure(
             connection=connection, 
             target_metadata=target_metadata,
-            render_as_batch=True
+            render_as_batch=True,
+            include_name=include_name
         )
 
         with context.begin_transaction():
@@ -0,0 +1,98 @@
+"""add device search index
+
+Revision ID: 0db9440c2271
+Revises: 0b43bf0a0ecb
+Create Date: 2026-10-19 09:22:27.005968
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0db9440c2271'
+down_revision: Union[str, Sequence[str], None] = '0b43bf0a0ecb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of the device_search schema in search.py as of this revision. Addresses and MACs
+# have their separators replaced by "_" (a token character) so each one is a single token.
+ADDRESS_TOKEN = "replace(replace({}, '.', '_'), ':', '_')"
+
+
+def refresh(device_id: str) -> str:
+    return f"""
+        DELETE FROM device_search WHERE rowid = {device_id};
+        INSERT INTO device_search(rowid, hostname, manufacturer, model, tags, notes, macs, addresses)
+        SELECT d.id, d.hostname, d.manufacturer, d.model, d.tags, d.notes,
+            (SELECT group_concat({ADDRESS_TOKEN.format("mac_address")}, ' ') FROM ip_addresses WHERE device_id = d.id),
+            (SELECT group_concat({ADDRESS_TOKEN.format("address")}, ' ') FROM ip_addresses WHERE device_id = d.id)
+        FROM devices d WHERE d.id = {device_id};
+    """
+
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE device_search USING fts5(hostname, manufacturer, model, tags, notes, macs, addresses,
+        tokenize="unicode61 tokenchars '_'", prefix='1 2 3')""",
+    f"""CREATE TRIGGER device_search_device_insert AFTER INSERT ON devices BEGIN
+        {refresh("NEW.id")}
+    END""",
+    f"""CREATE TRIGGER device_search_device_update
+        AFTER UPDATE OF hostname, manufacturer, model, tags, notes ON devices BEGIN
+        {refresh("NEW.id")}
+    END""",
+    """CREATE TRIGGER device_search_device_delete AFTER DELETE ON devices BEGIN
+        DELETE FROM device_search WHERE rowid = OLD.id;
+    END""",
+    f"""CREATE TRIGGER device_search_ip_insert AFTER INSERT ON ip_addresses
+        WHEN NEW.device_id IS NOT NULL BEGIN
+        {refresh("NEW.device_id")}
+    END""",
+    f"""CREATE TRIGGER device_search_ip_update
+        AFTER UPDATE OF device_id, address, mac_address ON ip_addresses
+        WHEN OLD.device_id IS NOT NULL OR NEW.device_id IS NOT NULL BEGIN
+        {refresh("OLD.device_id")}
+        {refresh("NEW.device_id")}
+    END""",
+    f"""CREATE TRIGGER device_search_ip_delete AFTER DELETE ON ip_addresses
+        WHEN OLD.device_id IS NOT NULL BEGIN
+        {refresh("OLD.device_id")}
+    END""",
+    f"""INSERT INTO device_search(rowid, hostname, manufacturer, model, tags, notes, macs, addresses)
+        SELECT d.id, d.hostname, d.manufacturer, d.model, d.tags, d.notes, ips.macs, ips.addresses
+        FROM devices d
+        LEFT JOIN (
+            SELECT device_id, group_concat({ADDRESS_TOKEN.format("mac_address")}, ' ') AS macs,
+                group_concat({ADDRESS_TOKEN.format("address")}, ' ') AS addresses
+            FROM ip_addresses WHERE device_id IS NOT NULL GROUP BY device_id
+        ) ips ON ips.device_id = d.id""",
+]
+
+TRIGGERS = ("device_insert", "device_update", "device_delete", "ip_insert", "ip_update", "ip_delete")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('ip_addresses', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ip_addresses_device_id'), ['device_id'], unique=False)
+
+    # ### end Alembic commands ###
+
+    for statement in SCHEMA:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for trigger in TRIGGERS:
+        op.execute(f"DROP TRIGGER device_search_{trigger}")
+    op.execute("DROP TABLE device_search")
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('ip_addresses', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ip_addresses_device_id'))
+
+    # ### end Alembic commands ###
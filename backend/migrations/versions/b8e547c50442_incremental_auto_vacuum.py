@@ -0,0 +1,38 @@
+"""incremental auto vacuum
+
+Revision ID: b8e547c50442
+Revises: 018f2978bed8
+Create Date: 2026-10-19 10:00:35.839251
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e547c50442'
+down_revision: Union[str, Sequence[str], None] = '018f2978bed8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # auto_vacuum only changes with a full VACUUM, which rewrites the file once here (before
+    # the API starts) so retention can later free pages with PRAGMA incremental_vacuum
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        op.execute("VACUUM")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("PRAGMA auto_vacuum = NONE")
+        op.execute("VACUUM")
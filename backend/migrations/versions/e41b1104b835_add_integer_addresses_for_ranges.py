@@ -0,0 +1,120 @@
+"""add integer addresses for ranges
+
+Revision ID: e41b1104b835
+Revises: 03fe2648dbcc
+Create Date: 2026-10-19 09:46:46.226690
+
+"""
+import socket
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b1104b835'
+down_revision: Union[str, Sequence[str], None] = '03fe2648dbcc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of the device_search triggers (see 0db9440c2271). Dropping a column recreates
+# ip_addresses, and SQLite refuses to rename a table over triggers that reference it, so they are
+# dropped first and recreated afterwards. The FTS rows themselves are unaffected.
+ADDRESS_TOKEN = "replace(replace({}, '.', '_'), ':', '_')"
+
+
+def refresh(device_id: str) -> str:
+    return f"""
+        DELETE FROM device_search WHERE rowid = {device_id};
+        INSERT INTO device_search(rowid, hostname, manufacturer, model, tags, notes, macs, addresses)
+        SELECT d.id, d.hostname, d.manufacturer, d.model, d.tags, d.notes,
+            (SELECT group_concat({ADDRESS_TOKEN.format("mac_address")}, ' ') FROM ip_addresses WHERE device_id = d.id),
+            (SELECT group_concat({ADDRESS_TOKEN.format("address")}, ' ') FROM ip_addresses WHERE device_id = d.id)
+        FROM devices d WHERE d.id = {device_id};
+    """
+
+
+TRIGGERS = {
+    "device_insert": f"""AFTER INSERT ON devices BEGIN
+        {refresh("NEW.id")}
+    END""",
+    "device_update": f"""AFTER UPDATE OF hostname, manufacturer, model, tags, notes ON devices BEGIN
+        {refresh("NEW.id")}
+    END""",
+    "device_delete": """AFTER DELETE ON devices BEGIN
+        DELETE FROM device_search WHERE rowid = OLD.id;
+    END""",
+    "ip_insert": f"""AFTER INSERT ON ip_addresses
+        WHEN NEW.device_id IS NOT NULL BEGIN
+        {refresh("NEW.device_id")}
+    END""",
+    "ip_update": f"""AFTER UPDATE OF device_id, address, mac_address ON ip_addresses
+        WHEN OLD.device_id IS NOT NULL OR NEW.device_id IS NOT NULL BEGIN
+        {refresh("OLD.device_id")}
+        {refresh("NEW.device_id")}
+    END""",
+    "ip_delete": f"""AFTER DELETE ON ip_addresses
+        WHEN OLD.device_id IS NOT NULL BEGIN
+        {refresh("OLD.device_id")}
+    END""",
+}
+
+
+def ipv4_int(address):
+    # Same as models.ipv4_int when this revision was written: None for IPv6 and malformed addresses
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+    except (OSError, TypeError):
+        return None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('ip_addresses', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('address_int', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_ip_addresses_subnet_id_address_int', ['subnet_id', 'address_int'], unique=False)
+
+    with op.batch_alter_table('ip_ranges', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('start_int', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('end_int', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_ip_ranges_subnet_id_start_int', ['subnet_id', 'start_int'], unique=False)
+
+    # ### end Alembic commands ###
+
+    # Fill the integer forms in for existing rows (IPv4 only, like the column defaults)
+    bind = op.get_bind()
+    rows = [
+        {"id": row_id, "value": ipv4_int(address)}
+        for row_id, address in bind.execute(sa.text("SELECT id, address FROM ip_addresses"))
+    ]
+    if rows:
+        bind.execute(sa.text("UPDATE ip_addresses SET address_int = :value WHERE id = :id"), rows)
+    rows = [
+        {"id": row_id, "start": ipv4_int(start_ip), "end": ipv4_int(end_ip)}
+        for row_id, start_ip, end_ip in bind.execute(sa.text("SELECT id, start_ip, end_ip FROM ip_ranges"))
+    ]
+    if rows:
+        bind.execute(sa.text("UPDATE ip_ranges SET start_int = :start, end_int = :end WHERE id = :id"), rows)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('ip_ranges', schema=None) as batch_op:
+        batch_op.drop_index('ix_ip_ranges_subnet_id_start_int')
+        batch_op.drop_column('end_int')
+        batch_op.drop_column('start_int')
+
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER device_search_{name}")
+
+    with op.batch_alter_table('ip_addresses', schema=None) as batch_op:
+        batch_op.drop_index('ix_ip_addresses_subnet_id_address_int')
+        batch_op.drop_column('address_int')
+
+    # ### end Alembic commands ###
+
+    for name, definition in TRIGGERS.items():
+        op.execute(f"CREATE TRIGGER device_search_{name} {definition}")
@@ -1,5 +1,6 @@
 import enum
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Enum, DateTime, JSON
+import socket
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Enum, DateTime, JSON, Index, Float, Table, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -11,6 +12,48 @@ class IPStatus(enum.Enum):
     DHCP_POOL = "DHCP_POOL"
     DISCOVERED = "DISCOVERED"
 
+class EventType(enum.Enum):
+    DISCOVERED = "DISCOVERED"
+    STATUS_CHANGED = "STATUS_CHANGED"
+    MAC_CHANGED = "MAC_CHANGED"
+    HOSTNAME_CHANGED = "HOSTNAME_CHANGED"
+    MAC_MOVED = "MAC_MOVED"
+
+def ipv4_int(address):
+    """
+    Integer value of an IPv4 address for range queries. None for IPv6, which does not
+    fit SQLite's 64-bit INTEGER, and for malformed addresses.
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+    except (OSError, TypeError):
+        return None
+
+def _ipv4_int_of(column: str):
+    # Column default derived from another column of the inserted row (ORM and core executemany inserts alike)
+    return lambda context: ipv4_int(context.get_current_parameters().get(column))
+
+# Normalized copies of the comma-separated Subnet.tags / Device.tags strings, kept in sync by crud
+subnet_tags = Table(
+    "subnet_tags",
+    Base.metadata,
+    Column("subnet_id", Integer, ForeignKey("subnets.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True, index=True),
+)
+
+device_tags = Table(
+    "device_tags",
+    Base.metadata,
+    Column("device_id", Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True, index=True),
+)
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False) # Lowercase
+
 class Subnet(Base):
     __tablename__ = "subnets"
 
@@ -24,9 +67,16 @@ class Subnet(Base):
     tags = Column(String, nullable=True)  # Stored as comma-separated or simple string for now
     last_scan = Column(DateTime(timezone=True), nullable=True)
     scan_status = Column(String, default="Idle")
+    scan_progress = Column(Integer, nullable=True) # Percent, refreshed periodically while scanning
+    discovery_backend = Column(String, nullable=True) # Overrides the global setting when set
+    rtt_srtt = Column(Float, nullable=True) # Smoothed probe round trip time in seconds
+    rtt_var = Column(Float, nullable=True)
+    rtt_samples = Column(Integer, default=0)
+    last_scan_duration = Column(Float, nullable=True) # Seconds
 
     ip_addresses = relationship("IPAddress", back_populates="subnet", cascade="all, delete-orphan")
     ip_ranges = relationship("IPRange", back_populates="subnet", cascade="all, delete-orphan")
+    tag_set = relationship("Tag", secondary=subnet_tags)
 
 class Device(Base):
     __tablename__ = "devices"
@@ -40,27 +90,35 @@ class Device(Base):
     notes = Column(Text, nullable=True)
 
     ip_addresses = relationship("IPAddress", back_populates="device")
+    tag_set = relationship("Tag", secondary=device_tags)
 
 class IPAddress(Base):
     __tablename__ = "ip_addresses"
+    __table_args__ = (Index("ix_ip_addresses_subnet_id_address_int", "subnet_id", "address_int"),)
 
     id = Column(Integer, primary_key=True, index=True)
     address = Column(String, index=True, unique=True)
     hostname = Column(String, nullable=True)
     status = Column(Enum(IPStatus), default=IPStatus.AVAILABLE)
     mac_address = Column(String, nullable=True)
+    vendor = Column(String, nullable=True) # OUI organization of mac_address
     interface_name = Column(String, nullable=True)
     last_seen = Column(DateTime(timezone=True), nullable=True)
     healthcheck_status = Column(String, nullable=True)
+    lease_expires = Column(DateTime(timezone=True), nullable=True) # Active DHCP lease from an ingested lease file
+    address_int = Column(Integer, nullable=True, default=_ipv4_int_of("address")) # Set on insert; addresses never change
 
     subnet_id = Column(Integer, ForeignKey("subnets.id"))
-    device_id = Column(Integer, ForeignKey("devices.id"), nullable=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=True, index=True)
 
     subnet = relationship("Subnet", back_populates="ip_addresses")
     device = relationship("Device", back_populates="ip_addresses")
+    events = relationship("IPEvent", back_populates="ip_address", cascade="all, delete-orphan")
+    services = relationship("IPService", back_populates="ip_address", cascade="all, delete-orphan")
 
 class IPRange(Base):
     __tablename__ = "ip_ranges"
+    __table_args__ = (Index("ix_ip_ranges_subnet_id_start_int", "subnet_id", "start_int"),)
 
     id = Column(Integer, primary_key=True, index=True)
     subnet_id = Column(Integer, ForeignKey("subnets.id"))
@@ -69,12 +127,138 @@ class IPRange(Base):
     end_ip = Column(String, index=True)
     purpose = Column(String) # DHCP, STATIC, etc.
     description = Column(Text, nullable=True)
+    start_int = Column(Integer, nullable=True, default=_ipv4_int_of("start_ip")) # Updates set these explicitly
+    end_int = Column(Integer, nullable=True, default=_ipv4_int_of("end_ip"))
 
     subnet = relationship("Subnet", back_populates="ip_ranges")
 
+class IPEvent(Base):
+    __tablename__ = "ip_events"
+    __table_args__ = (Index("ix_ip_events_ip_id_timestamp", "ip_id", "timestamp"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    ip_id = Column(Integer, ForeignKey("ip_addresses.id", ondelete="CASCADE"), nullable=False)
+    event_type = Column(Enum(EventType), nullable=False)
+    old_value = Column(String, nullable=True)
+    new_value = Column(String, nullable=True)
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+
+    ip_address = relationship("IPAddress", back_populates="events")
+
+class IPService(Base):
+    __tablename__ = "ip_services"
+    __table_args__ = (Index("ix_ip_services_ip_id_port", "ip_id", "port", "protocol", unique=True),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    ip_id = Column(Integer, ForeignKey("ip_addresses.id", ondelete="CASCADE"), nullable=False)
+    port = Column(Integer, nullable=False)
+    protocol = Column(String, nullable=False)
+    service = Column(String, nullable=True)
+    product = Column(String, nullable=True)
+    version = Column(String, nullable=True)
+    last_seen = Column(DateTime(timezone=True), nullable=True)
+
+    ip_address = relationship("IPAddress", back_populates="services")
+
+class AvailabilityRollup(Base):
+    __tablename__ = "availability_rollups"
+    __table_args__ = (
+        Index("ix_availability_rollups_scope_bucket", "scope", "scope_id", "period", "bucket_start", unique=True),
+        Index("ix_availability_rollups_period_bucket", "period", "bucket_start"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False) # "ip" or "subnet"
+    scope_id = Column(Integer, nullable=False)
+    period = Column(String, nullable=False) # "hour" or "day"
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    online_seconds = Column(Integer, default=0)
+    observed_seconds = Column(Integer, default=0)
+
+class MACSighting(Base):
+    __tablename__ = "mac_sightings"
+    __table_args__ = (
+        Index("ix_mac_sightings_mac_address", "mac_address", "address", unique=True),
+        Index("ix_mac_sightings_address", "address"),
+    )
+
+    # Keyed by address rather than IP record so history survives records being purged and recreated
+    id = Column(Integer, primary_key=True, index=True)
+    mac_address = Column(String, nullable=False) # Lowercase, colon separated
+    address = Column(String, nullable=False)
+    subnet_id = Column(Integer, nullable=True)
+    first_seen = Column(DateTime(timezone=True), nullable=False)
+    last_seen = Column(DateTime(timezone=True), nullable=False)
+
+class IPConflict(Base):
+    __tablename__ = "ip_conflicts"
+    __table_args__ = (Index("ix_ip_conflicts_kind_last_seen", "kind", "last_seen"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False) # "duplicate_ip" or "mac_flap"
+    address = Column(String, nullable=True) # The contested address (duplicate_ip)
+    mac_address = Column(String, nullable=True) # The flapping MAC (mac_flap)
+    members = Column(String, nullable=True) # Comma-separated MACs (duplicate_ip) or addresses (mac_flap) involved
+    subnet_id = Column(Integer, nullable=True)
+    first_seen = Column(DateTime(timezone=True), nullable=False)
+    last_seen = Column(DateTime(timezone=True), nullable=False)
+    occurrences = Column(Integer, default=1)
+
 class Setting(Base):
     __tablename__ = "settings"
 
     key = Column(String, primary_key=True, index=True)
     value = Column(String)
     description = Column(String, nullable=True)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Response of an applied POST /batch, replayed when a client retries with the same key
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False) # sha256 of the operations
+    response = Column(Text, nullable=False) # JSON
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class CacheGeneration(Base):
+    __tablename__ = "cache_generations"
+
+    # Bumped in the same transaction as writes to cached tables; every process compares it to its snapshots
+    name = Column(String, primary_key=True) # "settings", "subnets" or "ranges"
+    generation = Column(Integer, nullable=False, default=0)
+
+class CoordinationLease(Base):
+    __tablename__ = "coordination_leases"
+
+    # Time limited locks shared by every API worker and replica: "brain" elects the Brain leader,
+    # "subnet:<id>" claims a subnet scan. A holder keeps its lease by renewing it before expires_at.
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False) # coordination.INSTANCE_ID of the holding process
+    acquired_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+class ScanJob(Base):
+    __tablename__ = "scan_jobs"
+    # AUTOINCREMENT: job ids are never reused, even after old jobs are pruned
+    __table_args__ = (Index("ix_scan_jobs_state", "state"), {"sqlite_autoincrement": True})
+
+    # Shared record of a scan job (see jobs.py), so any worker can report or cancel it. The process
+    # running the scan keeps the live counters in memory and copies them here every few seconds.
+    id = Column(Integer, primary_key=True)
+    subnet_id = Column(Integer, nullable=False)
+    holder = Column(String, nullable=False) # coordination.INSTANCE_ID of the process running it
+    state = Column(String, nullable=False)
+    network = Column(String, nullable=True)
+    backend = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    time_budget = Column(Float, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False) # Heartbeat of the holder while active
+    progress = Column(Float, nullable=False, default=0.0)
+    total_probes = Column(Integer, nullable=False, default=0)
+    probes_sent = Column(Integer, nullable=False, default=0)
+    replies = Column(Integer, nullable=False, default=0)
+    hosts_ingested = Column(Integer, nullable=False, default=0)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
@@ -0,0 +1,161 @@
+import logging
+import shutil
+import subprocess
+import tempfile
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+NMAP_BINARY = "nmap"
+
+# Tuned for sweeping large routed networks: aggressive timing, big host groups
+# and a single retry; the Brain re-scans every cycle anyway.
+HOST_DISCOVERY_ARGS = ["-sn", "-T4", "--min-hostgroup", "256", "--min-rate", "1000", "--max-retries", "1"]
+SERVICE_DETECTION_ARGS = ["-sV", "--version-light", "-T4", "--min-hostgroup", "64", "--max-retries", "1"]
+
+READ_CHUNK_SIZE = 64 * 1024
+# Makes nmap emit <taskprogress> elements that drive job progress
+STATS_INTERVAL = "2s"
+
+class ScanAborted(Exception):
+    pass
+
+def is_available():
+    return shutil.which(NMAP_BINARY) is not None
+
+def build_command(target: str, service_detection: bool = False, top_ports: int = 100):
+    """
+    Builds the nmap command line. XML goes to stdout and reverse DNS is left
+    to the Brain's own resolver (-n).
+    """
+    cmd = [NMAP_BINARY, "-oX", "-", "-n", "--stats-every", STATS_INTERVAL]
+    if service_detection:
+        cmd += SERVICE_DETECTION_ARGS + ["--top-ports", str(top_ports)]
+    else:
+        cmd += HOST_DISCOVERY_ARGS
+    cmd.append(target)
+    return cmd
+
+def _parse_host(elem):
+    status = elem.find("status")
+    if status is None or status.get("state") != "up":
+        return None
+
+    host = {"ip": None, "mac": None, "vendor": None, "hostname": None, "ports": []}
+    for address in elem.findall("address"):
+        addrtype = address.get("addrtype")
+        if addrtype in ("ipv4", "ipv6"):
+            host["ip"] = address.get("addr")
+        elif addrtype == "mac":
+            host["mac"] = address.get("addr", "").lower() or None
+            host["vendor"] = address.get("vendor")
+
+    hostname = elem.find("hostnames/hostname")
+    if hostname is not None:
+        host["hostname"] = hostname.get("name")
+
+    for port in elem.iterfind("ports/port"):
+        state = port.find("state")
+        if state is None or state.get("state") != "open":
+            continue
+        service = port.find("service")
+        host["ports"].append({
+            "port": int(port.get("portid")),
+            "protocol": port.get("protocol"),
+            "service": service.get("name") if service is not None else None,
+            "product": service.get("product") if service is not None else None,
+            "version": service.get("version") if service is not None else None,
+        })
+
+    return host if host["ip"] else None
+
+def parse_nmap_xml(stream, on_progress=None):
+    """
+    Incrementally parses nmap XML output from a binary file-like object,
+    yielding one dict per host that is up as soon as its <host> element closes.
+    on_progress is called with the percentage from each <taskprogress> element.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    while True:
+        chunk = stream.read1(READ_CHUNK_SIZE) if hasattr(stream, "read1") else stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "taskprogress" and on_progress is not None:
+                try:
+                    on_progress(float(elem.get("percent")))
+                except (TypeError, ValueError):
+                    pass
+            elif elem.tag == "host":
+                host = _parse_host(elem)
+                # Drop parsed hosts so memory stays flat on large sweeps
+                elem.clear()
+                if root is not None and elem in root:
+                    root.remove(elem)
+                if host:
+                    yield host
+    try:
+        parser.close()
+    except ET.ParseError as e:
+        # nmap died mid-run: the hosts whose elements closed were already yielded
+        logger.warning(f"nmap XML output ended early: {e}")
+
+def iter_scan(network_prefix: str, service_detection: bool = False, top_ports: int = 100, on_progress=None):
+    """
+    Runs nmap against the prefix and yields hosts while the scan is still running.
+    """
+    cmd = build_command(network_prefix, service_detection, top_ports)
+    logger.info(f"Starting nmap scan: {' '.join(cmd)}")
+    # stderr goes to a file: a pipe nobody reads until stdout ends would block nmap once its
+    # warnings fill the pipe buffer, and the streaming parse with it
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        completed = False
+        try:
+            yield from parse_nmap_xml(proc.stdout, on_progress)
+            completed = True
+        finally:
+            # The consumer stopped early (e.g. cancelled scan): don't leave nmap running
+            if not completed:
+                proc.kill()
+            proc.communicate()
+        if proc.returncode != 0:
+            stderr.seek(0)
+            logger.error(f"nmap exited with {proc.returncode}: {stderr.read(1024).decode(errors='replace').strip()[:200]}")
+
+def scan_subnet(network_prefix: str, service_detection: bool = False, top_ports: int = 100, job=None):
+    """
+    nmap-backed equivalent of discovery.scan_subnet.
+    Hosts carry the extra "vendor", "hostname" and "ports" keys.
+    When the job is cancelled, nmap is stopped and the hosts found so far are returned.
+    """
+    if not is_available():
+        raise RuntimeError("nmap binary not found")
+    if job is None:
+        return list(iter_scan(network_prefix, service_detection, top_ports))
+
+    def on_progress(percent):
+        job.percent = percent
+        # Lets a cancel land even while nmap has no new hosts to report
+        if job.should_stop():
+            raise ScanAborted()
+
+    hosts = []
+    scan = iter_scan(network_prefix, service_detection, top_ports, on_progress)
+    try:
+        for host in scan:
+            hosts.append(host)
+            job.replies += 1
+            if job.should_stop():
+                break
+    except ScanAborted:
+        pass
+    finally:
+        scan.close()
+    return hosts
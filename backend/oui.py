@@ -0,0 +1,141 @@
+import argparse
+import csv
+import gzip
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bundled registry: one "<hex prefix>\t<organization>" line per assignment. The prefix length
+# gives the block size: 6 digits for MA-L (24-bit), 7 for MA-M (28-bit), 9 for MA-S (36-bit).
+# Regenerate with: python oui.py build oui.csv mam.csv oui36.csv (IEEE registry CSV exports)
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "oui.tsv.gz")
+
+# Longest match wins: MA-S and MA-M blocks are carved out of MA-L assignments
+PREFIX_BITS = (36, 28, 24)
+
+# U/L bit of the first octet: set on locally administered addresses (randomized phone and laptop
+# MACs, VMs). The IEEE does not assign them, although some legacy registry entries carry it.
+LOCAL_BIT = 1 << 41
+
+_MAC_SEPARATORS = re.compile(r"[\s:.\-]")
+_HEX = re.compile(r"^[0-9A-F]{12}$")
+_MANUF_LINE = re.compile(r"^([0-9A-Fa-f:\-]+)(?:/(\d+))?\s+(\S+)\s*(.*)$")
+
+_index = None
+_lock = threading.Lock()
+
+def normalize_mac(value):
+    """
+    Returns the MAC as 12 uppercase hex digits, or None if it is not a MAC.
+    Accepts colon, dash, dot (Cisco) and bare notations.
+    """
+    if not value:
+        return None
+    digits = _MAC_SEPARATORS.sub("", str(value)).upper()
+    return digits if _HEX.match(digits) else None
+
+def _load(path: str = DATA_FILE):
+    # {bits: {prefix int: organization}}; organization strings are shared between entries
+    index = {bits: {} for bits in PREFIX_BITS}
+    names = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            prefix, _, name = line.rstrip("\n").partition("\t")
+            bits = len(prefix) * 4
+            if bits in index:
+                index[bits][int(prefix, 16)] = names.setdefault(name, name)
+    return index
+
+def _get_index():
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                start = time.perf_counter()
+                try:
+                    _index = _load()
+                except OSError as e:
+                    logger.error(f"OUI registry {DATA_FILE} could not be loaded: {e}")
+                    _index = {bits: {} for bits in PREFIX_BITS}
+                logger.info(
+                    f"Loaded {sum(len(v) for v in _index.values())} OUI assignments "
+                    f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+                )
+    return _index
+
+def lookup(mac):
+    """
+    Vendor (IEEE organization name) for a MAC address, or None when unknown,
+    locally administered (randomized) or not a MAC.
+    """
+    digits = normalize_mac(mac)
+    if digits is None:
+        return None
+    value = int(digits, 16)
+    if value & LOCAL_BIT:
+        return None
+    index = _get_index()
+    for bits in PREFIX_BITS:
+        vendor = index[bits].get(value >> (48 - bits))
+        if vendor is not None:
+            return vendor
+    return None
+
+def lookup_many(macs):
+    return {mac: lookup(mac) for mac in macs}
+
+def _read_ieee_csv(path: str):
+    # IEEE exports: Registry,Assignment,Organization Name,Organization Address
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield row["Assignment"].strip().upper(), row["Organization Name"].strip()
+
+def _read_manuf(path: str):
+    # Wireshark "manuf" format: 00:1B:C5:00:00/36 <short name> <long name>
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            match = _MANUF_LINE.match(line.strip())
+            if not match or line.startswith("#"):
+                continue
+            octets, bits, short_name, long_name = match.groups()
+            digits = octets.replace(":", "").replace("-", "").upper()
+            bits = int(bits or 24)
+            if bits in PREFIX_BITS and len(digits) * 4 >= bits:
+                yield digits[:bits // 4], (long_name or short_name).strip()
+
+def build(sources, output: str = DATA_FILE):
+    """
+    Writes the bundled registry from IEEE CSV exports (oui.csv, mam.csv, oui36.csv)
+    or a Wireshark manuf file. Earlier sources win on duplicate prefixes. Prefixes with
+    the locally administered bit are left out: lookup() never matches them.
+    """
+    entries = {}
+    for path in sources:
+        reader = _read_ieee_csv if path.lower().endswith(".csv") else _read_manuf
+        for prefix, name in reader(path):
+            if name and not int(prefix[:2], 16) & 0x02:
+                entries.setdefault(prefix, " ".join(name.split()))
+    with gzip.GzipFile(output, "wb", mtime=0) as f:
+        for prefix in sorted(entries):
+            f.write(f"{prefix}\t{entries[prefix]}\n".encode("utf-8"))
+    return len(entries)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OUI vendor registry tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="regenerate the bundled registry")
+    build_parser.add_argument("sources", nargs="+")
+    build_parser.add_argument("-o", "--output", default=DATA_FILE)
+    lookup_parser = sub.add_parser("lookup", help="resolve MAC addresses")
+    lookup_parser.add_argument("macs", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"Wrote {build(args.sources, args.output)} assignments to {args.output}")
+    else:
+        for mac, vendor in lookup_many(args.macs).items():
+            print(f"{mac}\t{vendor or '-'}")
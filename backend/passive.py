@@ -0,0 +1,386 @@
+import argparse
+import ctypes
+import logging
+import socket
+import struct
+import threading
+import time
+import cache
+import ingest
+import metrics
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ETH_P_ALL = 0x0003
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+SO_ATTACH_FILTER = 26
+
+DHCP_SERVER_PORT = 67
+DHCP_CLIENT_PORT = 68
+DHCP_MAGIC = b"\x63\x82\x53\x63"
+DHCP_OPTION_HOSTNAME = 12
+DHCP_OPTION_MESSAGE_TYPE = 53
+DHCP_OPTION_END = 255
+DHCP_ACK = 5
+DHCP_INFORM = 8
+
+ICMPV6 = 58
+ND_NEIGHBOR_SOLICIT = 135
+ND_NEIGHBOR_ADVERT = 136
+ND_OPTION_SOURCE_LLADDR = 1
+ND_OPTION_TARGET_LLADDR = 2
+
+# Sightings are written in one batch per FLUSH_INTERVAL seconds, or sooner once MAX_PENDING
+# distinct (address, MAC) pairs are waiting
+FLUSH_INTERVAL = 10
+MAX_PENDING = 5000
+RECV_BUFFER_SIZE = 4 * 1024 * 1024
+SNAPLEN = 2048
+
+PCAP_MAGIC = {b"\xd4\xc3\xb2\xa1": "<", b"\xa1\xb2\xc3\xd4": ">", b"\x4d\x3c\xb2\xa1": "<", b"\xa1\xb2\x3c\x4d": ">"}
+LINKTYPE_ETHERNET = 1
+
+# Classic BPF run by the kernel on every frame, so Python only wakes up for ARP, DHCP and
+# IPv6 neighbor discovery. Same program as tcpdump -dd "arp or (udp dst port 67 or 68 and not
+# ip[6:2] & 0x1fff != 0) or (icmp6 and (ip6[40] == 135 or ip6[40] == 136))".
+# (label, opcode, k, jump if true, jump if false)
+_BPF_LD_H_ABS, _BPF_LD_B_ABS, _BPF_LD_H_IND, _BPF_LDX_B_MSH = 0x28, 0x30, 0x48, 0xB1
+_BPF_JEQ, _BPF_JSET, _BPF_RET = 0x15, 0x45, 0x06
+CAPTURE_PROGRAM = [
+    (None, _BPF_LD_H_ABS, 12, None, None),
+    (None, _BPF_JEQ, ETH_P_ARP, "accept", None),
+    (None, _BPF_JEQ, ETH_P_IP, None, "ipv6"),
+    (None, _BPF_LD_B_ABS, 23, None, None),
+    (None, _BPF_JEQ, socket.IPPROTO_UDP, None, "reject"),
+    (None, _BPF_LD_H_ABS, 20, None, None),
+    (None, _BPF_JSET, 0x1FFF, "reject", None),
+    (None, _BPF_LDX_B_MSH, 14, None, None),
+    (None, _BPF_LD_H_IND, 16, None, None),
+    (None, _BPF_JEQ, DHCP_SERVER_PORT, "accept", None),
+    (None, _BPF_JEQ, DHCP_CLIENT_PORT, "accept", "reject"),
+    ("ipv6", _BPF_JEQ, ETH_P_IPV6, None, "reject"),
+    (None, _BPF_LD_B_ABS, 20, None, None),
+    (None, _BPF_JEQ, ICMPV6, None, "reject"),
+    (None, _BPF_LD_B_ABS, 54, None, None),
+    (None, _BPF_JEQ, ND_NEIGHBOR_SOLICIT, "accept", None),
+    (None, _BPF_JEQ, ND_NEIGHBOR_ADVERT, "accept", "reject"),
+    ("accept", _BPF_RET, SNAPLEN, None, None),
+    ("reject", _BPF_RET, 0, None, None),
+]
+
+def assemble(program):
+    """
+    Packs (label, opcode, k, jt, jf) tuples into struct sock_filter bytes, resolving
+    jump labels to relative offsets (None falls through to the next instruction).
+    """
+    labels = {ins[0]: i for i, ins in enumerate(program) if ins[0]}
+    code = b""
+    for i, (_, opcode, k, jt, jf) in enumerate(program):
+        offsets = [labels[target] - i - 1 if target else 0 for target in (jt, jf)]
+        code += struct.pack("HBBI", opcode, offsets[0], offsets[1], k)
+    return code
+
+def attach_filter(sock, program=CAPTURE_PROGRAM):
+    code = ctypes.create_string_buffer(assemble(program))
+    fprog = struct.pack("HL", len(program), ctypes.addressof(code))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+def _mac(data: bytes):
+    return data.hex(":")
+
+def _parse_arp(frame: bytes):
+    # Requests and replies both reveal the sender; ARP probes (sender 0.0.0.0) do not
+    if len(frame) < 42 or frame[14:16] != b"\x00\x01" or frame[16:18] != b"\x08\x00":
+        return []
+    sender_ip = frame[28:32]
+    if sender_ip == b"\x00\x00\x00\x00":
+        return []
+    return [{"ip": socket.inet_ntoa(sender_ip), "mac": _mac(frame[22:28])}]
+
+def _dhcp_options(data: bytes):
+    options = {}
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code == DHCP_OPTION_END:
+            break
+        if code == 0:
+            i += 1
+            continue
+        if i + 1 >= len(data):
+            break
+        length = data[i + 1]
+        options[code] = data[i + 2:i + 2 + length]
+        i += 2 + length
+    return options
+
+def _parse_dhcp(frame: bytes):
+    ihl = (frame[14] & 0x0F) * 4
+    if frame[23] != socket.IPPROTO_UDP:
+        return []
+    bootp = frame[14 + ihl + 8:]
+    if len(bootp) < 240 or bootp[236:240] != DHCP_MAGIC or bootp[1] != 1 or bootp[2] != 6:
+        return []
+    options = _dhcp_options(bootp[240:])
+    message_type = options.get(DHCP_OPTION_MESSAGE_TYPE, b"\x00")[0]
+    hostname = options.get(DHCP_OPTION_HOSTNAME, b"").decode("ascii", "ignore").strip() or None
+    mac = _mac(bootp[28:34])
+    # Clients announce their hostname in DISCOVER/REQUEST, before they have an address
+    if message_type == DHCP_ACK:
+        address = bootp[16:20]
+    elif message_type == DHCP_INFORM:
+        address = bootp[12:16]
+    else:
+        return [{"ip": None, "mac": mac, "hostname": hostname}] if hostname else []
+    if address == b"\x00\x00\x00\x00":
+        return []
+    return [{"ip": socket.inet_ntoa(address), "mac": mac, "hostname": hostname}]
+
+def _parse_nd(frame: bytes):
+    if len(frame) < 78 or frame[20] != ICMPV6:
+        return []
+    icmp_type = frame[54]
+    if icmp_type == ND_NEIGHBOR_ADVERT:
+        address, wanted = frame[62:78], ND_OPTION_TARGET_LLADDR
+    elif icmp_type == ND_NEIGHBOR_SOLICIT:
+        # Duplicate address detection solicits from :: and says nothing about who holds the target
+        address, wanted = frame[22:38], ND_OPTION_SOURCE_LLADDR
+        if address == bytes(16):
+            return []
+    else:
+        return []
+    mac = _mac(frame[6:12])
+    i = 78
+    while i + 8 <= len(frame) and frame[i + 1]:
+        if frame[i] == wanted:
+            mac = _mac(frame[i + 2:i + 8])
+            break
+        i += frame[i + 1] * 8
+    return [{"ip": socket.inet_ntop(socket.AF_INET6, address), "mac": mac}]
+
+def parse_frame(frame: bytes):
+    """
+    Returns the sightings ({"ip", "mac"[, "hostname"]}) an Ethernet frame reveals.
+    ip is None for DHCP hostname hints that are not bound to an address yet.
+    """
+    if len(frame) < 14:
+        return []
+    ethertype = struct.unpack_from("!H", frame, 12)[0]
+    try:
+        if ethertype == ETH_P_ARP:
+            return _parse_arp(frame)
+        if ethertype == ETH_P_IP and len(frame) >= 34:
+            return _parse_dhcp(frame)
+        if ethertype == ETH_P_IPV6:
+            return _parse_nd(frame)
+    except (IndexError, struct.error, ValueError):
+        pass
+    return []
+
+class SightingBuffer:
+    """
+    Coalesces sightings in memory until they are flushed. A chatty host adds one entry,
+    not one per packet; entries are keyed by (address, MAC) so several MACs answering
+    for one address reach the conflict detection in the same batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._hostnames = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, sighting):
+        mac = sighting["mac"]
+        with self._lock:
+            if sighting.get("hostname"):
+                self._hostnames[mac] = sighting["hostname"]
+            if sighting["ip"] is None:
+                return
+            self._pending[(sighting["ip"], mac)] = {
+                "ip": sighting["ip"],
+                "mac": mac,
+                "hostname": self._hostnames.get(mac),
+                "online": True,
+            }
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            # Hints outlive a flush (the ACK may come later) but not forever
+            if len(self._hostnames) > MAX_PENDING:
+                self._hostnames.clear()
+        return list(pending.values())
+
+def flush(buffer: SightingBuffer, last_seen_granularity: int = 300):
+    """
+    Writes the buffered sightings through the ingest pipeline, one batch per subnet.
+    Addresses outside every subnet (link-local IPv6, foreign networks) are dropped.
+    DHCP hostnames only fill empty hostnames, so they do not fight with DNS names.
+    """
+    observations = buffer.drain()
+    totals = {"observed": 0, "created": 0, "updated": 0, "events": 0, "conflicts": 0}
+    if not observations:
+        return totals
+    db = SessionLocal()
+    try:
+        subnets = cache.subnet_index(db)
+        snapshot = ingest.load_snapshot(db, [obs["ip"] for obs in observations])
+        groups = {}
+        for obs in observations:
+            subnet_id = subnets.match(obs["ip"])
+            if subnet_id is None:
+                continue
+            current = snapshot.get(obs["ip"])
+            if current is not None and current["hostname"]:
+                obs["hostname"] = None
+            groups.setdefault(subnet_id, []).append(obs)
+        for subnet_id, group in groups.items():
+            stats = ingest.apply_observations(db, group, subnet_id=subnet_id, snapshot=snapshot, last_seen_granularity=last_seen_granularity)
+            for key in totals:
+                totals[key] += stats[key]
+        db.commit()
+        metrics.passive_sightings.inc(totals["observed"])
+        logger.info(f"Passive discovery flushed {len(observations)} sightings: {totals['created']} new, "
+                    f"{totals['updated']} changed, {totals['conflicts']} conflicts")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Passive discovery flush failed: {e}")
+    finally:
+        db.close()
+    return totals
+
+class Listener:
+    """
+    Captures ARP, DHCP and ND frames on an AF_PACKET socket (all interfaces unless one is
+    given) in a daemon thread and flushes the coalesced sightings periodically.
+    """
+
+    def __init__(self, interface: str = None, last_seen_granularity: int = 300, flush_interval: float = FLUSH_INTERVAL):
+        self.interface = interface
+        self.last_seen_granularity = last_seen_granularity
+        self.flush_interval = flush_interval
+        self.buffer = SightingBuffer()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="passive-discovery", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            attach_filter(sock)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+            if self.interface:
+                sock.bind((self.interface, ETH_P_ALL))
+            sock.settimeout(1.0)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _run(self):
+        try:
+            sock = self._open()
+        except OSError as e:
+            logger.error(f"Passive discovery could not open a capture socket on {self.interface or 'all interfaces'}: {e}")
+            return
+        logger.info(f"Passive discovery listening on {self.interface or 'all interfaces'}")
+        next_flush = time.monotonic() + self.flush_interval
+        try:
+            while not self._stop.is_set():
+                try:
+                    frame, address = sock.recvfrom(SNAPLEN)
+                except socket.timeout:
+                    frame = None
+                # Frames we sent ourselves (e.g. the prober's ARP requests) say nothing new
+                if frame is not None and address[2] != socket.PACKET_OUTGOING:
+                    metrics.passive_packets.inc()
+                    for sighting in parse_frame(frame):
+                        self.buffer.add(sighting)
+                if time.monotonic() >= next_flush or len(self.buffer) >= MAX_PENDING:
+                    flush(self.buffer, self.last_seen_granularity)
+                    next_flush = time.monotonic() + self.flush_interval
+        finally:
+            sock.close()
+            flush(self.buffer, self.last_seen_granularity)
+            logger.info("Passive discovery stopped")
+
+_listener = None
+_listener_lock = threading.Lock()
+
+def configure(enabled: bool, interface: str = None, last_seen_granularity: int = 300):
+    """
+    Starts, restarts or stops the listener to match the settings. Called every Brain cycle,
+    so a listener that died (e.g. missing NET_RAW) is retried.
+    """
+    global _listener
+    interface = interface or None
+    with _listener_lock:
+        if _listener is not None and (not enabled or _listener.interface != interface or not _listener.is_alive()):
+            _listener.stop()
+            _listener = None
+        if enabled and _listener is None:
+            _listener = Listener(interface, last_seen_granularity)
+            _listener.start()
+        elif _listener is not None:
+            _listener.last_seen_granularity = last_seen_granularity
+
+def read_pcap(path: str):
+    """
+    Yields the frames of a libpcap capture (tcpdump -w), Ethernet link type only.
+    """
+    with open(path, "rb") as f:
+        header = f.read(24)
+        endian = PCAP_MAGIC.get(header[:4])
+        if endian is None:
+            raise ValueError(f"{path} is not a pcap file (pcapng is not supported)")
+        if struct.unpack(endian + "I", header[20:24])[0] & 0xFFFF != LINKTYPE_ETHERNET:
+            raise ValueError(f"{path} is not an Ethernet capture")
+        while True:
+            record = f.read(16)
+            if len(record) < 16:
+                return
+            length = struct.unpack(endian + "IIII", record)[2]
+            yield f.read(length)
+
+def replay(path: str, last_seen_granularity: int = 300, dry_run: bool = False):
+    """
+    Feeds a capture through the same parser and buffer as the live listener, then flushes
+    once. With dry_run the coalesced sightings are returned instead of written.
+    """
+    buffer = SightingBuffer()
+    for frame in read_pcap(path):
+        for sighting in parse_frame(frame):
+            buffer.add(sighting)
+    if dry_run:
+        return buffer.drain()
+    return flush(buffer, last_seen_granularity)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Passive discovery tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="ingest the sightings in a pcap file (tcpdump -w)")
+    replay_parser.add_argument("pcap")
+    replay_parser.add_argument("--dry-run", action="store_true", help="print the sightings instead of writing them")
+    args = parser.parse_args()
+
+    result = replay(args.pcap, dry_run=args.dry_run)
+    if args.dry_run:
+        for sighting in result:
+            print(f"{sighting['ip']}\t{sighting['mac']}\t{sighting['hostname'] or '-'}")
+    else:
+        print(result)
@@ -0,0 +1,341 @@
+import asyncio
+import errno
+import fcntl
+import ipaddress
+import itertools
+import logging
+import os
+import socket
+import struct
+
+logger = logging.getLogger(__name__)
+
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+SIOCGIFADDR = 0x8915
+BROADCAST_MAC = b"\xff" * 6
+
+# Offset of the ARP target protocol address inside an Ethernet + ARP frame
+ARP_TARGET_OFFSET = 38
+ICMP_ECHO_REPLY = 0
+ICMP_PAYLOAD = b"ipam-probe"
+
+# Yield to the event loop (and the receive callbacks) every SEND_BURST probes
+SEND_BURST = 256
+# Upper bound for the per-attempt wait when retries back off
+MAX_RETRY_TIMEOUT = 5.0
+# Attempts to send one packet while the socket or interface queue is full
+SEND_RETRY_LIMIT = 200
+# How often a waiting probe checks whether its job was cancelled
+CANCEL_POLL_INTERVAL = 0.25
+RECV_BUFFER_SIZE = 4 * 1024 * 1024
+
+_identifiers = itertools.count(os.getpid())
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+def build_arp_template(src_mac: bytes, src_ip: bytes) -> bytearray:
+    """
+    Ethernet broadcast + ARP who-has frame; only the target address bytes
+    at ARP_TARGET_OFFSET change between probes.
+    """
+    ethernet = BROADCAST_MAC + src_mac + struct.pack("!H", ETH_P_ARP)
+    arp = struct.pack("!HHBBH6s4s6s4s", 1, ETH_P_IP, 6, 4, 1, src_mac, src_ip, b"\x00" * 6, b"\x00" * 4)
+    return bytearray(ethernet + arp)
+
+def build_icmp_echo(identifier: int, sequence: int = 1) -> bytes:
+    """
+    ICMP echo request. The kernel adds the IP header, so the same bytes are
+    sent to every destination.
+    """
+    header = struct.pack("!BBHHH", 8, 0, 0, identifier, sequence)
+    checksum = _checksum(header + ICMP_PAYLOAD)
+    return struct.pack("!BBHHH", 8, 0, checksum, identifier, sequence) + ICMP_PAYLOAD
+
+def parse_arp_reply(frame: bytes):
+    """
+    Returns (sender ip bytes, sender mac) for an ARP reply frame, else None.
+    """
+    if len(frame) < 42 or frame[12:14] != b"\x08\x06" or frame[20:22] != b"\x00\x02":
+        return None
+    return bytes(frame[28:32]), frame[22:28].hex(":")
+
+def parse_icmp_reply(packet: bytes, identifier: int):
+    """
+    Returns the source ip bytes of an echo reply carrying our identifier, else None.
+    """
+    if len(packet) < 20:
+        return None
+    ihl = (packet[0] & 0x0F) * 4
+    if len(packet) < ihl + 8 or packet[ihl] != ICMP_ECHO_REPLY:
+        return None
+    if struct.unpack_from("!H", packet, ihl + 4)[0] != identifier:
+        return None
+    return bytes(packet[12:16])
+
+def route_interface(address: str):
+    """
+    Finds the interface the kernel routes the address through (longest prefix match).
+    """
+    target = int(ipaddress.IPv4Address(address))
+    best = None
+    with open("/proc/net/route") as f:
+        next(f)
+        for line in f:
+            fields = line.split()
+            # /proc/net/route stores addresses as little-endian hex
+            destination = socket.ntohl(int(fields[1], 16))
+            mask = socket.ntohl(int(fields[7], 16))
+            if target & mask == destination and (best is None or mask > best[1]):
+                best = (fields[0], mask)
+    return best[0] if best else None
+
+def interface_addresses(interface: str):
+    """
+    Returns (mac bytes, ipv4 bytes) of an interface.
+    """
+    with open(f"/sys/class/net/{interface}/address") as f:
+        mac = bytes.fromhex(f.read().strip().replace(":", ""))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        ifreq = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", interface.encode()[:15]))
+    return mac, ifreq[20:24]
+
+class Prober:
+    """
+    Sends ARP and ICMP probes from prebuilt templates over raw sockets and
+    matches replies with dict lookups in asyncio reader callbacks.
+    Sockets can be injected (e.g. fakes in tests); otherwise use Prober.open().
+    """
+
+    def __init__(self, arp_socket=None, icmp_socket=None, arp_template: bytearray = None):
+        self.arp_socket = arp_socket
+        self.icmp_socket = icmp_socket
+        self.arp_template = arp_template
+        self.identifier = next(_identifiers) & 0xFFFF
+        self.icmp_packet = build_icmp_echo(self.identifier)
+
+    @classmethod
+    def open(cls, target: str, arp: bool = True, icmp: bool = True):
+        arp_socket = icmp_socket = None
+        template = None
+        try:
+            if arp:
+                interface = route_interface(target)
+                if interface and interface != "lo":
+                    mac, ip = interface_addresses(interface)
+                    template = build_arp_template(mac, ip)
+                    arp_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+                    arp_socket.bind((interface, ETH_P_ARP))
+            if icmp:
+                icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        except Exception:
+            for sock in (arp_socket, icmp_socket):
+                if sock:
+                    sock.close()
+            raise
+
+        for sock in (arp_socket, icmp_socket):
+            if sock:
+                sock.setblocking(False)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+        return cls(arp_socket, icmp_socket, template)
+
+    def close(self):
+        for sock in (self.arp_socket, self.icmp_socket):
+            if sock:
+                sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def _send(self, sock, data, address=None):
+        for _ in range(SEND_RETRY_LIMIT):
+            try:
+                if address is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, address)
+                return True
+            except BlockingIOError:
+                await asyncio.sleep(0.001)
+            except OSError as e:
+                # The interface queue is full; back off instead of failing the sweep
+                if e.errno != errno.ENOBUFS:
+                    raise
+                await asyncio.sleep(0.01)
+        logger.debug(f"Dropping probe to {address}: send queue stayed full")
+        return False
+
+    async def _wait(self, finished: asyncio.Event, timeout: float, job=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not finished.is_set():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(finished.wait(), min(remaining, CANCEL_POLL_INTERVAL) if job else remaining)
+            except asyncio.TimeoutError:
+                if job is not None and job.should_stop():
+                    return
+
+    async def probe(self, targets, arp: bool = True, icmp: bool = True, timeout: float = 2.0,
+                    retries: int = 0, expected=None, settle: float = None, rtts: list = None, job=None):
+        """
+        Probes every target and returns {ip: mac or None} for the ones that answered.
+
+        Waits up to timeout seconds after the last send; returns early once every
+        target has answered. When expected (e.g. hosts known to be online) is given,
+        only those are retried, with the timeout doubling per attempt, and once all
+        of them have answered the sweep only lingers settle seconds for unknown hosts.
+        Round trip times of probes that were not retransmitted are appended to rtts.
+        A job (see jobs.ScanJob) gets its probe and reply counters updated and can
+        stop the probe early; the replies collected so far are returned.
+        """
+        loop = asyncio.get_running_loop()
+        pending = {socket.inet_aton(t): t for t in targets}
+        wanted = dict(pending)
+        results = {}
+        finished = asyncio.Event()
+        if not pending:
+            return results
+
+        arp = arp and self.arp_socket is not None and self.arp_template is not None
+        icmp = icmp and self.icmp_socket is not None
+
+        if expected is None:
+            waiting_on = set(pending)
+        else:
+            waiting_on = {socket.inet_aton(t) for t in expected} & set(pending)
+        # With nothing expected (e.g. a first sweep) there is nothing to finish early on
+        expecting = bool(waiting_on)
+        sent_at = {}
+        retransmitted = set()
+
+        def answered(raw):
+            address = pending.pop(raw, None)
+            if address is not None and job is not None:
+                job.replies += 1
+            # Karn's algorithm: a reply to a retransmitted probe is ambiguous, skip it
+            if address is not None and rtts is not None and raw not in retransmitted and raw in sent_at:
+                rtts.append(loop.time() - sent_at[raw])
+            waiting_on.discard(raw)
+
+        def check_finished():
+            if not pending or (expecting and not waiting_on):
+                finished.set()
+
+        def on_arp_readable():
+            while True:
+                try:
+                    frame = self.arp_socket.recv(65535)
+                except (BlockingIOError, InterruptedError):
+                    break
+                parsed = parse_arp_reply(frame)
+                if parsed and parsed[0] in wanted:
+                    results[wanted[parsed[0]]] = parsed[1]
+                    answered(parsed[0])
+            check_finished()
+
+        def on_icmp_readable():
+            while True:
+                try:
+                    packet = self.icmp_socket.recv(65535)
+                except (BlockingIOError, InterruptedError):
+                    break
+                source = parse_icmp_reply(packet, self.identifier)
+                if source is not None and source in wanted:
+                    results.setdefault(wanted[source], None)
+                    answered(source)
+            check_finished()
+
+        readers = []
+        if arp:
+            loop.add_reader(self.arp_socket.fileno(), on_arp_readable)
+            readers.append(self.arp_socket.fileno())
+        if icmp:
+            loop.add_reader(self.icmp_socket.fileno(), on_icmp_readable)
+            readers.append(self.icmp_socket.fileno())
+
+        try:
+            template = self.arp_template
+            batch = list(pending.items())
+            wait = timeout
+            for attempt in range(retries + 1):
+                for i, (raw, address) in enumerate(batch):
+                    if raw not in pending:
+                        continue
+                    if job is not None:
+                        if i % SEND_BURST == 0 and job.should_stop():
+                            break
+                        job.probes_sent += arp + icmp
+                    if attempt:
+                        retransmitted.add(raw)
+                    sent_at[raw] = loop.time()
+                    if arp:
+                        template[ARP_TARGET_OFFSET:ARP_TARGET_OFFSET + 4] = raw
+                        await self._send(self.arp_socket, template)
+                    if icmp:
+                        await self._send(self.icmp_socket, self.icmp_packet, (address, 0))
+                    if i % SEND_BURST == SEND_BURST - 1:
+                        await asyncio.sleep(0)
+                check_finished()
+                await self._wait(finished, wait, job)
+
+                if not pending or (job is not None and job.should_stop()):
+                    break
+                if not waiting_on:
+                    # Every expected host answered; give unknown hosts a short grace period
+                    if expecting and settle:
+                        await asyncio.sleep(settle)
+                    break
+                batch = [(raw, pending[raw]) for raw in waiting_on]
+                wait = min(wait * 2, MAX_RETRY_TIMEOUT)
+        finally:
+            for fd in readers:
+                loop.remove_reader(fd)
+        return results
+
+def _hosts(network_prefix: str):
+    network = ipaddress.ip_network(network_prefix, strict=False)
+    return [str(host) for host in network.hosts()] or [str(network.network_address)]
+
+def scan_subnet(network_prefix: str, arp_enabled: bool = True, icmp_enabled: bool = True, timeout: float = 2.0,
+                retries: int = 0, expected=None, settle: float = None, rtts: list = None, job=None):
+    """
+    Raw socket drop-in replacement for discovery.scan_subnet.
+    """
+    targets = _hosts(network_prefix)
+    with Prober.open(targets[0], arp_enabled, icmp_enabled) as prober:
+        found = asyncio.run(prober.probe(targets, arp_enabled, icmp_enabled, timeout, retries, expected, settle, rtts, job))
+    logger.info(f"Raw probe of {network_prefix} found {len(found)} hosts")
+    return [{"ip": ip, "mac": mac} for ip, mac in found.items()]
+
+def ping_many(addresses, timeout: float = 1.0, retries: int = 0, expected=None, settle: float = None, rtts: list = None):
+    """
+    ICMP pings all addresses concurrently and returns the set that replied.
+    """
+    addresses = list(addresses)
+    if not addresses:
+        return set()
+    with Prober.open(addresses[0], arp=False) as prober:
+        return set(asyncio.run(prober.probe(addresses, False, True, timeout, retries, expected, settle, rtts)))
+
+def ping_ip(ip_address: str, timeout: int = 1, retries: int = 0):
+    """
+    Raw socket drop-in replacement for discovery.ping_ip.
+    """
+    try:
+        return ip_address in ping_many([ip_address], timeout, retries)
+    except Exception as e:
+        logger.error(f"Error pinging {ip_address}: {e}")
+        return False
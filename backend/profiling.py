@@ -0,0 +1,215 @@
+import itertools
+import logging
+import os
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# QUERY_PROFILING=1 records every request's SQL, QUERY_PROFILING=strict also enforces the query budgets
+MODE = os.getenv("QUERY_PROFILING", "").strip().lower()
+ENABLED = MODE in ("1", "true", "on", "strict")
+STRICT = MODE == "strict"
+
+# The same statement shape this many times in one request is reported as an N+1 suspect
+N_PLUS_ONE_THRESHOLD = 5
+# Statements kept per profile; counts and suspects still cover the whole request
+MAX_STATEMENTS = 500
+HISTORY_SIZE = 100
+
+# Allowed statements per request in strict mode, keyed by "METHOD /route/template"
+DEFAULT_QUERY_BUDGET = 20
+QUERY_BUDGETS = {
+    "GET /stats": 10,
+    # Subnets (ranges joined) and one grouped IP count. The lists also allow one more query
+    # for pages that span over 500 subnets, which the count and selectinload split in two.
+    "GET /subnets/": 3,
+    "GET /subnets/{subnet_id}": 2,
+    "GET /devices/": 3,
+    "GET /devices/{device_id}": 3,
+    # IPs, then their subnets with ranges joined
+    "GET /ips/": 3,
+}
+
+# Expanded IN lists differ only in their number of placeholders
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_current = ContextVar("query_profile", default=None)
+_history = deque(maxlen=HISTORY_SIZE)
+_ids = itertools.count(1)
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+def statement_shape(statement: str) -> str:
+    return _IN_LIST.sub("(?, ...)", _WHITESPACE.sub(" ", statement).strip())
+
+class QueryProfile:
+    """
+    The SQL issued while serving one request. The route is read from the ASGI
+    scope once routing has happened, so budgets apply by path template.
+    """
+
+    def __init__(self, scope):
+        self.id = next(_ids)
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status = None
+        self.error = None
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.statements = []
+        # shape -> [count, seconds]
+        self.shapes = {}
+
+    @property
+    def route(self):
+        return getattr(self.scope.get("route"), "path", None)
+
+    @property
+    def budget(self):
+        if self.route is None:
+            return DEFAULT_QUERY_BUDGET
+        return QUERY_BUDGETS.get(f"{self.method} {self.route}", DEFAULT_QUERY_BUDGET)
+
+    def record(self, statement: str, elapsed: float, executemany: bool):
+        shape = statement_shape(statement)
+        self.query_count += 1
+        self.db_seconds += elapsed
+        totals = self.shapes.setdefault(shape, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append({
+                "offset_ms": round((time.time() - self.started_at) * 1000, 3),
+                "duration_ms": round(elapsed * 1000, 3),
+                "executemany": executemany,
+                "statement": shape,
+            })
+
+        if STRICT and self.query_count > self.budget:
+            # Raised at the statement that crosses the budget so the traceback points at the culprit
+            raise QueryBudgetExceeded(
+                f"{self.method} {self.route or self.path} issued more than {self.budget} queries; "
+                f"suspects: {[s['statement'] for s in self.suspects()] or 'none'}"
+            )
+
+    def suspects(self):
+        repeated = [
+            {"statement": shape, "count": count, "total_ms": round(seconds * 1000, 3)}
+            for shape, (count, seconds) in self.shapes.items()
+            if count >= N_PLUS_ONE_THRESHOLD
+        ]
+        return sorted(repeated, key=lambda s: s["count"], reverse=True)
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "query_count": self.query_count,
+            "db_ms": round(self.db_seconds * 1000, 3),
+            "budget": self.budget,
+            "over_budget": self.query_count > self.budget,
+            "suspects": self.suspects(),
+        }
+
+    def as_dict(self):
+        result = self.summary()
+        result["statements"] = self.statements
+        return result
+
+class QueryProfilingMiddleware:
+    """
+    Plain ASGI middleware recording the SQL of each request. The totals are
+    added as X-Query-* response headers and the full profile is kept for
+    /debug/queries/{id}.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile(scope)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                # Sync endpoints have finished by now; streamed bodies may still add queries
+                headers = list(message.get("headers", []))
+                headers.extend([
+                    (b"x-query-profile", str(profile.id).encode()),
+                    (b"x-query-count", str(profile.query_count).encode()),
+                    (b"x-query-time-ms", f"{profile.db_seconds * 1000:.3f}".encode()),
+                    (b"x-query-suspects", str(len(profile.suspects())).encode()),
+                ])
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            profile.error = str(e)
+            raise
+        finally:
+            profile.duration = time.perf_counter() - start
+            _current.reset(token)
+            _history.append(profile)
+            suspects = profile.suspects()
+            if suspects:
+                logger.warning(
+                    f"Possible N+1 in {profile.method} {profile.route or profile.path}: "
+                    f"{suspects[0]['count']}x {suspects[0]['statement'][:200]}"
+                )
+
+def instrument_engine(engine):
+    """
+    Records each statement on the engine into the profile of the current request.
+    Statements outside a request (the Brain) are ignored.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        starts = conn.info.get("profile_start")
+        if profile is None or not starts:
+            return
+        profile.record(statement, time.perf_counter() - starts.pop(), executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("profile_start") if context.connection is not None else None
+        if starts and _current.get() is not None:
+            starts.pop()
+
+def get_profile(profile_id: int):
+    for profile in _history:
+        if profile.id == profile_id:
+            return profile
+    return None
+
+def list_profiles(suspects_only: bool = False):
+    profiles = [p for p in reversed(_history) if not suspects_only or p.suspects() or p.query_count > p.budget]
+    return [p.summary() for p in profiles]
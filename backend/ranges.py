@@ -0,0 +1,144 @@
+import ipaddress
+from datetime import datetime, timezone
+from sqlalchemy import and_, case, func
+from sqlalchemy.orm import Session
+import models
+import cache
+from ingest import as_utc
+
+# Ranges carry integer bounds (start_int/end_int) and IPs an integer address (address_int),
+# each indexed after subnet_id. Ranges of a subnet never overlap, so ordered by start they form
+# an interval index: the only range that can overlap [start, end] is the one with the greatest
+# start <= end, one bisect into the cached range definitions away. Utilization joins each range
+# to its IPs with a BETWEEN on the (subnet_id, address_int) index instead of parsing addresses
+# in Python. IPv6 bounds and addresses do not fit SQLite's INTEGER and are stored as NULL: the
+# cached definitions compute their bounds, and their utilization is counted in Python.
+
+def bounds(network, start_ip: str, end_ip: str):
+    """
+    Integer bounds of a range, checked against its subnet's network. Raises ValueError.
+    """
+    try:
+        start = ipaddress.ip_address(start_ip)
+        end = ipaddress.ip_address(end_ip)
+    except ValueError:
+        raise ValueError(f"Invalid range {start_ip} - {end_ip}")
+    for address in (start, end):
+        if address not in network:
+            raise ValueError(f"{address} is outside subnet {network}")
+    if start > end:
+        raise ValueError(f"Range start {start} is after its end {end}")
+    return int(start), int(end)
+
+def find_overlap(db: Session, subnet_id: int, start: int, end: int, exclude_id: int = None):
+    """
+    The stored range of the subnet overlapping [start, end], if any, as a cache.RangeDef.
+    """
+    for previous in cache.preceding_ranges(db, subnet_id, end):
+        if previous.id != exclude_id:
+            return previous if previous.end_int >= start else None
+    return None
+
+def check(db: Session, subnet: models.Subnet, start_ip: str, end_ip: str, exclude_id: int = None):
+    """
+    Validates a new or changed range of subnet and returns its integer bounds. Raises ValueError
+    when it is malformed, leaves the subnet or overlaps another range.
+    """
+    if subnet is None:
+        raise ValueError("Range does not belong to a subnet")
+    network = ipaddress.ip_network(f"{subnet.network_address}/{subnet.prefix_length}", strict=False)
+    start, end = bounds(network, start_ip, end_ip)
+    overlap = find_overlap(db, subnet.id, start, end, exclude_id)
+    if overlap is not None:
+        raise ValueError(f"Range overlaps {overlap.name} ({overlap.start_ip} - {overlap.end_ip})")
+    return start, end
+
+def overlaps(intervals):
+    """
+    Overlapping pairs among (start, end, key) intervals, with one sort and a sweep that keeps
+    the furthest reaching interval so far. Yields (earlier key, later key).
+    """
+    reach = None
+    for start, end, key in sorted(intervals, key=lambda interval: (interval[0], interval[1])):
+        if reach is not None and start <= reach[0]:
+            yield reach[1], key
+        if reach is None or end > reach[0]:
+            reach = (end, key)
+
+def range_stats(db: Session, range_ids=None, subnet_id: int = None):
+    """
+    Used and free counts per range in one grouped query: assigned (allocated, reserved or
+    DHCP pool records), discovered, and active DHCP leases. Returns {range_id: stats}.
+    """
+    now = datetime.now(timezone.utc)
+    query = db.query(
+        models.IPRange.id,
+        models.IPRange.subnet_id,
+        models.IPRange.start_ip,
+        models.IPRange.end_ip,
+        models.IPRange.start_int,
+        models.IPRange.end_int,
+        func.count(case((models.IPAddress.status.in_(
+            [models.IPStatus.ALLOCATED, models.IPStatus.RESERVED, models.IPStatus.DHCP_POOL]
+        ), 1))),
+        func.count(case((models.IPAddress.status == models.IPStatus.DISCOVERED, 1))),
+        func.count(case((models.IPAddress.lease_expires > now, 1))),
+    ).outerjoin(models.IPAddress, and_(
+        models.IPAddress.subnet_id == models.IPRange.subnet_id,
+        models.IPAddress.address_int.between(models.IPRange.start_int, models.IPRange.end_int),
+    )).group_by(models.IPRange.id)
+    if range_ids is not None:
+        query = query.filter(models.IPRange.id.in_(range_ids))
+    if subnet_id is not None:
+        query = query.filter(models.IPRange.subnet_id == subnet_id)
+
+    counts = {}
+    ipv6 = {}
+    for range_id, range_subnet_id, start_ip, end_ip, start, end, assigned, discovered, leased in query:
+        if start is None or end is None:
+            try:
+                start, end = int(ipaddress.ip_address(start_ip)), int(ipaddress.ip_address(end_ip))
+            except ValueError:
+                counts[range_id] = (0, 0, 0, 0)
+                continue
+            ipv6.setdefault(range_subnet_id, []).append((range_id, start, end))
+        counts[range_id] = (end - start + 1, assigned, discovered, leased)
+    if ipv6:
+        _count_ipv6(db, ipv6, counts, now)
+
+    stats = {}
+    for range_id, (total, assigned, discovered, leased) in counts.items():
+        used = assigned + discovered
+        stats[range_id] = {
+            "range_id": range_id,
+            "total": total,
+            "assigned": assigned,
+            "discovered": discovered,
+            "leased": leased,
+            "free": max(0, total - used),
+            "utilization": round(100.0 * used / total, 2) if total else None,
+        }
+    return stats
+
+def _count_ipv6(db: Session, ipv6, counts, now: datetime):
+    """
+    Adds the IPs of IPv6 ranges ({subnet_id: [(range_id, start, end)]}) to counts, parsing
+    the addresses of their subnets that have no integer address.
+    """
+    assigned_statuses = (models.IPStatus.ALLOCATED, models.IPStatus.RESERVED, models.IPStatus.DHCP_POOL)
+    for subnet_id, address, status, lease_expires in db.query(
+        models.IPAddress.subnet_id, models.IPAddress.address, models.IPAddress.status, models.IPAddress.lease_expires,
+    ).filter(models.IPAddress.subnet_id.in_(ipv6), models.IPAddress.address_int.is_(None)):
+        try:
+            value = int(ipaddress.ip_address(address))
+        except ValueError:
+            continue
+        for range_id, start, end in ipv6[subnet_id]:
+            if start <= value <= end:
+                total, assigned, discovered, leased = counts[range_id]
+                counts[range_id] = (
+                    total,
+                    assigned + (status in assigned_statuses),
+                    discovered + (status == models.IPStatus.DISCOVERED),
+                    leased + (lease_expires is not None and as_utc(lease_expires) > now),
+                )
@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, delete, exists, or_, select, update
+from sqlalchemy.orm import Session, aliased
+import models
+import metrics
+import coordination
+from ingest import as_utc
+from history import STATUS_EVENTS
+
+logger = logging.getLogger(__name__)
+
+# Scheduled retention. Every policy deletes in keyset batches: one DELETE ... RETURNING of the
+# next BATCH_SIZE matching ids above the last one deleted, committed on its own, then a pause
+# of BATCH_PAUSE so the API and scans get the SQLite write lock between batches. The database
+# uses auto_vacuum=INCREMENTAL, so maintenance hands freed pages back to the filesystem in steps
+# of VACUUM_STEP_PAGES instead of a full VACUUM that rewrites the file under an exclusive lock.
+BATCH_SIZE = 2000
+BATCH_PAUSE = 0.02
+VACUUM_STEP_PAGES = 2000
+# Rows sampled per index by ANALYZE, bounding its time on large tables
+ANALYZE_LIMIT = 1000
+
+LEASE = "retention"
+MAINTENANCE_KEY = "retention_last_maintenance"
+REPORT_KEY = "retention_last_report"
+
+def _in_batches(db: Session, model, criteria, statement, batch_size: int, pause: float, on_written):
+    count = batches = 0
+    last_id = 0
+    while True:
+        batch = select(model.id).where(model.id > last_id, *criteria).order_by(model.id).limit(batch_size)
+        # Writing first means the transaction takes the write lock without a read snapshot to invalidate
+        ids = db.execute(statement.where(model.id.in_(batch)).returning(model.id)).scalars().all()
+        if ids and on_written is not None:
+            on_written(db, ids)
+        db.commit()
+        if not ids:
+            return count, batches
+        count += len(ids)
+        batches += 1
+        last_id = max(ids)
+        if len(ids) < batch_size:
+            return count, batches
+        time.sleep(pause)
+
+def delete_in_batches(db: Session, model, criteria, batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE, on_deleted=None):
+    """
+    Deletes the rows of model matching criteria, batch_size at a time in id order, committing
+    each batch. on_deleted(db, ids) runs in the batch's transaction, e.g. to delete dependent rows.
+    Returns (rows deleted, batches).
+    """
+    return _in_batches(db, model, criteria, delete(model), batch_size, pause, on_deleted)
+
+def update_in_batches(db: Session, model, criteria, values: dict, batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE):
+    """
+    Sets values on the rows of model matching criteria, batch_size at a time in id order like
+    delete_in_batches. criteria must stop matching updated rows. Returns (rows updated, batches).
+    """
+    return _in_batches(db, model, criteria, update(model).values(**values), batch_size, pause, None)
+
+def _delete_ip_dependents(db: Session, ids):
+    # Bulk deletes bypass the ORM cascade and SQLite does not enforce the foreign keys
+    db.execute(delete(models.IPEvent).where(models.IPEvent.ip_id.in_(ids)))
+    db.execute(delete(models.IPService).where(models.IPService.ip_id.in_(ids)))
+    db.execute(delete(models.AvailabilityRollup).where(
+        models.AvailabilityRollup.scope == "ip", models.AvailabilityRollup.scope_id.in_(ids)
+    ))
+
+def purge_discovered(db: Session, days: int, now: datetime = None, batch_size: int = BATCH_SIZE):
+    """
+    Deletes DISCOVERED IPs not seen for days, with their events, services and availability
+    rollups. IPs holding an active DHCP lease are kept.
+    """
+    now = now or datetime.now(timezone.utc)
+    deleted, batches = delete_in_batches(db, models.IPAddress, (
+        models.IPAddress.status == models.IPStatus.DISCOVERED,
+        models.IPAddress.last_seen < now - timedelta(days=days),
+        or_(models.IPAddress.lease_expires.is_(None), models.IPAddress.lease_expires < now),
+    ), batch_size, on_deleted=_delete_ip_dependents)
+    return {"discovered_ips": deleted}, batches
+
+def purge_offline(db: Session, days: int, now: datetime = None, batch_size: int = BATCH_SIZE):
+    """
+    Forgets hosts offline for days. IPs last seen before the cutoff lose their MAC address,
+    vendor and hostname, except ALLOCATED and RESERVED ones, which hold what users entered,
+    and IPs with an active DHCP lease. MAC sightings, open ports and conflicts last seen
+    before the cutoff are deleted; the IP records themselves are kept.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=days)
+    ip = models.IPAddress
+    deleted, batches = {}, 0
+    deleted["ip_identities"], batches = update_in_batches(db, ip, (
+        ip.status.not_in((models.IPStatus.ALLOCATED, models.IPStatus.RESERVED)),
+        ip.last_seen < cutoff,
+        or_(ip.lease_expires.is_(None), ip.lease_expires < now),
+        or_(ip.mac_address.is_not(None), ip.vendor.is_not(None), ip.hostname.is_not(None)),
+    ), {"mac_address": None, "vendor": None, "hostname": None}, batch_size)
+
+    # Services recorded before they carried last_seen go with an IP that is offline or was never seen
+    stale_ip = select(ip.id).where(ip.id == models.IPService.ip_id, or_(ip.last_seen.is_(None), ip.last_seen < cutoff))
+    for key, model, criteria in (
+        ("mac_sightings", models.MACSighting, (models.MACSighting.last_seen < cutoff,)),
+        ("services", models.IPService, (or_(
+            models.IPService.last_seen < cutoff,
+            and_(models.IPService.last_seen.is_(None), stale_ip.exists())
+        ),)),
+        ("conflicts", models.IPConflict, (models.IPConflict.last_seen < cutoff,)),
+    ):
+        deleted[key], count = delete_in_batches(db, model, criteria, batch_size)
+        batches += count
+    return deleted, batches
+
+def compact_history(db: Session, retention_days: int = 30, daily_retention_days: int = 365, now: datetime = None,
+                    batch_size: int = BATCH_SIZE):
+    """
+    Deletes raw events and hourly rollups older than retention_days and daily
+    rollups older than daily_retention_days. The newest status event of each IP
+    is kept so its state at the retention boundary stays known.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=retention_days)
+
+    newer = aliased(models.IPEvent)
+    superseded = exists().where(
+        newer.ip_id == models.IPEvent.ip_id,
+        newer.event_type.in_(STATUS_EVENTS),
+        newer.timestamp > models.IPEvent.timestamp,
+        newer.timestamp < cutoff
+    )
+    deleted, batches = {}, 0
+    for key, model, criteria in (
+        ("events", models.IPEvent, (models.IPEvent.timestamp < cutoff, or_(
+            models.IPEvent.event_type.not_in(STATUS_EVENTS), superseded
+        ))),
+        ("hourly_rollups", models.AvailabilityRollup, (
+            models.AvailabilityRollup.period == "hour", models.AvailabilityRollup.bucket_start < cutoff
+        )),
+        ("daily_rollups", models.AvailabilityRollup, (
+            models.AvailabilityRollup.period == "day",
+            models.AvailabilityRollup.bucket_start < now - timedelta(days=daily_retention_days)
+        )),
+    ):
+        deleted[key], count = delete_in_batches(db, model, criteria, batch_size)
+        batches += count
+    return deleted, batches
+
+def _pragma(conn, name: str):
+    return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+def maintain(db: Session):
+    """
+    Returns free pages to the filesystem with incremental_vacuum, in steps that each hold
+    the write lock briefly, then refreshes the planner statistics with ANALYZE.
+    """
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        page_size = _pragma(conn, "page_size")
+        size_before = _pragma(conn, "page_count") * page_size
+        free_before = _pragma(conn, "freelist_count")
+
+        with metrics.Timer() as vacuum:
+            mode = "incremental" if _pragma(conn, "auto_vacuum") == 2 else None
+            if mode is None:
+                logger.warning("auto_vacuum is not INCREMENTAL (run the migrations); skipping vacuum")
+            free = free_before if mode else 0
+            while free:
+                # sqlite3's execute() steps a statement once, freeing a single page; executescript() runs it to the end
+                conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+                remaining = _pragma(conn, "freelist_count")
+                if remaining >= free:
+                    break
+                free = remaining
+                time.sleep(BATCH_PAUSE)
+        with metrics.Timer() as analyze:
+            conn.exec_driver_sql(f"PRAGMA analysis_limit={ANALYZE_LIMIT}")
+            conn.exec_driver_sql("ANALYZE")
+
+        size_after = _pragma(conn, "page_count") * page_size
+    return {
+        "vacuum": mode or "skipped",
+        "free_pages_before": free_before,
+        "size_before_bytes": size_before,
+        "size_after_bytes": size_after,
+        "reclaimed_bytes": max(0, size_before - size_after),
+        "vacuum_seconds": round(vacuum.elapsed, 3),
+        "analyze_seconds": round(analyze.elapsed, 3),
+    }
+
+def _get_setting(db: Session, key: str):
+    setting = db.query(models.Setting).filter(models.Setting.key == key).first()
+    return setting.value if setting else None
+
+def _set_setting(db: Session, key: str, value: str, description: str):
+    # Bookkeeping rows like the history watermark: not settings users edit, so the settings cache is not bumped
+    setting = db.query(models.Setting).filter(models.Setting.key == key).first()
+    if not setting:
+        setting = models.Setting(key=key, description=description)
+        db.add(setting)
+    setting.value = value
+
+def maintenance_due(db: Session, interval_hours: int, now: datetime = None):
+    if not interval_hours:
+        return False
+    last = _get_setting(db, MAINTENANCE_KEY)
+    now = now or datetime.now(timezone.utc)
+    return last is None or now - as_utc(datetime.fromisoformat(last)) >= timedelta(hours=interval_hours)
+
+def run(db: Session, settings: dict, maintenance: bool = None, now: datetime = None):
+    """
+    Applies the retention policies of settings and, when maintenance is True (or None and
+    retention_maintenance_hours have passed), vacuums and analyzes. Returns the run's report,
+    also kept for GET /retention. Raises ValueError if another process is running retention.
+    """
+    if not coordination.acquire(LEASE):
+        raise ValueError("Retention is already running in another process")
+    try:
+        now = now or datetime.now(timezone.utc)
+        if maintenance is None:
+            maintenance = maintenance_due(db, settings.get("retention_maintenance_hours", 24), now)
+        policies = [("history", compact_history, (settings.get("history_retention_days", 30),
+                                                  settings.get("history_daily_retention_days", 365)))]
+        if settings.get("retention_discovered_days"):
+            policies.append(("discovered", purge_discovered, (settings["retention_discovered_days"],)))
+        if settings.get("retention_offline_days"):
+            policies.append(("offline", purge_offline, (settings["retention_offline_days"],)))
+
+        report = {"started_at": now, "policies": [], "maintenance": None}
+        with metrics.Timer() as total:
+            for name, policy, args in policies:
+                with metrics.Timer() as timer:
+                    deleted, batches = policy(db, *args, now=now)
+                report["policies"].append({
+                    "policy": name, "deleted": deleted, "batches": batches, "seconds": round(timer.elapsed, 3),
+                })
+                for key, count in deleted.items():
+                    metrics.retention_rows_deleted.labels(key).inc(count)
+            if maintenance:
+                db.commit()
+                report["maintenance"] = maintain(db)
+                metrics.retention_reclaimed_bytes.inc(report["maintenance"]["reclaimed_bytes"])
+                _set_setting(db, MAINTENANCE_KEY, now.isoformat(), "Last retention vacuum and analyze")
+        report["elapsed_seconds"] = round(total.elapsed, 3)
+
+        _set_setting(db, REPORT_KEY, json.dumps(report, default=str), "Report of the last retention run")
+        db.commit()
+    finally:
+        coordination.release(LEASE)
+
+    deleted = sum(sum(p["deleted"].values()) for p in report["policies"])
+    reclaimed = report["maintenance"]["reclaimed_bytes"] if report["maintenance"] else 0
+    logger.info(f"Retention deleted {deleted} rows and reclaimed {reclaimed / 1048576:.1f} MB in {report['elapsed_seconds']:.1f}s")
+    return report
+
+def last_report(db: Session):
+    value = _get_setting(db, REPORT_KEY)
+    return json.loads(value) if value else None
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    from crud import get_settings
+
+    parser = argparse.ArgumentParser(description="Apply the retention policies from the settings")
+    parser.add_argument("--maintenance", action="store_true", help="also vacuum and analyze, whether due or not")
+    parser.add_argument("--no-maintenance", action="store_true", help="never vacuum or analyze")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        maintenance = True if args.maintenance else False if args.no_maintenance else None
+        print(json.dumps(run(db, get_settings(db), maintenance), indent=2, default=str))
+    finally:
+        db.close()
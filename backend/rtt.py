@@ -0,0 +1,66 @@
+import models
+
+# Fixed timeouts in seconds used until a subnet has RTT samples (or when adaptive timeouts are off)
+PING_TIMEOUT = 1
+SWEEP_TIMEOUT = 2
+
+# Probe timeout bounds in seconds. INITIAL_RTO matches the old fixed scan timeout.
+MIN_RTO = 0.05
+MAX_RTO = 5.0
+INITIAL_RTO = 2.0
+
+# RFC 6298 gains
+ALPHA = 0.125
+BETA = 0.25
+K = 4
+
+class RTTEstimator:
+    """
+    TCP-style smoothed round trip time (SRTT/RTTVAR) used to size probe timeouts.
+    Values are in seconds.
+    """
+
+    def __init__(self, srtt: float = None, rttvar: float = None, samples: int = 0):
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.samples = samples or 0
+
+    @classmethod
+    def from_subnet(cls, subnet: models.Subnet):
+        return cls(subnet.rtt_srtt, subnet.rtt_var, subnet.rtt_samples)
+
+    def update(self, sample: float):
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - sample)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * sample
+        self.samples += 1
+
+    def update_many(self, samples):
+        for sample in samples:
+            self.update(sample)
+
+    @property
+    def rto(self):
+        if self.srtt is None:
+            return INITIAL_RTO
+        return min(MAX_RTO, max(MIN_RTO, self.srtt + K * self.rttvar))
+
+    def timeout(self, default: float = INITIAL_RTO):
+        """
+        Probe timeout to use; falls back to default until the first sample is in.
+        """
+        return default if self.srtt is None else self.rto
+
+    def settle_time(self):
+        """
+        How long to keep listening for unknown hosts once every expected host has answered.
+        """
+        if self.srtt is None:
+            return self.rto / 4
+        return min(self.rto, max(MIN_RTO, 2 * self.srtt))
+
+    def as_columns(self):
+        return {"rtt_srtt": self.srtt, "rtt_var": self.rttvar, "rtt_samples": self.samples}
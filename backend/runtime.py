@@ -0,0 +1,5 @@
+import os
+
+# API_ONLY=1 serves the API without the Brain or scan jobs in this process, so the scanning
+# stack (scapy, dnspython, raw sockets) is never imported. Some other instance runs the Brain.
+API_ONLY = os.getenv("API_ONLY", "").strip().lower() in ("1", "true", "yes")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict, Field, field_validator
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from enum import Enum
 import ipaddress
@@ -11,6 +11,19 @@ class IPStatus(str, Enum):
     DHCP_POOL = "DHCP_POOL"
     DISCOVERED = "DISCOVERED"
 
+class EventType(str, Enum):
+    DISCOVERED = "DISCOVERED"
+    STATUS_CHANGED = "STATUS_CHANGED"
+    MAC_CHANGED = "MAC_CHANGED"
+    HOSTNAME_CHANGED = "HOSTNAME_CHANGED"
+    MAC_MOVED = "MAC_MOVED"
+
+DISCOVERY_BACKEND_PATTERN = "^(scapy|raw|nmap)$"
+DNS_MODE_PATTERN = "^(ptr|zone)$"
+BACKUP_METHOD_PATTERN = "^(vacuum|pages)$"
+BATCH_OP_PATTERN = "^(create|update|delete)$"
+BATCH_TYPE_PATTERN = "^(ip|device|range)$"
+
 # Base schemas
 class SubnetBase(BaseModel):
     name: str = Field(..., min_length=1)
@@ -22,6 +35,8 @@ class SubnetBase(BaseModel):
     tags: Optional[str] = None
     last_scan: Optional[datetime] = None
     scan_status: Optional[str] = "Idle"
+    scan_progress: Optional[int] = None
+    discovery_backend: Optional[str] = Field(None, pattern=DISCOVERY_BACKEND_PATTERN)
 
     @field_validator('network_address')
     @classmethod
@@ -43,6 +58,7 @@ class SubnetUpdate(BaseModel):
     vlan_id: Optional[int] = None
     description: Optional[str] = None
     tags: Optional[str] = None
+    discovery_backend: Optional[str] = Field(None, pattern=DISCOVERY_BACKEND_PATTERN)
 
     @field_validator('network_address')
     @classmethod
@@ -114,10 +130,82 @@ class IPAddressUpdate(BaseModel):
 
 class IPAddress(IPAddressBase):
     id: int
+    vendor: Optional[str] = None
     last_seen: Optional[datetime] = None
+    lease_expires: Optional[datetime] = None
     subnet: Optional[Subnet] = None
     model_config = ConfigDict(from_attributes=True)
 
+class IPEvent(BaseModel):
+    id: int
+    ip_id: int
+    event_type: EventType
+    old_value: Optional[str] = None
+    new_value: Optional[str] = None
+    timestamp: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class IPService(BaseModel):
+    id: int
+    ip_id: int
+    port: int
+    protocol: str
+    service: Optional[str] = None
+    product: Optional[str] = None
+    version: Optional[str] = None
+    last_seen: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class Availability(BaseModel):
+    start: datetime
+    end: datetime
+    online_seconds: int
+    observed_seconds: int
+    availability: Optional[float] = None
+    last_offline: Optional[datetime] = None
+
+class RTTStats(BaseModel):
+    subnet_id: int
+    srtt_ms: Optional[float] = None
+    rttvar_ms: Optional[float] = None
+    timeout_ms: float
+    samples: int
+    last_scan_duration: Optional[float] = None
+
+class ScanJob(BaseModel):
+    id: int
+    subnet_id: int
+    network: Optional[str] = None
+    backend: Optional[str] = None
+    state: str
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    elapsed_seconds: float
+    time_budget: Optional[float] = None
+    progress: float
+    eta_seconds: Optional[float] = None
+    total_probes: int
+    probes_sent: int
+    replies: int
+    hosts_ingested: int
+    probes_per_second: float
+
+class CoordinationLease(BaseModel):
+    name: str # "brain" or "subnet:<id>"
+    holder: str
+    acquired_at: datetime
+    expires_at: datetime
+    expired: bool
+    mine: bool # Held by the process answering
+
+class CoordinationStatus(BaseModel):
+    instance_id: str
+    api_only: bool
+    brain_leader: bool
+    leases: List[CoordinationLease] = []
+
 class IPRangeBase(BaseModel):
     subnet_id: int
     name: str
@@ -140,6 +228,15 @@ class IPRange(IPRangeBase):
     id: int
     model_config = ConfigDict(from_attributes=True)
 
+class IPRangeStats(BaseModel):
+    range_id: int
+    total: int
+    assigned: int
+    discovered: int
+    leased: int # Active DHCP leases
+    free: int
+    utilization: Optional[float] = None # Percent of the range assigned or discovered
+
 class DeviceWithIPs(Device):
     ip_addresses: List[IPAddress] = []
 
@@ -148,6 +245,92 @@ class IPAssignment(BaseModel):
     interface_name: Optional[str] = None
     model_config = ConfigDict(from_attributes=True)
 
+class MACSighting(BaseModel):
+    mac_address: str
+    address: str
+    subnet_id: Optional[int] = None
+    first_seen: datetime
+    last_seen: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class IPConflict(BaseModel):
+    id: int
+    kind: str
+    address: Optional[str] = None
+    mac_address: Optional[str] = None
+    members: List[str] = []
+    subnet_id: Optional[int] = None
+    first_seen: datetime
+    last_seen: datetime
+    occurrences: int
+    model_config = ConfigDict(from_attributes=True)
+
+    @field_validator('members', mode='before')
+    @classmethod
+    def split_members(cls, v):
+        if isinstance(v, str):
+            return [m for m in v.split(",") if m]
+        return v or []
+
+class LeaseSource(BaseModel):
+    path: str
+    format: str
+    offset: int
+    size: int
+    records: int
+    last_read: Optional[datetime] = None
+    error: Optional[str] = None
+
+class DNSMismatch(BaseModel):
+    address: str
+    kind: str
+    ptr: Optional[str] = None
+    forward: List[str] = []
+    ip_id: Optional[int] = None
+
+class DNSReconcileReport(BaseModel):
+    started: datetime
+    zones: int
+    errors: List[str] = []
+    ptr_records: int
+    forward_records: int
+    updated: int
+    mismatches: List[DNSMismatch] = []
+
+class BatchOperation(BaseModel):
+    op: str = Field(..., pattern=BATCH_OP_PATTERN)
+    type: str = Field(..., pattern=BATCH_TYPE_PATTERN)
+    id: Optional[int] = None # Required for update and delete
+    data: dict = {} # IPAddressCreate/Update, DeviceCreate/Update or IPRangeCreate/Update fields
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(..., max_length=50000)
+
+class BatchResult(BaseModel):
+    index: int
+    op: str
+    type: str
+    id: Optional[int] = None
+    status: str # created, updated, deleted, error, or skipped when another operation failed
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    applied: bool
+    replayed: bool = False
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    errors: int = 0
+    results: List[BatchResult] = []
+
+class MACLookup(BaseModel):
+    macs: List[str] = Field(..., max_length=10000)
+
+class TagCount(BaseModel):
+    name: str
+    subnets: int
+    devices: int
+
 class SettingBase(BaseModel):
     key: str
     value: str
@@ -163,6 +346,71 @@ class SettingsUpdate(BaseModel):
     dns_enabled: bool = False
     dns_server: Optional[str] = None
     dns_search_domains: Optional[str] = None
+    last_seen_granularity: int = Field(300, ge=0)
+    history_retention_days: int = Field(30, ge=1)
+    history_daily_retention_days: int = Field(365, ge=1)
+    discovery_backend: str = Field("scapy", pattern=DISCOVERY_BACKEND_PATTERN)
+    service_detection: bool = False
+    nmap_top_ports: int = Field(100, ge=1, le=65535)
+    adaptive_timeouts: bool = True
+    probe_retries: int = Field(1, ge=0, le=5)
+    scan_time_budget: int = Field(1800, ge=0)
+    passive_discovery: bool = False
+    passive_interface: str = ""
+    dhcp_lease_files: str = ""
+    dns_mode: str = Field("ptr", pattern=DNS_MODE_PATTERN)
+    dns_zones: str = ""
+    retention_discovered_days: int = Field(0, ge=0) # 0 keeps discovered IPs forever
+    retention_offline_days: int = Field(0, ge=0) # 0 keeps the MACs and hostnames of offline IPs, sightings, services and conflicts forever
+    retention_maintenance_hours: int = Field(24, ge=0) # 0 disables vacuum and analyze
+    backup_interval_hours: int = Field(0, ge=0) # 0 disables scheduled backups
+    backup_keep: int = Field(7, ge=1)
+    backup_method: str = Field("vacuum", pattern=BACKUP_METHOD_PATTERN)
+    backup_compress: bool = True
+
+class RetentionPolicyResult(BaseModel):
+    policy: str # "history", "discovered" or "offline"
+    deleted: Dict[str, int]
+    batches: int
+    seconds: float
+
+class RetentionMaintenance(BaseModel):
+    vacuum: str # "incremental" or "skipped"
+    free_pages_before: int
+    size_before_bytes: int
+    size_after_bytes: int
+    reclaimed_bytes: int
+    vacuum_seconds: float
+    analyze_seconds: float
+
+class RetentionReport(BaseModel):
+    started_at: datetime
+    elapsed_seconds: float
+    policies: List[RetentionPolicyResult] = []
+    maintenance: Optional[RetentionMaintenance] = None
+
+class Backup(BaseModel):
+    name: str
+    created_at: datetime
+    method: str # "vacuum" or "pages"
+    compressed: bool
+    database_bytes: int # Live database file when the snapshot was taken
+    snapshot_bytes: int # Uncompressed snapshot
+    size_bytes: int # Stored file
+    sha256: str
+    alembic_revision: Optional[str] = None
+    tables: Dict[str, int] # Row counts, compared again on verification
+    integrity: str
+    backup_steps: int
+    snapshot_seconds: float
+    check_seconds: float
+    compress_seconds: float
+
+class BackupVerification(BaseModel):
+    name: str
+    ok: bool
+    errors: List[str] = []
+    seconds: float
 
 Subnet.model_rebuild()
 IPAddress.model_rebuild()
@@ -0,0 +1,131 @@
+import re
+from sqlalchemy import text
+
+# SQLite FTS5 index over devices, one row per device (rowid = device id). Triggers rebuild a
+# device's row whenever the device or one of its IPs changes, so ORM writes, bulk core updates
+# from ingest and raw SQL all stay in sync. A migration that recreates devices or ip_addresses
+# (batch_alter_table) must drop the triggers before and recreate them after: SQLite refuses to
+# rename a table over triggers that reference it, and drops a table's triggers with it. Migrations
+# carry their own copy of the DDL (see aa312671644a); a change here needs a new migration.
+TABLE = "device_search"
+TEXT_COLUMNS = ("hostname", "manufacturer", "model", "tags", "notes")
+ADDRESS_COLUMNS = ("macs", "addresses")
+COLUMNS = TEXT_COLUMNS + ADDRESS_COLUMNS
+# bm25 weights, same order as COLUMNS
+WEIGHTS = (10.0, 2.0, 2.0, 3.0, 1.0, 5.0, 5.0)
+# Set per query with "rank MATCH", so ORDER BY rank LIMIT keeps FTS5's top-N sort over every match
+RANK = f"bm25({', '.join(str(w) for w in WEIGHTS)})"
+MAX_RESULTS = 100
+
+# unicode61 splits text on punctuation ("sw-core" -> sw core). Addresses and MACs are stored with
+# their separators replaced by "_", a token character here, so each one is a single token and
+# "10.1.2." can prefix match 10_1_2_* without also matching 10.10.1.2.
+_TOKEN = re.compile(r"\w+")
+_ADDRESS_TERM = re.compile(r"^[0-9a-f]+([.:][0-9a-f]*)*$", re.IGNORECASE)
+
+def _address_token(column: str) -> str:
+    return f"replace(replace({column}, '.', '_'), ':', '_')"
+
+def _refresh(device_id: str) -> str:
+    return f"""
+        DELETE FROM {TABLE} WHERE rowid = {device_id};
+        INSERT INTO {TABLE}(rowid, {", ".join(COLUMNS)})
+        SELECT d.id, d.hostname, d.manufacturer, d.model, d.tags, d.notes,
+            (SELECT group_concat({_address_token("mac_address")}, ' ') FROM ip_addresses WHERE device_id = d.id),
+            (SELECT group_concat({_address_token("address")}, ' ') FROM ip_addresses WHERE device_id = d.id)
+        FROM devices d WHERE d.id = {device_id};
+    """
+
+SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5({', '.join(COLUMNS)}, tokenize=\"unicode61 tokenchars '_'\", prefix='1 2 3')",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_device_insert AFTER INSERT ON devices BEGIN
+        {_refresh("NEW.id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_device_update
+        AFTER UPDATE OF hostname, manufacturer, model, tags, notes ON devices BEGIN
+        {_refresh("NEW.id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_device_delete AFTER DELETE ON devices BEGIN
+        DELETE FROM {TABLE} WHERE rowid = OLD.id;
+    END""",
+    # Unassigned IPs (most of them, and most of the Brain's writes) never touch the index
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ip_insert AFTER INSERT ON ip_addresses
+        WHEN NEW.device_id IS NOT NULL BEGIN
+        {_refresh("NEW.device_id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ip_update
+        AFTER UPDATE OF device_id, address, mac_address ON ip_addresses
+        WHEN OLD.device_id IS NOT NULL OR NEW.device_id IS NOT NULL BEGIN
+        {_refresh("OLD.device_id")}
+        {_refresh("NEW.device_id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ip_delete AFTER DELETE ON ip_addresses
+        WHEN OLD.device_id IS NOT NULL BEGIN
+        {_refresh("OLD.device_id")}
+    END""",
+]
+
+TRIGGERS = ("device_insert", "device_update", "device_delete", "ip_insert", "ip_update", "ip_delete")
+
+def create_index(conn):
+    """
+    Creates the FTS table and its triggers and fills it from the current data.
+    """
+    for statement in SCHEMA:
+        conn.exec_driver_sql(statement)
+    rebuild(conn)
+
+def drop_index(conn):
+    for trigger in TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {TABLE}_{trigger}")
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE}")
+
+def rebuild(conn):
+    conn.exec_driver_sql(f"DELETE FROM {TABLE}")
+    conn.exec_driver_sql(f"""
+        INSERT INTO {TABLE}(rowid, {", ".join(COLUMNS)})
+        SELECT d.id, d.hostname, d.manufacturer, d.model, d.tags, d.notes, ips.macs, ips.addresses
+        FROM devices d
+        LEFT JOIN (
+            SELECT device_id, group_concat({_address_token("mac_address")}, ' ') AS macs,
+                group_concat({_address_token("address")}, ' ') AS addresses
+            FROM ip_addresses WHERE device_id IS NOT NULL GROUP BY device_id
+        ) ips ON ips.device_id = d.id
+    """)
+
+def _phrase(columns, tokens: str, prefix: bool) -> str:
+    # The exact phrase is OR-ed in so "host-1" ranks above host-10, host-11, ...
+    match = f'("{tokens}"* OR "{tokens}")' if prefix else f'"{tokens}"'
+    return f"{{{' '.join(columns)}}} : {match}"
+
+def build_match(query: str):
+    """
+    Turns user input into an FTS5 MATCH expression. Each whitespace separated term
+    becomes a phrase of its tokens, all terms must match, and a term is a prefix
+    unless it ends with a separator. Terms that look like an IP or MAC prefix
+    also match the address columns ("10.1.2." matches 10.1.2.x, not 10.1.20.x).
+    """
+    phrases = []
+    for term in query.split():
+        tokens = _TOKEN.findall(term.lower())
+        if not tokens:
+            continue
+        phrase = _phrase(TEXT_COLUMNS, " ".join(tokens), term[-1].isalnum())
+        if _ADDRESS_TERM.match(term):
+            address = term.lower().replace(".", "_").replace(":", "_")
+            phrase = f"({phrase} OR {_phrase(ADDRESS_COLUMNS, address, True)})"
+        phrases.append(phrase)
+    return " AND ".join(phrases) or None
+
+def search_device_ids(db, query: str, limit: int = 20):
+    """
+    Device ids matching the query, best match first.
+    """
+    match = build_match(query)
+    if match is None:
+        return []
+    rows = db.execute(
+        text(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH :match AND rank MATCH :rank ORDER BY rank LIMIT :limit"),
+        {"match": match, "rank": RANK, "limit": max(1, min(limit, MAX_RESULTS))},
+    )
+    return [row[0] for row in rows]
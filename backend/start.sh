@@ -5,6 +5,6 @@ set -e
 echo "Running database migrations..."
 alembic upgrade head
 
-# Start the application
+# Start the application (WEB_CONCURRENCY=N runs N workers; they elect one Brain between them)
 echo "Starting application..."
 exec uvicorn main:app --host 0.0.0.0 --port 8000
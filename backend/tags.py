@@ -0,0 +1,165 @@
+import re
+from sqlalchemy import select, func, and_, or_, not_, insert
+import models
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+_CHUNK = 500
+
+# Tag expressions: names combined with AND, OR, NOT and parentheses ("prod AND (dmz OR lab) AND NOT legacy").
+# Adjacent names without an operator are AND-ed. Names are matched case-insensitively.
+_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+_KEYWORDS = {"AND", "OR", "NOT"}
+
+def parse_tags(value):
+    """
+    Splits a comma-separated tags string into unique lowercase names, in order.
+    """
+    names = []
+    for part in (value or "").split(","):
+        name = part.strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def sync_tags(db, obj):
+    """
+    Points obj.tag_set (Subnet or Device) at the Tag rows for obj.tags, creating missing ones.
+    """
+    names = parse_tags(obj.tags)
+    existing = {t.name: t for t in db.query(models.Tag).filter(models.Tag.name.in_(names))} if names else {}
+    for name in names:
+        if name not in existing:
+            existing[name] = models.Tag(name=name)
+            db.add(existing[name])
+    obj.tag_set = [existing[name] for name in names]
+
+def sync_device_tags(db, assignments: dict):
+    """
+    Set-based sync_tags for many devices at once: {device_id: tags string}. Replaces their
+    device_tags rows and creates missing Tag rows with executemany inserts.
+    """
+    names_by_device = {device_id: parse_tags(value) for device_id, value in assignments.items()}
+    names = sorted(set().union(*names_by_device.values()))
+    tag_ids = {}
+    for i in range(0, len(names), _CHUNK):
+        tag_ids.update((t.name, t.id) for t in db.query(models.Tag.id, models.Tag.name).filter(models.Tag.name.in_(names[i:i + _CHUNK])))
+    missing = [name for name in names if name not in tag_ids]
+    if missing:
+        ids = db.execute(
+            insert(models.Tag).returning(models.Tag.id, sort_by_parameter_order=True), [{"name": name} for name in missing]
+        ).scalars().all()
+        tag_ids.update(zip(missing, ids))
+
+    device_ids = list(names_by_device)
+    for i in range(0, len(device_ids), _CHUNK):
+        db.execute(models.device_tags.delete().where(models.device_tags.c.device_id.in_(device_ids[i:i + _CHUNK])))
+    links = [
+        {"device_id": device_id, "tag_id": tag_ids[name]}
+        for device_id, device_names in names_by_device.items() for name in device_names
+    ]
+    if links:
+        db.execute(models.device_tags.insert(), links)
+
+def _has_tag(links, owner_column, name):
+    return select(owner_column).join(models.Tag, models.Tag.id == links.c.tag_id).where(models.Tag.name == name)
+
+class _Parser:
+    """
+    Recursive descent over the tokens: expr := term (OR term)*, term := factor ([AND] factor)*,
+    factor := NOT factor | ( expr ) | name. Returns a SQL clause built by match(name).
+    """
+
+    def __init__(self, expression: str, match):
+        self.tokens = _TOKEN.findall(expression)
+        self.pos = 0
+        self.match = match
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty tag expression")
+        clause = self.expr()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected '{self.peek()}' in tag expression")
+        return clause
+
+    def expr(self):
+        clauses = [self.term()]
+        while self.peek() is not None and self.peek().upper() == "OR":
+            self.take()
+            clauses.append(self.term())
+        return clauses[0] if len(clauses) == 1 else or_(*clauses)
+
+    def term(self):
+        clauses = [self.factor()]
+        while self.peek() is not None and self.peek() != ")" and self.peek().upper() != "OR":
+            if self.peek().upper() == "AND":
+                self.take()
+            clauses.append(self.factor())
+        return clauses[0] if len(clauses) == 1 else and_(*clauses)
+
+    def factor(self):
+        token = self.take()
+        if token is None:
+            raise ValueError("Tag expression ends unexpectedly")
+        if token.upper() == "NOT":
+            return not_(self.factor())
+        if token == "(":
+            clause = self.expr()
+            if self.take() != ")":
+                raise ValueError("Missing ')' in tag expression")
+            return clause
+        if token == ")" or token.upper() in _KEYWORDS:
+            raise ValueError(f"Unexpected '{token}' in tag expression")
+        return self.match(token.lower())
+
+def subnet_filter(expression: str):
+    return _Parser(expression, lambda name: models.Subnet.id.in_(
+        _has_tag(models.subnet_tags, models.subnet_tags.c.subnet_id, name)
+    )).parse()
+
+def device_filter(expression: str):
+    return _Parser(expression, lambda name: models.Device.id.in_(
+        _has_tag(models.device_tags, models.device_tags.c.device_id, name)
+    )).parse()
+
+def ip_filter(expression: str):
+    # An IP carries the tags of its subnet and of its device
+    return _Parser(expression, lambda name: or_(
+        models.IPAddress.subnet_id.in_(_has_tag(models.subnet_tags, models.subnet_tags.c.subnet_id, name)),
+        models.IPAddress.device_id.in_(_has_tag(models.device_tags, models.device_tags.c.device_id, name)),
+    )).parse()
+
+def _counts(db, links, owner_column, owner_filter):
+    query = (
+        db.query(models.Tag.name, func.count(owner_column))
+        .join(links, links.c.tag_id == models.Tag.id)
+        .group_by(models.Tag.name)
+    )
+    if owner_filter is not None:
+        query = query.filter(owner_filter)
+    return dict(query.all())
+
+def tag_counts(db, expression: str = None):
+    """
+    Subnet and device counts per tag. With an expression, only subnets and devices
+    matching it are counted (facets for the current selection).
+    """
+    subnet_clause = device_clause = None
+    if expression:
+        subnet_clause = models.subnet_tags.c.subnet_id.in_(select(models.Subnet.id).where(subnet_filter(expression)))
+        device_clause = models.device_tags.c.device_id.in_(select(models.Device.id).where(device_filter(expression)))
+    subnets = _counts(db, models.subnet_tags, models.subnet_tags.c.subnet_id, subnet_clause)
+    devices = _counts(db, models.device_tags, models.device_tags.c.device_id, device_clause)
+    rows = [
+        {"name": name, "subnets": subnets.get(name, 0), "devices": devices.get(name, 0)}
+        for name in set(subnets) | set(devices)
+    ]
+    return sorted(rows, key=lambda r: (-(r["subnets"] + r["devices"]), r["name"]))
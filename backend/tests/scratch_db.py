@@ -0,0 +1,29 @@
+"""
+Scratch database for tests that need one. Importing this module points DATABASE_URL at a
+temporary SQLite file and migrates it to head, so it must come before anything that imports
+database. Every test module that imports it shares the same file.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+if "database" in sys.modules:
+    raise RuntimeError("Import scratch_db before database so the tests do not run against a real database")
+
+_dir = tempfile.mkdtemp(prefix="ipam-test-")
+atexit.register(shutil.rmtree, _dir, True)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_dir, 'ipam.db')}"
+os.environ["API_ONLY"] = "1"
+
+from alembic import command
+from alembic.config import Config
+
+# No config file, so env.py leaves the logging configuration alone
+_config = Config()
+_config.set_main_option("script_location", os.path.join(BACKEND, "migrations"))
+command.upgrade(_config, "head")
@@ -0,0 +1,57 @@
+"""
+POST /batch against a scratch database.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scratch_db  # noqa: F401 (sets DATABASE_URL)
+from fastapi.testclient import TestClient
+
+import main
+
+class RangeUpdateTest(unittest.TestCase):
+    _subnets = 0
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(main.app)
+
+    def setUp(self):
+        # A subnet and range of its own per test, so a failing test cannot leak into the next
+        RangeUpdateTest._subnets += 1
+        self.net = net = f"10.44.{self._subnets}"
+        subnet = self.client.post("/subnets/", json={"name": f"batch{self._subnets}", "network_address": f"{net}.0", "prefix_length": 24}).json()
+        self.range = self.client.post("/ranges/", json={
+            "subnet_id": subnet["id"], "name": "pool", "start_ip": f"{net}.100", "end_ip": f"{net}.199", "purpose": "DHCP",
+        }).json()
+
+    def _stats(self):
+        return self.client.get(f"/ranges/{self.range['id']}/stats").json()
+
+    def test_null_bounds_rejected_like_put(self):
+        for field in ("start_ip", "end_ip"):
+            with self.subTest(field=field):
+                body = {field: None}
+                self.assertEqual(self.client.put(f"/ranges/{self.range['id']}", json=body).status_code, 400)
+                response = self.client.post("/batch", json={"operations": [
+                    {"op": "update", "type": "range", "id": self.range["id"], "data": body},
+                ]})
+                self.assertNotEqual(response.status_code, 200)
+                self.assertIsNotNone(response.json()["results"][0]["error"])
+                stored = self.client.get(f"/ranges/{self.range['id']}").json()
+                self.assertEqual((stored["start_ip"], stored["end_ip"]), (self.range["start_ip"], self.range["end_ip"]))
+                self.assertEqual(self._stats()["total"], 100)
+
+    def test_one_bound_keeps_the_other(self):
+        response = self.client.post("/batch", json={"operations": [
+            {"op": "update", "type": "range", "id": self.range["id"], "data": {"end_ip": f"{self.net}.149"}},
+        ]})
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(self._stats()["total"], 50)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Measures SQLite write lock waits on an instrumented engine over the scratch database
+while another connection holds the lock.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scratch_db  # noqa: F401 (sets DATABASE_URL)
+from sqlalchemy import create_engine, exc, text
+
+import metrics
+
+DATABASE_PATH = os.environ["DATABASE_URL"].removeprefix("sqlite:///")
+
+class LockWaitTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine(os.environ["DATABASE_URL"], connect_args={"timeout": 5})
+        metrics.instrument_engine(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE IF NOT EXISTS lock_probe (id INTEGER PRIMARY KEY, note TEXT)"))
+        self.waits = metrics.db_lock_wait.labels()
+        self.outcomes = {outcome: metrics.db_lock_waits.labels(outcome).value for outcome in ("waited", "locked")}
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def hold_write_lock(self, seconds: float):
+        holder = sqlite3.connect(DATABASE_PATH, isolation_level=None, check_same_thread=False)
+        holder.execute("BEGIN IMMEDIATE")
+
+        def release():
+            time.sleep(seconds)
+            holder.execute("COMMIT")
+            holder.close()
+        thread = threading.Thread(target=release)
+        thread.start()
+        return thread
+
+    def increase(self, outcome: str):
+        return metrics.db_lock_waits.labels(outcome).value - self.outcomes[outcome]
+
+    def test_uncontended_write(self):
+        count = sum(self.waits.counts)
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT count(*) FROM lock_probe"))
+            conn.execute(text("INSERT INTO lock_probe (note) VALUES ('free')"))
+            conn.execute(text("INSERT INTO lock_probe (note) VALUES ('same transaction')"))
+        # One acquisition per transaction, none for reads
+        self.assertEqual(sum(self.waits.counts), count + 1)
+        self.assertEqual(self.increase("waited"), 0)
+
+    def test_wait_is_measured(self):
+        total = self.waits.sum
+        thread = self.hold_write_lock(0.3)
+        with self.engine.begin() as conn:
+            start = time.perf_counter()
+            conn.execute(text("INSERT INTO lock_probe (note) VALUES ('waited')"))
+            elapsed = time.perf_counter() - start
+        thread.join()
+        waited = self.waits.sum - total
+        self.assertGreater(waited, 0.2)
+        self.assertLessEqual(waited, elapsed)
+        self.assertEqual(self.increase("waited"), 1)
+
+    def test_reads_do_not_wait(self):
+        thread = self.hold_write_lock(0.3)
+        try:
+            with self.engine.connect() as conn:
+                start = time.perf_counter()
+                conn.execute(text("SELECT count(*) FROM lock_probe")).scalar()
+                self.assertLess(time.perf_counter() - start, 0.2)
+        finally:
+            thread.join()
+        self.assertEqual(self.increase("waited"), 0)
+
+    def test_gives_up(self):
+        engine = create_engine(os.environ["DATABASE_URL"], connect_args={"timeout": 0.05})
+        metrics.instrument_engine(engine)
+        thread = self.hold_write_lock(0.3)
+        try:
+            with self.assertRaises(exc.OperationalError):
+                with engine.begin() as conn:
+                    conn.execute(text("INSERT INTO lock_probe (note) VALUES ('locked')"))
+        finally:
+            thread.join()
+            engine.dispose()
+        self.assertEqual(self.increase("locked"), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Runs recorded nmap -oX output through parse_nmap_xml.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+import nmap_scanner
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def _fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+class ChunkedStream(io.RawIOBase):
+    """
+    Returns at most size bytes per read, like a pipe delivering nmap output in pieces.
+    """
+    def __init__(self, data: bytes, size: int):
+        self._data = data
+        self._size = size
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        chunk, self._data = self._data[:self._size], self._data[self._size:]
+        return chunk
+
+class ParseNmapXmlTest(unittest.TestCase):
+    def test_ping_sweep(self):
+        progress = []
+        hosts = list(nmap_scanner.parse_nmap_xml(io.BytesIO(_fixture("nmap_sn.xml")), progress.append))
+        self.assertEqual([h["ip"] for h in hosts], ["192.0.2.1", "192.0.2.7", "192.0.2.10"])
+        self.assertEqual(hosts[0], {
+            "ip": "192.0.2.1", "mac": "00:1b:c5:00:00:01", "vendor": "Converging Systems",
+            "hostname": None, "ports": [],
+        })
+        self.assertEqual(hosts[1]["mac"], "52:54:00:ab:cd:ef")
+        # The scanning host itself has no MAC address
+        self.assertIsNone(hosts[2]["mac"])
+        self.assertEqual(progress, [43.75, 87.5])
+
+    def test_service_scan(self):
+        progress = []
+        hosts = list(nmap_scanner.parse_nmap_xml(io.BytesIO(_fixture("nmap_sv.xml")), progress.append))
+        self.assertEqual(len(hosts), 2)
+        gateway, server = hosts
+        self.assertEqual(gateway["hostname"], "gw.example.net")
+        # Filtered 8080 is left out
+        self.assertEqual(gateway["ports"], [
+            {"port": 22, "protocol": "tcp", "service": "ssh", "product": "OpenSSH", "version": "9.2p1 Debian 2+deb12u3"},
+            {"port": 53, "protocol": "tcp", "service": "domain", "product": "dnsmasq", "version": "2.89"},
+        ])
+        self.assertEqual(server["ports"], [
+            {"port": 443, "protocol": "tcp", "service": "http", "product": "nginx", "version": None},
+        ])
+        self.assertEqual(progress, [61.2, 50.0])
+
+    def test_small_reads(self):
+        data = _fixture("nmap_sv.xml")
+        whole = list(nmap_scanner.parse_nmap_xml(io.BytesIO(data)))
+        self.assertEqual(list(nmap_scanner.parse_nmap_xml(ChunkedStream(data, 7))), whole)
+
+    def test_truncated_stream(self):
+        # Cut inside the third <host>, as when nmap is killed mid-sweep
+        data = _fixture("nmap_sn.xml")
+        cut = data.index(b'<address addr="192.0.2.10"')
+        with self.assertLogs("nmap_scanner", "WARNING"):
+            hosts = list(nmap_scanner.parse_nmap_xml(io.BytesIO(data[:cut])))
+        self.assertEqual([h["ip"] for h in hosts], ["192.0.2.1", "192.0.2.7"])
+
+    def test_empty_stream(self):
+        with self.assertLogs("nmap_scanner", "WARNING"):
+            self.assertEqual(list(nmap_scanner.parse_nmap_xml(io.BytesIO(b""))), [])
+
+class IterScanTest(unittest.TestCase):
+    def _run(self, stderr: str, repeat: int = 1, exit_code: int = 0):
+        # A stand-in for nmap: stderr, then the fixture on stdout, then the exit status
+        fixture = os.path.join(FIXTURES, "nmap_sn.xml")
+        code = (f"import sys, shutil; sys.stderr.write({stderr!r} * {repeat}); sys.stderr.flush(); "
+                f"shutil.copyfileobj(open({fixture!r}, 'rb'), sys.stdout.buffer); sys.exit({exit_code})")
+        with mock.patch.object(nmap_scanner, "build_command", return_value=[sys.executable, "-c", code]):
+            return list(nmap_scanner.iter_scan("192.0.2.0/28"))
+
+    def test_noisy_stderr_does_not_block(self):
+        # Well past a pipe buffer (64 KiB on Linux) of warnings before any XML
+        hosts = self._run("Warning: retransmission cap hit\n", repeat=20000)
+        self.assertEqual(len(hosts), 3)
+
+    def test_exit_status_is_logged(self):
+        with self.assertLogs("nmap_scanner", "ERROR") as logs:
+            self._run("Failed to resolve\n", exit_code=1)
+        self.assertIn("nmap exited with 1: Failed to resolve", logs.output[0])
+
+if __name__ == "__main__":
+    unittest.main()
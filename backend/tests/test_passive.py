@@ -0,0 +1,115 @@
+"""
+Replays tests/fixtures/passive.pcap through passive discovery. The capture holds, in order:
+an ARP reply from 192.0.2.1 (twice), one from a second MAC claiming 192.0.2.1, an ARP probe,
+a DHCP REQUEST carrying hostname printer-1 and the ACK binding 192.0.2.50 to that client,
+an ND advertisement for 2001:db8::10 (sent from a different MAC than its target link-layer
+option), an ND solicitation from 2001:db8::20, a DAD solicitation from ::, and three frames
+the capture filter drops: a TCP SYN, an ICMPv6 echo request and a non-first IPv4 fragment
+whose payload starts with UDP ports 68 -> 67.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scratch_db  # noqa: F401 (sets DATABASE_URL)
+from fastapi.testclient import TestClient
+
+import main
+import models
+import passive
+from database import SessionLocal
+
+PCAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "passive.pcap")
+
+def run_filter(program: bytes, frame: bytes) -> int:
+    """
+    Interprets the classic BPF opcodes CAPTURE_PROGRAM uses, like the kernel would.
+    Returns the number of bytes to keep (0 drops the frame).
+    """
+    instructions = list(struct.iter_unpack("HBBI", program))
+    a = x = pc = 0
+    while True:
+        opcode, jt, jf, k = instructions[pc]
+        pc += 1
+        if opcode == passive._BPF_LD_H_ABS:
+            a = struct.unpack_from("!H", frame, k)[0]
+        elif opcode == passive._BPF_LD_B_ABS:
+            a = frame[k]
+        elif opcode == passive._BPF_LD_H_IND:
+            a = struct.unpack_from("!H", frame, x + k)[0]
+        elif opcode == passive._BPF_LDX_B_MSH:
+            x = (frame[k] & 0x0F) * 4
+        elif opcode == passive._BPF_JEQ:
+            pc += jt if a == k else jf
+        elif opcode == passive._BPF_JSET:
+            pc += jt if a & k else jf
+        elif opcode == passive._BPF_RET:
+            return k
+        else:
+            raise AssertionError(f"Unexpected BPF opcode {opcode:#x}")
+
+class PcapTest(unittest.TestCase):
+    def setUp(self):
+        self.frames = list(passive.read_pcap(PCAP))
+
+    def test_parse_frame(self):
+        self.assertEqual([passive.parse_frame(frame) for frame in self.frames], [
+            [{"ip": "192.0.2.1", "mac": "00:1b:c5:00:00:01"}],
+            [{"ip": "192.0.2.1", "mac": "00:1b:c5:00:00:01"}],
+            [{"ip": "192.0.2.1", "mac": "00:1b:c5:00:00:02"}],
+            # ARP probe from 0.0.0.0
+            [],
+            # Hostname hint, no address yet
+            [{"ip": None, "mac": "52:54:00:ab:cd:ef", "hostname": "printer-1"}],
+            [{"ip": "192.0.2.50", "mac": "52:54:00:ab:cd:ef", "hostname": None}],
+            # The target link-layer option wins over the Ethernet source
+            [{"ip": "2001:db8::10", "mac": "00:1b:c5:00:00:10"}],
+            [{"ip": "2001:db8::20", "mac": "00:1b:c5:00:00:20"}],
+            # Duplicate address detection
+            [],
+            [], [], [],
+        ])
+
+    def test_capture_filter(self):
+        program = passive.assemble(passive.CAPTURE_PROGRAM)
+        kept = [run_filter(program, frame) for frame in self.frames]
+        self.assertEqual(kept, [passive.SNAPLEN] * 9 + [0, 0, 0])
+
+    def test_truncated_frames_are_ignored(self):
+        for frame in self.frames:
+            for length in (13, 20, 40):
+                self.assertIsInstance(passive.parse_frame(frame[:length]), list)
+
+    def test_not_a_pcap(self):
+        with self.assertRaises(ValueError):
+            list(passive.read_pcap(__file__))
+
+    def test_replay_dry_run_coalesces(self):
+        self.assertEqual(passive.replay(PCAP, dry_run=True), [
+            {"ip": "192.0.2.1", "mac": "00:1b:c5:00:00:01", "hostname": None, "online": True},
+            {"ip": "192.0.2.1", "mac": "00:1b:c5:00:00:02", "hostname": None, "online": True},
+            {"ip": "192.0.2.50", "mac": "52:54:00:ab:cd:ef", "hostname": "printer-1", "online": True},
+            {"ip": "2001:db8::10", "mac": "00:1b:c5:00:00:10", "hostname": None, "online": True},
+            {"ip": "2001:db8::20", "mac": "00:1b:c5:00:00:20", "hostname": None, "online": True},
+        ])
+
+    def test_replay_writes_sightings_inside_subnets(self):
+        client = TestClient(main.app)
+        client.post("/subnets/", json={"name": "passive", "network_address": "192.0.2.0", "prefix_length": 24})
+        totals = passive.replay(PCAP)
+        # The IPv6 sightings match no subnet and are dropped
+        self.assertEqual((totals["observed"], totals["created"]), (3, 2))
+        db = SessionLocal()
+        try:
+            ip = db.query(models.IPAddress).filter(models.IPAddress.address == "192.0.2.50").one()
+            self.assertEqual((ip.mac_address, ip.hostname), ("52:54:00:ab:cd:ef", "printer-1"))
+            self.assertIsNone(db.query(models.IPAddress).filter(models.IPAddress.address == "2001:db8::10").first())
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    unittest.main()
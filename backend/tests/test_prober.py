@@ -0,0 +1,251 @@
+"""
+Drives prober.Prober with fake sockets, and checks rtt.RTTEstimator against RFC 6298.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import asyncio
+import errno
+import os
+import socket
+import struct
+import sys
+import time
+import unittest
+from unittest import mock
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+import prober
+import rtt
+
+SRC_MAC = bytes.fromhex("020000000001")
+SRC_IP = socket.inet_aton("192.0.2.254")
+
+def arp_reply(ip: str, mac: str) -> bytes:
+    sender_mac = bytes.fromhex(mac.replace(":", ""))
+    ethernet = SRC_MAC + sender_mac + struct.pack("!H", prober.ETH_P_ARP)
+    arp = struct.pack("!HHBBH6s4s6s4s", 1, prober.ETH_P_IP, 6, 4, 2, sender_mac, socket.inet_aton(ip), SRC_MAC, SRC_IP)
+    return ethernet + arp
+
+def icmp_reply(ip: str, identifier: int, icmp_type: int = prober.ICMP_ECHO_REPLY) -> bytes:
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 38, 0, 0, 64, socket.IPPROTO_ICMP, 0, socket.inet_aton(ip), SRC_IP)
+    return header + struct.pack("!BBHHH", icmp_type, 0, 0, identifier, 1) + prober.ICMP_PAYLOAD
+
+class FakeSocket:
+    """
+    Records what is sent and delivers the responder's replies through a datagram socketpair,
+    so the prober's event loop readers fire as they would on a raw socket. send_errors are
+    raised by the next sends, in order, before anything is recorded.
+    """
+
+    def __init__(self, responder=None, delay: float = 0.0):
+        self._ours, self._peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._ours.setblocking(False)
+        self.responder = responder
+        self.delay = delay
+        self.sent = []
+        self.send_errors = []
+
+    def fileno(self):
+        return self._ours.fileno()
+
+    def recv(self, size):
+        return self._ours.recv(size)
+
+    def send(self, data):
+        return self.sendto(data, None)
+
+    def sendto(self, data, address):
+        if self.send_errors:
+            raise self.send_errors.pop(0)
+        self.sent.append((bytes(data), address))
+        for reply in (self.responder(bytes(data), address) if self.responder else ()):
+            if self.delay:
+                asyncio.get_running_loop().call_later(self.delay, self._peer.send, reply)
+            else:
+                self._peer.send(reply)
+        return len(data)
+
+    def close(self):
+        self._ours.close()
+        self._peer.close()
+
+def _arp_target(frame: bytes) -> str:
+    return socket.inet_ntoa(frame[prober.ARP_TARGET_OFFSET:prober.ARP_TARGET_OFFSET + 4])
+
+class PacketTest(unittest.TestCase):
+    def test_icmp_echo_checksum(self):
+        packet = prober.build_icmp_echo(0x1234, 7)
+        self.assertEqual(prober._checksum(packet), 0)
+        self.assertEqual(struct.unpack_from("!BBHHH", packet)[3:], (0x1234, 7))
+
+    def test_parse_replies(self):
+        self.assertEqual(prober.parse_arp_reply(arp_reply("192.0.2.1", "00:1b:c5:00:00:01")),
+                         (socket.inet_aton("192.0.2.1"), "00:1b:c5:00:00:01"))
+        request = prober.build_arp_template(SRC_MAC, SRC_IP)
+        self.assertIsNone(prober.parse_arp_reply(bytes(request)))
+        self.assertIsNone(prober.parse_arp_reply(arp_reply("192.0.2.1", "00:1b:c5:00:00:01")[:41]))
+        self.assertEqual(prober.parse_icmp_reply(icmp_reply("192.0.2.1", 99), 99), socket.inet_aton("192.0.2.1"))
+        self.assertIsNone(prober.parse_icmp_reply(icmp_reply("192.0.2.1", 98), 99))
+        self.assertIsNone(prober.parse_icmp_reply(icmp_reply("192.0.2.1", 99, icmp_type=3), 99))
+
+class ProberTest(unittest.TestCase):
+    def setUp(self):
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def _prober(self, arp_responder=None, icmp_responder=None, delay: float = 0.0):
+        arp = FakeSocket(arp_responder, delay)
+        icmp = FakeSocket(icmp_responder, delay)
+        self.sockets += [arp, icmp]
+        return prober.Prober(arp, icmp, prober.build_arp_template(SRC_MAC, SRC_IP)), arp, icmp
+
+    def test_arp_template_patched_per_target(self):
+        probe, arp, icmp = self._prober()
+        targets = ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+        asyncio.run(probe.probe(targets, timeout=0.01))
+        template = bytes(prober.build_arp_template(SRC_MAC, SRC_IP))
+        self.assertEqual([_arp_target(frame) for frame, _ in arp.sent], targets)
+        for frame, _ in arp.sent:
+            # Only the target protocol address differs from the template
+            self.assertEqual(frame[:prober.ARP_TARGET_OFFSET], template[:prober.ARP_TARGET_OFFSET])
+            self.assertEqual(len(frame), len(template))
+        # One prebuilt echo request for every destination
+        self.assertEqual({packet for packet, _ in icmp.sent}, {probe.icmp_packet})
+        self.assertEqual([address for _, address in icmp.sent], [(t, 0) for t in targets])
+
+    def test_replies_matched_to_targets(self):
+        macs = {"192.0.2.1": "00:1b:c5:00:00:01", "192.0.2.2": "52:54:00:ab:cd:ef"}
+
+        def on_arp(frame, _):
+            target = _arp_target(frame)
+            # A reply for an address that was never probed, then the real one
+            yield arp_reply("192.0.2.200", "00:00:5e:00:53:01")
+            if target in macs:
+                yield arp_reply(target, macs[target])
+
+        def on_icmp(_, address):
+            yield icmp_reply(address[0], (probe.identifier + 1) & 0xFFFF)
+            if address[0] in ("192.0.2.2", "192.0.2.3"):
+                yield icmp_reply(address[0], probe.identifier)
+
+        probe, _, _ = self._prober(on_arp, on_icmp)
+        found = asyncio.run(probe.probe(["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"], timeout=0.1))
+        # ICMP-only hosts have no MAC, and an ICMP reply does not erase the ARP one
+        self.assertEqual(found, {"192.0.2.1": "00:1b:c5:00:00:01", "192.0.2.2": "52:54:00:ab:cd:ef", "192.0.2.3": None})
+
+    def test_returns_once_everyone_answered(self):
+        probe, _, _ = self._prober(icmp_responder=lambda _, address: [icmp_reply(address[0], probe.identifier)])
+        start = time.monotonic()
+        found = asyncio.run(probe.probe(["192.0.2.1", "192.0.2.2"], arp=False, timeout=5.0))
+        self.assertEqual(set(found), {"192.0.2.1", "192.0.2.2"})
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_enobufs_backs_off_and_resends(self):
+        probe, _, icmp = self._prober(icmp_responder=lambda _, address: [icmp_reply(address[0], probe.identifier)])
+        icmp.send_errors = [OSError(errno.ENOBUFS, "No buffer space available"), BlockingIOError(), OSError(errno.ENOBUFS, "")]
+        found = asyncio.run(probe.probe(["192.0.2.1"], arp=False, timeout=0.5))
+        self.assertEqual(found, {"192.0.2.1": None})
+        self.assertEqual(len(icmp.sent), 1)
+
+    def test_full_queue_drops_probe(self):
+        probe, _, icmp = self._prober()
+        icmp.send_errors = [OSError(errno.ENOBUFS, "")] * 5
+        with mock.patch.object(prober, "SEND_RETRY_LIMIT", 3):
+            found = asyncio.run(probe.probe(["192.0.2.1", "192.0.2.2"], arp=False, timeout=0.01))
+        self.assertEqual(found, {})
+        # The first probe was dropped after three attempts; the second got through on its third
+        self.assertEqual([address for _, address in icmp.sent], [("192.0.2.2", 0)])
+
+    def test_other_send_errors_raise(self):
+        probe, _, icmp = self._prober()
+        icmp.send_errors = [OSError(errno.EPERM, "Operation not permitted")]
+        with self.assertRaises(PermissionError):
+            asyncio.run(probe.probe(["192.0.2.1"], arp=False, timeout=0.01))
+
+    def test_retries_only_expected_hosts_and_skips_ambiguous_rtts(self):
+        attempts = {}
+
+        def on_icmp(_, address):
+            attempts[address[0]] = attempts.get(address[0], 0) + 1
+            # .1 answers at once, .2 only to its retransmission, .3 never
+            if address[0] == "192.0.2.1" or (address[0] == "192.0.2.2" and attempts[address[0]] == 2):
+                yield icmp_reply(address[0], probe.identifier)
+
+        probe, _, _ = self._prober(icmp_responder=on_icmp, delay=0.01)
+        rtts = []
+        found = asyncio.run(probe.probe(
+            ["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"], arp=False, timeout=0.05, retries=2,
+            expected=["192.0.2.1", "192.0.2.2", "192.0.2.3"], rtts=rtts,
+        ))
+        self.assertEqual(set(found), {"192.0.2.1", "192.0.2.2"})
+        # .4 was not expected, so it is sent once; .3 is sent on every attempt
+        self.assertEqual(attempts, {"192.0.2.1": 1, "192.0.2.2": 2, "192.0.2.3": 3, "192.0.2.4": 1})
+        # Karn: only .1's first-attempt reply is a sample
+        self.assertEqual(len(rtts), 1)
+        self.assertGreaterEqual(rtts[0], 0.01)
+
+    def test_settles_once_expected_hosts_answered(self):
+        probe, _, icmp = self._prober(icmp_responder=lambda _, address: [icmp_reply(address[0], probe.identifier)]
+                                      if address[0] == "192.0.2.1" else [])
+        start = time.monotonic()
+        found = asyncio.run(probe.probe(["192.0.2.1", "192.0.2.2"], arp=False, timeout=5.0, retries=3,
+                                        expected=["192.0.2.1"], settle=0.05))
+        self.assertEqual(set(found), {"192.0.2.1"})
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(len(icmp.sent), 2)
+
+    def test_job_counters_and_cancel(self):
+        job = mock.Mock(replies=0, probes_sent=0)
+        job.should_stop.return_value = False
+        probe, _, _ = self._prober(icmp_responder=lambda _, address: [icmp_reply(address[0], probe.identifier)]
+                                   if address[0] == "192.0.2.1" else [])
+        asyncio.run(probe.probe(["192.0.2.1", "192.0.2.2"], timeout=0.05, job=job))
+        # ARP and ICMP per target
+        self.assertEqual((job.probes_sent, job.replies), (4, 1))
+
+        job.should_stop.return_value = True
+        start = time.monotonic()
+        asyncio.run(probe.probe(["192.0.2.3"], arp=False, timeout=5.0, job=job))
+        self.assertLess(time.monotonic() - start, 1.0)
+
+class RTTEstimatorTest(unittest.TestCase):
+    def test_first_and_later_samples(self):
+        estimator = rtt.RTTEstimator()
+        self.assertEqual(estimator.rto, rtt.INITIAL_RTO)
+        self.assertEqual(estimator.timeout(1.0), 1.0)
+        estimator.update(0.1)
+        self.assertAlmostEqual(estimator.srtt, 0.1)
+        self.assertAlmostEqual(estimator.rttvar, 0.05)
+        estimator.update(0.3)
+        # RTTVAR uses the SRTT from before this sample
+        self.assertAlmostEqual(estimator.rttvar, 0.75 * 0.05 + 0.25 * 0.2)
+        self.assertAlmostEqual(estimator.srtt, 0.875 * 0.1 + 0.125 * 0.3)
+        self.assertAlmostEqual(estimator.rto, estimator.srtt + 4 * estimator.rttvar)
+        self.assertEqual(estimator.timeout(1.0), estimator.rto)
+        self.assertEqual(estimator.samples, 2)
+
+    def test_rto_bounds(self):
+        fast = rtt.RTTEstimator(srtt=0.001, rttvar=0.0, samples=10)
+        self.assertEqual(fast.rto, rtt.MIN_RTO)
+        slow = rtt.RTTEstimator(srtt=3.0, rttvar=1.0, samples=10)
+        self.assertEqual(slow.rto, rtt.MAX_RTO)
+
+    def test_settle_time(self):
+        self.assertEqual(rtt.RTTEstimator().settle_time(), rtt.INITIAL_RTO / 4)
+        # Twice the SRTT, within [MIN_RTO, RTO]
+        self.assertAlmostEqual(rtt.RTTEstimator(srtt=0.1, rttvar=0.05, samples=5).settle_time(), 0.2)
+        self.assertEqual(rtt.RTTEstimator(srtt=0.01, rttvar=0.0, samples=5).settle_time(), rtt.MIN_RTO)
+        self.assertAlmostEqual(rtt.RTTEstimator(srtt=1.0, rttvar=0.0, samples=5).settle_time(), 1.0)
+
+    def test_round_trip_through_columns(self):
+        estimator = rtt.RTTEstimator()
+        estimator.update_many([0.2, 0.25, 0.18])
+        copy = rtt.RTTEstimator(*estimator.as_columns().values())
+        self.assertEqual((copy.srtt, copy.rttvar, copy.samples), (estimator.srtt, estimator.rttvar, 3))
+
+if __name__ == "__main__":
+    unittest.main()
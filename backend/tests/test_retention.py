@@ -0,0 +1,134 @@
+"""
+Runs the retention policies against IPs, services, rollups and sightings in the scratch database.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scratch_db  # noqa: F401 (sets DATABASE_URL)
+
+import models
+import retention
+from database import SessionLocal
+
+NOW = datetime.now(timezone.utc)
+LONG_AGO = NOW - timedelta(days=400)
+
+class RetentionTest(unittest.TestCase):
+    networks = iter(range(1, 255))
+
+    def setUp(self):
+        self.db = SessionLocal()
+        self.net = f"10.49.{next(self.networks)}"
+        self.subnet = models.Subnet(name="retention", network_address=f"{self.net}.0", prefix_length=24)
+        self.db.add(self.subnet)
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def add_ip(self, host: int, status=models.IPStatus.DISCOVERED, last_seen=LONG_AGO, **fields):
+        ip = models.IPAddress(
+            address=f"{self.net}.{host}", subnet_id=self.subnet.id, status=status, last_seen=last_seen,
+            mac_address=f"52:54:00:49:00:{host:02x}", vendor="QEMU", hostname=f"host-{host}", **fields
+        )
+        self.db.add(ip)
+        self.db.flush()
+        return ip
+
+    def add_rollup(self, scope: str, scope_id: int):
+        self.db.add(models.AvailabilityRollup(
+            scope=scope, scope_id=scope_id, period="day", bucket_start=NOW.replace(minute=0, second=0, microsecond=0),
+            online_seconds=0, observed_seconds=3600
+        ))
+
+    def count(self, model, *criteria):
+        return self.db.query(model).filter(*criteria).count()
+
+    def test_purge_discovered_takes_dependents(self):
+        stale = self.add_ip(1)
+        fresh = self.add_ip(2, last_seen=NOW)
+        for ip in (stale, fresh):
+            self.db.add(models.IPEvent(ip_id=ip.id, event_type=models.EventType.DISCOVERED, timestamp=ip.last_seen))
+            self.db.add(models.IPService(ip_id=ip.id, port=22, protocol="tcp", last_seen=ip.last_seen))
+            self.add_rollup("ip", ip.id)
+        # A subnet rollup sharing the purged IP's id is not the IP's
+        self.add_rollup("subnet", stale.id)
+        self.db.commit()
+        stale_id, fresh_id = stale.id, fresh.id
+
+        deleted, batches = retention.purge_discovered(self.db, 30, now=NOW)
+        self.assertEqual((deleted, batches), ({"discovered_ips": 1}, 1))
+        for model in (models.IPEvent, models.IPService):
+            self.assertEqual(self.count(model, model.ip_id == stale_id), 0)
+            self.assertEqual(self.count(model, model.ip_id == fresh_id), 1)
+        rollup = models.AvailabilityRollup
+        self.assertEqual(self.count(rollup, rollup.scope == "ip", rollup.scope_id == stale_id), 0)
+        self.assertEqual(self.count(rollup, rollup.scope == "ip", rollup.scope_id == fresh_id), 1)
+        self.assertEqual(self.count(rollup, rollup.scope == "subnet", rollup.scope_id == stale_id), 1)
+
+    def test_purge_offline_forgets_identities(self):
+        cleared = [self.add_ip(1), self.add_ip(2, status=models.IPStatus.AVAILABLE), self.add_ip(3, status=models.IPStatus.DHCP_POOL)]
+        kept = [
+            self.add_ip(10, status=models.IPStatus.ALLOCATED),
+            self.add_ip(11, status=models.IPStatus.RESERVED),
+            self.add_ip(12, last_seen=NOW),
+            self.add_ip(13, lease_expires=NOW + timedelta(hours=1)),
+            self.add_ip(14, last_seen=None),
+        ]
+        self.db.commit()
+
+        deleted, _ = retention.purge_offline(self.db, 30, now=NOW, batch_size=2)
+        self.assertEqual(deleted["ip_identities"], 3)
+        for ip in cleared:
+            self.db.refresh(ip)
+            self.assertEqual((ip.mac_address, ip.vendor, ip.hostname), (None, None, None))
+        for ip in kept:
+            self.db.refresh(ip)
+            self.assertIsNotNone(ip.mac_address)
+            self.assertEqual(ip.hostname, f"host-{ip.address.rsplit('.', 1)[1]}")
+        # Nothing left to clear
+        self.assertEqual(retention.purge_offline(self.db, 30, now=NOW)[0]["ip_identities"], 0)
+
+    def test_purge_offline_observations(self):
+        offline = self.add_ip(1, status=models.IPStatus.ALLOCATED)
+        online = self.add_ip(2, status=models.IPStatus.ALLOCATED, last_seen=NOW)
+        for ip in (offline, online):
+            self.db.add(models.IPService(ip_id=ip.id, port=22, protocol="tcp", last_seen=None))
+            self.db.add(models.IPService(ip_id=ip.id, port=80, protocol="tcp", last_seen=LONG_AGO))
+            self.db.add(models.IPService(ip_id=ip.id, port=443, protocol="tcp", last_seen=NOW))
+        for host, last_seen in ((1, LONG_AGO), (2, NOW)):
+            self.db.add(models.MACSighting(
+                mac_address=f"52:54:00:49:01:{host:02x}", address=f"{self.net}.{host}", first_seen=LONG_AGO, last_seen=last_seen
+            ))
+            self.db.add(models.IPConflict(kind="duplicate_ip", address=f"{self.net}.{host}", first_seen=LONG_AGO, last_seen=last_seen))
+        self.db.commit()
+        offline_id, online_id = offline.id, online.id
+
+        deleted, _ = retention.purge_offline(self.db, 30, now=NOW)
+        self.assertGreaterEqual(deleted["services"], 3)
+        service = models.IPService
+        remaining = {
+            (row.ip_id, row.port) for row in self.db.query(service).filter(service.ip_id.in_((offline_id, online_id)))
+        }
+        # A service without last_seen stays while its IP is online
+        self.assertEqual(remaining, {(offline_id, 443), (online_id, 22), (online_id, 443)})
+        for model in (models.MACSighting, models.IPConflict):
+            self.assertEqual(self.count(model, model.address == f"{self.net}.1"), 0)
+            self.assertEqual(self.count(model, model.address == f"{self.net}.2"), 1)
+
+    def test_batches(self):
+        for host in range(1, 6):
+            self.add_ip(host)
+        self.db.commit()
+        deleted, batches = retention.delete_in_batches(self.db, models.IPAddress, (
+            models.IPAddress.address.like(f"{self.net}.%"),
+        ), batch_size=2, pause=0)
+        self.assertEqual((deleted, batches), (5, 3))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Builds FTS5 match expressions and ranks device search results in the scratch database.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scratch_db  # noqa: F401 (sets DATABASE_URL)
+from sqlalchemy import insert
+
+import models
+import search
+from database import SessionLocal
+
+class BuildMatchTest(unittest.TestCase):
+    def test_terms(self):
+        self.assertIsNone(search.build_match(" -- "))
+        self.assertEqual(
+            search.build_match("sw-core rack"),
+            '{hostname manufacturer model tags notes} : ("sw core"* OR "sw core") AND '
+            '{hostname manufacturer model tags notes} : ("rack"* OR "rack")'
+        )
+
+    def test_address_terms(self):
+        # A trailing separator ends the term, but an address keeps matching as a prefix
+        self.assertEqual(
+            search.build_match("10.1.2."),
+            '({hostname manufacturer model tags notes} : "10 1 2" OR {macs addresses} : ("10_1_2_"* OR "10_1_2_"))'
+        )
+
+class RankTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db = SessionLocal()
+        try:
+            # Many weak matches first, so the best one has the highest id
+            db.execute(insert(models.Device), [{"hostname": f"filler-{i}", "notes": "rankprobe"} for i in range(2500)])
+            db.commit()
+            cls.weak = [row.id for row in db.query(models.Device.id).filter(models.Device.notes == "rankprobe").order_by(models.Device.id)]
+            best = models.Device(hostname="rankprobe")
+            db.add(best)
+            db.commit()
+            cls.best = best.id
+        finally:
+            db.close()
+
+    def setUp(self):
+        self.db = SessionLocal()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_best_match_beyond_the_oldest_devices(self):
+        ids = search.search_device_ids(self.db, "rankprobe", limit=5)
+        self.assertEqual(ids[0], self.best)
+        # Equal scores keep device id order
+        self.assertEqual(ids[1:], self.weak[:4])
+
+    def test_limit_is_capped(self):
+        self.assertEqual(len(search.search_device_ids(self.db, "rankprobe", limit=1000)), search.MAX_RESULTS)
+        self.assertEqual(search.search_device_ids(self.db, "rankprobe", limit=0), [self.best])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Loads the zone files in tests/fixtures and reconciles them against the scratch database.
+
+    python -m unittest discover -s tests     # from backend/
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scratch_db  # noqa: F401 (sets DATABASE_URL)
+from fastapi.testclient import TestClient
+
+import main
+import models
+import zones
+from database import SessionLocal
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REVERSE = os.path.join(FIXTURES, "db.100.51.198.in-addr.arpa")
+FORWARD = os.path.join(FIXTURES, "example.test.zone")
+
+class SourcesTest(unittest.TestCase):
+    def test_origin_from_filename(self):
+        for path, origin in [
+            ("/etc/bind/db.10.in-addr.arpa", "10.in-addr.arpa"),
+            ("10.in-addr.arpa.zone", "10.in-addr.arpa"),
+            ("example.com.db", "example.com"),
+            ("/var/named/example.com.hosts", "example.com"),
+            ("example.com", "example.com"),
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(zones._origin_from_filename(path), origin)
+
+    def test_parse_sources(self):
+        self.assertEqual(zones.parse_sources(
+            " /etc/bind/db.10.in-addr.arpa, example.com ,10.in-addr.arpa@10.0.0.53:5353,"
+            "example.org@ns1.example.org,ip6.arpa@2001:db8::53,"
+        ), [
+            ("file", "/etc/bind/db.10.in-addr.arpa", None, None),
+            ("axfr", "example.com", None, 53),
+            ("axfr", "10.in-addr.arpa", "10.0.0.53", 5353),
+            ("axfr", "example.org", "ns1.example.org", 53),
+            # Several colons: an IPv6 server on the default port
+            ("axfr", "ip6.arpa", "2001:db8::53", 53),
+        ])
+        self.assertEqual(zones.parse_sources(None), [])
+
+    def test_transfer_needs_a_server(self):
+        data, errors = zones.load_zones(zones.parse_sources("example.com"))
+        self.assertEqual(data.ptr, {})
+        self.assertEqual(len(errors), 1)
+        self.assertIn("No DNS server", errors[0])
+
+class MismatchTest(unittest.TestCase):
+    def test_origins(self):
+        data, errors = zones.load_zones(zones.parse_sources(f"{REVERSE},{FORWARD}"))
+        self.assertEqual(errors, [])
+        self.assertEqual([o.to_text() for o in data.reverse_origins], ["100.51.198.in-addr.arpa."])
+        self.assertEqual([o.to_text() for o in data.forward_origins], ["example.test."])
+        self.assertEqual(data.forward["host1.example.test"], {"198.51.100.1", "2001:db8::1"})
+
+    def test_all_three_kinds(self):
+        data, _ = zones.load_zones(zones.parse_sources(f"{REVERSE},{FORWARD}"))
+        self.assertEqual(data.mismatches(), [
+            {"address": "198.51.100.3", "kind": zones.A_WITHOUT_PTR, "ptr": None, "forward": ["host3.example.test"]},
+            {"address": "198.51.100.5", "kind": zones.PTR_MISMATCH, "ptr": "printer.example.test", "forward": []},
+            {"address": "198.51.100.6", "kind": zones.A_WITHOUT_PTR, "ptr": None, "forward": ["printer.example.test"]},
+            {"address": "198.51.100.7", "kind": zones.PTR_WITHOUT_A, "ptr": "ghost.example.test", "forward": []},
+        ])
+
+    def test_one_side_only(self):
+        # Without the forward zone no PTR lacks an A record; without the reverse zone no A lacks a PTR
+        reverse, _ = zones.load_zones(zones.parse_sources(REVERSE))
+        self.assertEqual(reverse.mismatches(), [])
+        forward, _ = zones.load_zones(zones.parse_sources(FORWARD))
+        self.assertEqual(forward.mismatches(), [])
+
+class ReconcileTest(unittest.TestCase):
+    def setUp(self):
+        client = TestClient(main.app)
+        subnet = client.post("/subnets/", json={"name": "zones", "network_address": "198.51.100.0", "prefix_length": 24}).json()
+        for address, hostname in (("198.51.100.1", "old-name"), ("198.51.100.5", None), ("198.51.100.20", "keep-me")):
+            client.post("/ips/", json={"address": address, "subnet_id": subnet["id"], "hostname": hostname})
+        self.db = SessionLocal()
+
+    def tearDown(self):
+        self.db.close()
+
+    def _hostnames(self):
+        return {
+            ip.address: ip.hostname
+            for ip in self.db.query(models.IPAddress).filter(models.IPAddress.address.like("198.51.100.%"))
+        }
+
+    def test_reconcile(self):
+        sources = zones.parse_sources(f"{REVERSE},{FORWARD},{os.path.join(FIXTURES, 'missing.zone')}")
+        report = zones.reconcile(self.db, sources)
+        self.db.commit()
+        self.assertEqual((report["zones"], report["ptr_records"], report["forward_records"], report["updated"]), (2, 5, 7, 2))
+        self.assertEqual(len(report["errors"]), 1)
+        # PTR records win; an address without one keeps its hostname
+        self.assertEqual(self._hostnames(), {
+            "198.51.100.1": "host1.example.test",
+            "198.51.100.5": "printer.example.test",
+            "198.51.100.20": "keep-me",
+        })
+        events = (
+            self.db.query(models.IPEvent).join(models.IPAddress)
+            .filter(models.IPAddress.address == "198.51.100.1", models.IPEvent.event_type == models.EventType.HOSTNAME_CHANGED)
+            .all()
+        )
+        self.assertEqual([(e.old_value, e.new_value) for e in events], [("old-name", "host1.example.test")])
+
+        # Mismatches point at the stored IP when there is one, and the report is served from the database
+        by_address = {m["address"]: m for m in report["mismatches"]}
+        self.assertIsNotNone(by_address["198.51.100.5"]["ip_id"])
+        self.assertIsNone(by_address["198.51.100.7"]["ip_id"])
+        stored = zones.last_report(self.db)
+        self.assertEqual(stored["mismatches"], report["mismatches"])
+        self.assertEqual(stored["updated"], 2)
+
+        # Nothing left to change on a second run
+        self.assertEqual(zones.reconcile(self.db, sources)["updated"], 0)
+        self.db.commit()
+
+if __name__ == "__main__":
+    unittest.main()
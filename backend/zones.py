@@ -0,0 +1,208 @@
+import argparse
+import ipaddress
+import json
+import logging
+import os
+from datetime import datetime, timezone
+import dns.exception
+import dns.name
+import dns.query
+import dns.rdatatype
+import dns.reversename
+import dns.zone
+import ingest
+import models
+
+logger = logging.getLogger(__name__)
+
+XFR_TIMEOUT = 30
+
+PTR_WITHOUT_A = "ptr_without_a"
+A_WITHOUT_PTR = "a_without_ptr"
+PTR_MISMATCH = "ptr_mismatch"
+
+_REVERSE_ROOTS = (dns.name.from_text("in-addr.arpa."), dns.name.from_text("ip6.arpa."))
+
+# Settings row holding the result of the last reconcile(), served by GET /dns/mismatches on every worker
+REPORT_KEY = "dns_zones_last_report"
+
+def parse_sources(value: str):
+    """
+    Parses the dns_zones setting: comma-separated zone files (absolute paths) or zone names
+    transferred with AXFR, optionally from a given server ("10.in-addr.arpa@10.0.0.53:5353").
+    Returns (kind, zone or path, server, port) tuples.
+    """
+    sources = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith("/"):
+            sources.append(("file", item, None, None))
+            continue
+        zone, _, server = item.partition("@")
+        host, port = server, 53
+        if server.count(":") == 1:
+            host, _, port = server.partition(":")
+            port = int(port)
+        sources.append(("axfr", zone, host or None, port))
+    return sources
+
+def _origin_from_filename(path: str):
+    # db.10.in-addr.arpa, 10.in-addr.arpa.zone, example.com.db -> the zone name; $ORIGIN in the file wins
+    name = os.path.basename(path)
+    for prefix in ("db.",):
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+    for suffix in (".zone", ".db", ".hosts"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+def load_zone(kind: str, target: str, server: str = None, port: int = 53):
+    if kind == "file":
+        return dns.zone.from_file(target, origin=_origin_from_filename(target), relativize=False, check_origin=False)
+    if not server:
+        raise ValueError(f"No DNS server to transfer {target} from (set dns_server or use {target}@server)")
+    return dns.zone.from_xfr(dns.query.xfr(server, target, port=port, lifetime=XFR_TIMEOUT, relativize=False), relativize=False)
+
+def _hostname(name: dns.name.Name):
+    return name.to_text().rstrip(".")
+
+def _address(value: str):
+    # Zone files may spell IPv6 addresses in any form
+    return str(ipaddress.ip_address(value))
+
+class ZoneData:
+    """
+    PTR and A/AAAA records of every loaded zone, indexed both ways, plus the zone
+    origins so a missing counterpart is only reported where we can see that side.
+    """
+
+    def __init__(self):
+        self.ptr = {}        # address -> hostname, as published
+        self.forward = {}    # lowercase hostname -> set of addresses
+        self.reverse_origins = []
+        self.forward_origins = []
+
+    def add_zone(self, zone):
+        origin = zone.origin
+        if any(origin.is_subdomain(root) for root in _REVERSE_ROOTS):
+            self.reverse_origins.append(origin)
+        else:
+            self.forward_origins.append(origin)
+        for name, _, rdata in zone.iterate_rdatas(dns.rdatatype.PTR):
+            try:
+                self.ptr[dns.reversename.to_address(name)] = _hostname(rdata.target)
+            except (dns.exception.SyntaxError, ValueError):
+                continue
+        for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            for name, _, rdata in zone.iterate_rdatas(rdtype):
+                self.forward.setdefault(_hostname(name).lower(), set()).add(_address(rdata.address))
+
+    def covers_forward(self, hostname: str):
+        name = dns.name.from_text(hostname)
+        return any(name.is_subdomain(origin) for origin in self.forward_origins)
+
+    def covers_reverse(self, address: str):
+        name = dns.reversename.from_address(address)
+        return any(name.is_subdomain(origin) for origin in self.reverse_origins)
+
+    def mismatches(self):
+        """
+        Forward/reverse disagreements, one entry per address.
+        """
+        found = {}
+        for address, hostname in self.ptr.items():
+            addresses = self.forward.get(hostname.lower())
+            if addresses is None:
+                if self.covers_forward(hostname):
+                    found[address] = (PTR_WITHOUT_A, hostname)
+            elif address not in addresses:
+                found[address] = (PTR_MISMATCH, hostname)
+        # Several names may point at one address; only the PTR has to agree with one of them
+        for addresses in self.forward.values():
+            for address in addresses:
+                if address not in self.ptr and self.covers_reverse(address):
+                    found[address] = (A_WITHOUT_PTR, None)
+        forward_names = {}
+        for hostname, addresses in self.forward.items():
+            for address in addresses:
+                forward_names.setdefault(address, []).append(hostname)
+        return [
+            {"address": address, "kind": kind, "ptr": ptr, "forward": sorted(forward_names.get(address, []))}
+            for address, (kind, ptr) in sorted(found.items())
+        ]
+
+def load_zones(sources, dns_server: str = None):
+    """
+    Loads every configured zone. A zone that fails to load is logged and skipped so one
+    unreachable server does not stop the others.
+    """
+    data = ZoneData()
+    errors = []
+    default_server = next((s.strip() for s in (dns_server or "").split(",") if s.strip()), None)
+    for kind, target, server, port in sources:
+        try:
+            data.add_zone(load_zone(kind, target, server or default_server, port))
+        except Exception as e:
+            logger.warning(f"Could not load DNS zone {target}: {type(e).__name__}: {e}")
+            errors.append(f"{target}: {e}")
+    return data, errors
+
+def reconcile(db, sources, dns_server: str = None, last_seen_granularity: int = 300):
+    """
+    Diffs the PTR records of the loaded zones against stored hostnames and writes the
+    changes through the ingest pipeline in one batch (bulk update plus HOSTNAME_CHANGED
+    events). Addresses without a PTR record keep their hostname. Also collects
+    forward/reverse mismatches into the report kept for last_report(). The caller commits.
+    """
+    started = datetime.now(timezone.utc)
+    data, errors = load_zones(sources, dns_server)
+    snapshot = ingest.load_snapshot(db)
+    observations = [
+        {"ip": address, "hostname": hostname}
+        for address, hostname in data.ptr.items()
+        if address in snapshot and snapshot[address]["hostname"] != hostname
+    ]
+    stats = ingest.apply_observations(db, observations, snapshot=snapshot, last_seen_granularity=last_seen_granularity)
+
+    mismatches = data.mismatches()
+    for mismatch in mismatches:
+        current = snapshot.get(mismatch["address"])
+        mismatch["ip_id"] = current["id"] if current else None
+    report = {
+        "started": started,
+        "zones": len(sources) - len(errors),
+        "errors": errors,
+        "ptr_records": len(data.ptr),
+        "forward_records": sum(len(addresses) for addresses in data.forward.values()),
+        "updated": stats["updated"],
+        "mismatches": mismatches,
+    }
+    # A bookkeeping row, like the history watermark: the settings cache is not bumped
+    setting = db.query(models.Setting).filter(models.Setting.key == REPORT_KEY).first()
+    if not setting:
+        setting = models.Setting(key=REPORT_KEY, description="Report of the last DNS zone reconciliation")
+        db.add(setting)
+    setting.value = json.dumps(report, default=str)
+    logger.info(f"DNS zones reconciled: {report['ptr_records']} PTR records, {report['updated']} hostnames changed, "
+                f"{len(mismatches)} forward/reverse mismatches")
+    return report
+
+def last_report(db):
+    setting = db.query(models.Setting).filter(models.Setting.key == REPORT_KEY).first()
+    return json.loads(setting.value) if setting and setting.value else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DNS zone tools")
+    parser.add_argument("sources", nargs="+", help="zone files or zone[@server[:port]] names to transfer")
+    parser.add_argument("--server", help="default server for zone transfers")
+    args = parser.parse_args()
+
+    data, errors = load_zones(parse_sources(",".join(args.sources)), args.server)
+    for error in errors:
+        print(f"error\t{error}")
+    print(f"{len(data.ptr)} PTR records, {sum(len(a) for a in data.forward.values())} forward records")
+    for mismatch in data.mismatches():
+        print(f"{mismatch['kind']}\t{mismatch['address']}\t{mismatch['ptr'] or '-'}\t{','.join(mismatch['forward']) or '-'}")